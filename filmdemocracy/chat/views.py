@@ -6,11 +6,11 @@ from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views import generic
 
-from filmdemocracy.democracy.models import Club
 from filmdemocracy.chat.models import ChatClubPost, ChatUsersPost, ChatUsersInfo, ChatClubInfo
 from filmdemocracy.registration.models import User
 
 from filmdemocracy.core.utils import user_is_club_member_check, user_is_club_admin_check, users_know_each_other_check
+from filmdemocracy.core.utils import get_request_club
 from filmdemocracy.core.utils import add_club_context
 
 
@@ -18,12 +18,12 @@ from filmdemocracy.core.utils import add_club_context
 class ChatClubView(UserPassesTestMixin, generic.TemplateView):
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page'] = 'chat'
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         context = add_club_context(context, club)
         posts = ChatClubPost.objects.filter(club=club)
         context['posts'] = posts.order_by('-datetime')[:1000]  # TODO
@@ -32,8 +32,8 @@ class ChatClubView(UserPassesTestMixin, generic.TemplateView):
 
 @login_required
 def post_in_chat_club(request, club_id):
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_member_check(request.user, club=club):
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
         return HttpResponseForbidden()
     post_text = request.POST['text']
     if not post_text.lstrip() == '':
@@ -48,9 +48,9 @@ def post_in_chat_club(request, club_id):
 @login_required
 def delete_chat_club_post(request, club_id, post_id):
     post = get_object_or_404(ChatClubPost, id=post_id)
-    club = get_object_or_404(Club, id=club_id)
+    club = get_request_club(request, club_id)
     if request.user != post.user:
-        if not user_is_club_admin_check(request.user, club=club):
+        if not user_is_club_admin_check(request, club=club):
             return HttpResponseForbidden()
     post.deleted = True
     post.save()
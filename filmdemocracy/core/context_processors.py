@@ -1,25 +1,19 @@
-from filmdemocracy.core.utils import NotificationsHelper
-from filmdemocracy.democracy.models import Club
+from filmdemocracy.core.utils import NotificationsHelper, ClubResolver
 
 
 def notifications(request):
     notifications_helper = NotificationsHelper(request)
     if notifications_helper.check_user_is_anonymous():
         return {}
-    notifications_helper.process_notifications()
-    return {'notifications': {
-        'list': notifications_helper.messages,
-        'unread_count': notifications_helper.unread_count}
-    }
+    return {'notifications': {'unread_count': notifications_helper.get_unread_count()}}
 
 
 def club_context(request):
     if 'club_id' in request.resolver_match.kwargs:
-        club = Club.objects.get(id=request.resolver_match.kwargs['club_id'])
-        if club:
-            return {
-                'club': club,
-                'club_members': club.members.filter(is_active=True),
-                'club_admins': club.admin_members.filter(is_active=True),
-            }
+        club_resolver = ClubResolver.for_request(request, request.resolver_match.kwargs['club_id'])
+        return {
+            'club': club_resolver.club,
+            'club_members': club_resolver.members,
+            'club_admins': club_resolver.admins,
+        }
     return {}
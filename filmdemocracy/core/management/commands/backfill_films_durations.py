@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from filmdemocracy.democracy.models import FilmDb
+from filmdemocracy.democracy.ranking import RankingCache
+
+
+class Command(BaseCommand):
+    help = 'Fills the integer duration column of the films already in the database from their duration string'
+
+    BATCH_SIZE = 2000
+
+    @staticmethod
+    def update_filmdbs(filmdbs):
+        """ Saves the durations and drops the cached rankings that show them, returns the number of films updated """
+        FilmDb.objects.bulk_update(filmdbs, ['duration_mins'])
+        RankingCache.invalidate_filmdbs(filmdb.imdb_id for filmdb in filmdbs)
+        return len(filmdbs)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every film, not only those without duration')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Backfilling films durations:')
+        filmdbs = FilmDb.objects.only('imdb_id', 'duration', 'duration_mins').exclude(duration='')
+        if not options['all']:
+            filmdbs = filmdbs.filter(duration_mins=0)
+        updated_filmdbs = []
+        updated_counter = 0
+        for filmdb in filmdbs.iterator(chunk_size=self.BATCH_SIZE):
+            duration_mins = FilmDb.parse_duration_mins(filmdb.duration)
+            if duration_mins != filmdb.duration_mins:
+                filmdb.duration_mins = duration_mins
+                updated_filmdbs.append(filmdb)
+            if len(updated_filmdbs) >= self.BATCH_SIZE:
+                updated_counter += self.update_filmdbs(updated_filmdbs)
+                updated_filmdbs = []
+        updated_counter += self.update_filmdbs(updated_filmdbs)
+        self.stdout.write(f'  Films updated: {updated_counter}')
+        self.stdout.write(f'  OK')
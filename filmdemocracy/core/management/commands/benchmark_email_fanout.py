@@ -0,0 +1,79 @@
+import time
+from datetime import date
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template import loader
+from django.test import RequestFactory
+
+from filmdemocracy.core.models import OutboxEmail
+from filmdemocracy.core.utils import SpamHelper
+from filmdemocracy.core.outbox import OutboxSender
+from filmdemocracy.registration.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measures the fan-out of a meeting email to many recipients against the locmem email backend'
+
+    LOCMEM_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    subject_template = 'democracy/emails/meetings_new_subject.txt'
+    email_template = 'democracy/emails/meetings_new_email.html'
+    html_email_template = 'democracy/emails/meetings_new_email_html.html'
+
+    def get_spam_helper(self):
+        request = RequestFactory().get('/')
+        request.user = User(username='benchmark', email='benchmark@filmdemocracy.com')
+        return SpamHelper(request, self.subject_template, self.email_template, self.html_email_template)
+
+    @staticmethod
+    def get_email_context(spam_helper):
+        return {
+            'organizer': spam_helper.request.user,
+            'club': {'id': '000000', 'name': 'benchmark'},
+            'name': 'benchmark meeting',
+            'description': 'benchmark meeting description',
+            'place': 'benchmark place',
+            'date': date.today(),
+            'time_start': None,
+        }
+
+    def send_per_recipient(self, spam_helper, email_context, recipients_substitutions):
+        """ The former delivery: templates rendered and a connection opened for each recipient """
+        for to_email, substitutions in recipients_substitutions.items():
+            context = {**spam_helper.default_context, **email_context, **substitutions}
+            subject = ''.join(loader.render_to_string(self.subject_template, context).splitlines())
+            body = loader.render_to_string(self.email_template, context)
+            email_message = EmailMultiAlternatives(subject, body, spam_helper.from_email, [to_email],
+                                                   connection=get_connection(self.LOCMEM_BACKEND))
+            email_message.attach_alternative(loader.render_to_string(self.html_email_template, context), 'text/html')
+            email_message.send()
+
+    def send_render_once(self, spam_helper, email_context, recipients_substitutions):
+        spam_helper.queue_emails(list(recipients_substitutions), email_context, recipients_substitutions)
+        OutboxSender(batch_size=len(recipients_substitutions), backend=self.LOCMEM_BACKEND).send_pending()
+
+    def time_fanout(self, send_function, *args):
+        start = time.perf_counter()
+        send_function(*args)
+        return (time.perf_counter() - start) * 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000, help='Number of recipients of the email')
+
+    def handle(self, *args, **options):
+        n_recipients = options['recipients']
+        self.stdout.write(f'Benchmarking email fan-out to {n_recipients} recipients (nothing is kept in the database):')
+        spam_helper = self.get_spam_helper()
+        email_context = self.get_email_context(spam_helper)
+        recipients_substitutions = {f'member{i}@filmdemocracy.com': {'recipient_name': f'member{i}'}
+                                    for i in range(n_recipients)}
+        per_recipient_ms = self.time_fanout(self.send_per_recipient, spam_helper, email_context, recipients_substitutions)
+        self.stdout.write(f'  Render and send per recipient: {per_recipient_ms:.0f} ms')
+        with transaction.atomic():
+            render_once_ms = self.time_fanout(self.send_render_once, spam_helper, email_context, recipients_substitutions)
+            sent_count = OutboxEmail.objects.filter(status=OutboxEmail.SENT).count()
+            transaction.set_rollback(True)
+        self.stdout.write(f'  Render once, queue and send through one connection: {render_once_ms:.0f} ms '
+                          f'({sent_count} emails sent)')
+        self.stdout.write(f'  OK')
@@ -0,0 +1,56 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from filmdemocracy.core.search import iter_synthetic_films_rows, search_filmdbs
+from filmdemocracy.democracy.models import FilmDb
+
+
+class Command(BaseCommand):
+    help = 'Compares the films autocomplete search with the former title__icontains scan on a synthetic catalogue'
+
+    QUERIES = ['mem', 'memento', 'dark night', 'the last', 'shadw', 'odyssey 1968', 'year:2001 king',
+               'storm director:kurosawa', 'xqzv']
+    BENCHMARK_IMDB_ID_OFFSET = 90000000
+
+    def create_catalogue(self, size):
+        existing = FilmDb.objects.count()
+        filmdbs = []
+        films_rows = iter_synthetic_films_rows(size, imdb_id_offset=self.BENCHMARK_IMDB_ID_OFFSET)
+        for imdb_id, title, year, director in islice(films_rows, existing, None):
+            filmdbs.append(FilmDb(imdb_id=imdb_id, title=title, year=year, director=director))
+            if len(filmdbs) == 5000:
+                FilmDb.objects.bulk_create(filmdbs, ignore_conflicts=True)
+                filmdbs = []
+        FilmDb.objects.bulk_create(filmdbs, ignore_conflicts=True)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {FilmDb._meta.db_table}')
+
+    @staticmethod
+    def time_query(queryset, page_size, repetitions):
+        """ Like the autocomplete view: counts the results and fetches the first page """
+        start = time.perf_counter()
+        for i in range(repetitions):
+            queryset.count()
+            list(queryset[0:page_size])
+        return (time.perf_counter() - start) / repetitions * 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=500000, help='Number of films in the synthetic catalogue')
+        parser.add_argument('--repetitions', type=int, default=5, help='Times each query is run')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Benchmarking films search on {options["size"]} films (nothing is kept in the database):')
+        with transaction.atomic():
+            self.create_catalogue(options['size'])
+            for query in self.QUERIES:
+                icontains_ms = self.time_query(FilmDb.objects.filter(title__icontains=query), 10, options['repetitions'])
+                search_ms = self.time_query(search_filmdbs(query), 10, options['repetitions'])
+                top_titles = [f'{filmdb.title} ({filmdb.year})' for filmdb in search_filmdbs(query)[0:3]]
+                self.stdout.write(f'  {query!r:>26}: icontains {icontains_ms:8.1f} ms, search {search_ms:8.1f} ms, '
+                                  f'top results: {top_titles}')
+            transaction.set_rollback(True)
+        self.stdout.write(f'  OK')
@@ -0,0 +1,39 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from filmdemocracy.core.search import FilmSearchIndex, iter_synthetic_films_rows
+
+
+class Command(BaseCommand):
+    help = 'Measures the memory, build time and lookup latency of the in-process films search index'
+
+    QUERIES = ['m', 'mem', 'memento', 'dark night', 'the last', 'ODYSSEY 1968', 'year:2001 king',
+               'storm director:kurosawa', 'xqzv']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 500000],
+                            help='Numbers of films indexed')
+        parser.add_argument('--repetitions', type=int, default=20, help='Times each query is run')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Benchmarking the in-process films search index (synthetic films, no database):')
+        for size in options['sizes']:
+            films_rows = list(iter_synthetic_films_rows(size))
+            tracemalloc.start()
+            start = time.perf_counter()
+            film_search_index = FilmSearchIndex()
+            film_search_index.add_films(films_rows)
+            build_secs = time.perf_counter() - start
+            index_mb = tracemalloc.get_traced_memory()[0] / 1024 ** 2
+            tracemalloc.stop()
+            self.stdout.write(f'  {size} films: built in {build_secs:.2f} s, {index_mb:.1f} MB '
+                              f'({index_mb / size * 100000:.1f} MB per 100k films)')
+            for query in self.QUERIES:
+                start = time.perf_counter()
+                for i in range(options['repetitions']):
+                    imdb_ids = film_search_index.search(query, limit=100)
+                query_ms = (time.perf_counter() - start) / options['repetitions'] * 1000
+                self.stdout.write(f'    {query!r:>26}: {query_ms:7.2f} ms, {len(imdb_ids)} results')
+        self.stdout.write(f'  OK')
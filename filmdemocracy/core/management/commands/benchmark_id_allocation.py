@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from filmdemocracy.core.utils import random_club_id_generator, random_film_public_id_generator
+from filmdemocracy.democracy.models import Club, FilmDb, Film
+
+
+class Command(BaseCommand):
+    help = 'Measures the cost of allocating club ids and film public ids as the number of existing ones grows'
+
+    BENCHMARK_CLUB_ID = '000000'
+    BENCHMARK_IMDB_ID = '00000000'
+
+    @staticmethod
+    def time_allocations(id_generator, n_allocations):
+        start = time.perf_counter()
+        for i in range(n_allocations):
+            id_generator()
+        return (time.perf_counter() - start) / n_allocations * 1000
+
+    def run_benchmark(self, sizes, n_allocations):
+        benchmark_club = Club.objects.create(id=self.BENCHMARK_CLUB_ID, name='benchmark', short_description='')
+        filmdb = FilmDb.objects.create(imdb_id=self.BENCHMARK_IMDB_ID, title='benchmark')
+        existing = 0
+        for size in sorted(sizes):
+            new_ids = range(100000 + existing, 100000 + size)
+            Club.objects.bulk_create([Club(id=str(i), name='benchmark', short_description='') for i in new_ids], ignore_conflicts=True)
+            Film.objects.bulk_create([Film(public_id=str(i), club=benchmark_club, db=filmdb) for i in new_ids], ignore_conflicts=True)
+            existing = max(existing, size)
+            club_ms = self.time_allocations(random_club_id_generator, n_allocations)
+            film_ms = self.time_allocations(lambda: random_film_public_id_generator(benchmark_club), n_allocations)
+            self.stdout.write(f'  {size:>8} existing ids: club id {club_ms:.3f} ms, film public id {film_ms:.3f} ms')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[0, 1000, 10000, 100000],
+                            help='Numbers of existing clubs and films to measure')
+        parser.add_argument('--allocations', type=int, default=100, help='Allocations timed for each size')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Benchmarking id allocation (nothing is kept in the database):')
+        with transaction.atomic():
+            self.run_benchmark(options['sizes'], options['allocations'])
+            transaction.set_rollback(True)
+        self.stdout.write(f'  OK')
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from filmdemocracy.core.search import FilmSearchIndex
+
+
+class Command(BaseCommand):
+    help = 'Writes the snapshot file the in-process films search index is loaded from at startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.FILM_SEARCH_INDEX_SNAPSHOT, help='Path of the snapshot file')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Writing films search index snapshot to: {options["output"]}')
+        films_count = FilmSearchIndex().save_snapshot(options['output'])
+        self.stdout.write(f'  Films in snapshot: {films_count}')
+        self.stdout.write(f'  OK')
@@ -10,7 +10,8 @@ from django.utils import timezone
 from django.core.management.base import BaseCommand, CommandError
 import django.db.utils
 
-from filmdemocracy.core.utils import random_club_id_generator, random_film_public_id_generator
+from filmdemocracy.core.utils import create_club_with_random_id, create_film_with_random_public_id
+from filmdemocracy.democracy.ranking import rebuild_film_vote_tally
 from filmdemocracy.registration.models import User
 from filmdemocracy.democracy import forms
 from filmdemocracy.core.models import Notification
@@ -72,10 +73,9 @@ class Command(BaseCommand):
         for filmdb in filmsdbs:
             if random.random() < 0.8:
                 random_member = random.choice(club_members)
-                film = Film.objects.create(
-                    public_id=random_film_public_id_generator(club),
+                film = create_film_with_random_public_id(
+                    club,
                     proposed_by=random_member,
-                    club=club,
                     db=filmdb,
                 )
                 notif_members = club.members.filter(is_active=True).exclude(id=random_member.id)
@@ -98,6 +98,7 @@ class Command(BaseCommand):
                         club=club,
                         choice=random.choice([Vote.OMG, Vote.YES, Vote.SEENOK, Vote.MEH, Vote.NO, Vote.SEENNO, Vote.VETO])
                     )
+            rebuild_film_vote_tally(film)
 
     @staticmethod
     def add_meetings_to_club(club):
@@ -170,8 +171,7 @@ class Command(BaseCommand):
 
         for i, club_name in enumerate(CLUB_NAMES):
             self.stdout.write(f'  Creating club: {club_name}')
-            club = Club.objects.create(
-                id=random_club_id_generator(),
+            club = create_club_with_random_id(
                 founder=user_creators[i],
                 name=CLUB_NAMES[i],
                 short_description=LORE_100,
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from filmdemocracy.democracy.models import FilmDb
+
+
+class Command(BaseCommand):
+    help = 'Enables pg_trgm and creates the trigram indexes used by the films search (PostgreSQL only)'
+
+    # (index suffix, field, indexed expression): UPPER(column::text) is what the icontains/istartswith lookups
+    # compare, while the trigram similarity lookup (%) compares the bare column
+    TRIGRAM_INDEXES = [
+        ('upper_trgm', 'title', 'UPPER({column}::text)'),
+        ('trgm', 'title', '{column}'),
+        ('upper_trgm', 'director', 'UPPER({column}::text)'),
+    ]
+
+    @staticmethod
+    def get_index_name(index_suffix, field_name):
+        return f'{FilmDb._meta.db_table}_{FilmDb._meta.get_field(field_name).column}_{index_suffix}'
+
+    def get_index_sql(self, index_suffix, field_name, expression):
+        table = FilmDb._meta.db_table
+        column = FilmDb._meta.get_field(field_name).column
+        return (f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.get_index_name(index_suffix, field_name)} '
+                f'ON {table} USING gin (({expression.format(column=column)}) gin_trgm_ops)')
+
+    @staticmethod
+    def drop_invalid_index(cursor, index_name):
+        """ An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index that IF NOT EXISTS would keep """
+        cursor.execute('SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', [index_name])
+        row = cursor.fetchone()
+        if row and row[0]:
+            cursor.execute(f'DROP INDEX CONCURRENTLY {index_name}')
+            return True
+        return False
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(f'Search indexes are only created in PostgreSQL, skipping ({connection.vendor})')
+            return
+        if connection.in_atomic_block:
+            raise CommandError('The search indexes are created CONCURRENTLY, which cannot run inside a transaction')
+        self.stdout.write(f'Creating films search indexes:')
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for index_suffix, field_name, expression in self.TRIGRAM_INDEXES:
+                self.stdout.write(f'  Trigram index on FilmDb.{field_name}: {expression.format(column=field_name)}')
+                index_name = self.get_index_name(index_suffix, field_name)
+                if self.drop_invalid_index(cursor, index_name):
+                    self.stdout.write(f'  Dropped invalid index left by an interrupted run: {index_name}')
+                cursor.execute(self.get_index_sql(index_suffix, field_name, expression))
+        self.stdout.write(f'  OK')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from filmdemocracy.core.utils import random_film_public_id_generator
+from filmdemocracy.democracy.models import Film
+
+
+class Command(BaseCommand):
+    help = ('Gives a new public id to the films sharing their public id with an older film of the same club, '
+            'which the unique_film_public_id_in_club constraint rejects. To be run before migrate')
+
+    @staticmethod
+    def get_duplicated_public_ids():
+        return Film.objects.values_list('club_id', 'public_id').annotate(
+            films_count=Count('id')
+        ).filter(films_count__gt=1).order_by()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report the duplicated public ids')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Checking duplicated film public ids:')
+        if Film._meta.db_table not in connection.introspection.table_names():
+            self.stdout.write(f'  No films table yet, skipping')
+            return
+        duplicated_public_ids = list(self.get_duplicated_public_ids())
+        self.stdout.write(f'  Duplicated public ids: {len(duplicated_public_ids)}')
+        if options['check']:
+            if duplicated_public_ids:
+                raise CommandError(f'{len(duplicated_public_ids)} duplicated film public ids found')
+            self.stdout.write(f'  OK')
+            return
+        with transaction.atomic():
+            for club_id, public_id, films_count in duplicated_public_ids:
+                # Only the columns existing before the migrations are read, the oldest film keeps its public id
+                films = Film.objects.only('id', 'club_id', 'public_id').filter(club_id=club_id, public_id=public_id)
+                for film in films.order_by('created_datetime')[1:]:
+                    new_public_id = random_film_public_id_generator(club_id)
+                    Film.objects.filter(id=film.id).update(public_id=new_public_id)
+                    self.stdout.write(f'  Film {film.id} of club {club_id}: public id {public_id} -> {new_public_id}')
+        self.stdout.write(f'  OK')
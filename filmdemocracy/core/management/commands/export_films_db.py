@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from filmdemocracy.core.omdb import FILMDB_OMDB_FIELDS, omdb_film_json, open_films_dump
+from filmdemocracy.democracy.models import FilmDb
+
+
+class Command(BaseCommand):
+    help = 'Exports the films database to a JSON Lines dump (.jsonl, .jsonl.gz or .jsonl.zst) readable by feed_db_with_films'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the dump, compressed according to its extension')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Films fetched from the database at once')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Exporting films database to: {options["output"]}')
+        filmdbs_fields = FilmDb.objects.order_by('imdb_id').values('imdb_id', *FILMDB_OMDB_FIELDS)
+        exported_count = 0
+        with open_films_dump(options['output'], 'w') as dump:
+            for filmdb_fields in filmdbs_fields.iterator(chunk_size=options['chunk_size']):
+                dump.write(json.dumps(omdb_film_json(filmdb_fields)) + '\n')
+                exported_count += 1
+        self.stdout.write(f'  Films exported: {exported_count}')
+        self.stdout.write(f'  OK')
@@ -1,15 +1,29 @@
 import json
 import glob
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pprint import pprint
 import ntpath
 
 from django.core.management.base import BaseCommand, CommandError
 import django.db.utils
 
+from filmdemocracy.core.omdb import open_films_dump, parse_omdb_film_json
 from filmdemocracy.democracy.models import FilmDb
 
 
+def parse_film_json_file(file_path):
+    """ Runs in the worker processes: returns the FilmDb fields of the film json, or None if it is not valid """
+    try:
+        film_json_id = os.path.splitext(ntpath.basename(file_path))[0]
+        with open(file_path) as json_file:
+            film_json = json.load(json_file)
+    except (OSError, ValueError):
+        return None
+    return parse_omdb_film_json(film_json_id, film_json)
+
+
 class Command(BaseCommand):
     help = 'Feeds the database with the films jsons located in /local'
 
@@ -26,28 +40,13 @@ class Command(BaseCommand):
 
     @staticmethod
     def update_filmdb_info(film_json_id, film_json):
-        filmdb, created = FilmDb.objects.get_or_create(imdb_id=str(film_json_id).zfill(8))
-        if created:
-            try:
-                filmdb.title = film_json['Title']
-                filmdb.imdb_rating = film_json['imdbRating']
-                filmdb.metascore = film_json['Metascore']
-                filmdb.year = int(film_json['Year'][0:4])
-                filmdb.director = film_json['Director']
-                filmdb.writer = film_json['Writer']
-                filmdb.actors = film_json['Actors']
-                filmdb.poster_url = film_json['Poster']
-                filmdb.duration = film_json['Runtime']
-                filmdb.language = film_json['Language']
-                filmdb.rated = film_json['Rated']
-                filmdb.country = film_json['Country']
-                filmdb.plot = film_json['Plot']
-                filmdb.save()
-            except KeyError:
-                filmdb.delete()
-            except django.db.utils.DataError:
-                pprint(film_json)
-                filmdb.delete()
+        filmdb_fields = parse_omdb_film_json(film_json_id, film_json)
+        if filmdb_fields is None:
+            return
+        try:
+            FilmDb.objects.get_or_create(imdb_id=filmdb_fields.pop('imdb_id'), defaults=filmdb_fields)
+        except django.db.utils.DataError:
+            pprint(film_json)
 
     def process_films_jsons(self, test=False):
         if test:
@@ -62,10 +61,153 @@ class Command(BaseCommand):
             film_json_id, film_json = self.load_film_json(film_json_file)
             self.update_filmdb_info(film_json_id, film_json)
 
+    @staticmethod
+    def get_fields_max_lengths():
+        return {field.name: field.max_length for field in FilmDb._meta.get_fields() if getattr(field, 'max_length', None)}
+
+    @staticmethod
+    def validate_filmdb_fields(filmdb_fields, fields_max_lengths):
+        return filmdb_fields is not None and all(
+            len(str(filmdb_fields[field])) <= max_length
+            for field, max_length in fields_max_lengths.items() if field in filmdb_fields
+        )
+
+    @staticmethod
+    def load_checkpoint(checkpoint_file):
+        try:
+            with open(checkpoint_file) as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def save_checkpoint(checkpoint_file, checkpoint):
+        tmp_checkpoint_file = f'{checkpoint_file}.tmp'
+        with open(tmp_checkpoint_file, 'w') as json_file:
+            json.dump(checkpoint, json_file)
+        os.replace(tmp_checkpoint_file, checkpoint_file)
+
+    @staticmethod
+    def insert_filmdbs(filmdbs_fields):
+        """ Films already in the database are left untouched, like in the one by one mode """
+        FilmDb.objects.bulk_create([FilmDb(**filmdb_fields) for filmdb_fields in filmdbs_fields], ignore_conflicts=True)
+
+    @staticmethod
+    def submit_window(executor, window_files):
+        return executor.map(parse_film_json_file, window_files, chunksize=256)
+
+    def bulk_process_films_jsons(self, films_jsons_dir, workers, chunk_size, checkpoint_file=None):
+        """
+        Parses the film jsons in a pool of processes and inserts them in chunks. The files are submitted to the pool
+        in windows of chunk_size files, the next window being parsed while the current one is inserted, so that at
+        most two windows of parsed films are held in memory. After each window the last file inserted is written
+        to the checkpoint file, so that an interrupted run resumes after it.
+        """
+        self.stdout.write(f'  Checking film jsons in directory: {films_jsons_dir}')
+        films_jsons_files = sorted(glob.glob(os.path.join(films_jsons_dir, '*.json')))
+        self.stdout.write(f'  Number of film jsons detected: {len(films_jsons_files)}')
+        last_file = self.load_checkpoint(checkpoint_file).get('last_file') if checkpoint_file else None
+        if last_file:
+            films_jsons_files = [file_path for file_path in films_jsons_files if file_path > last_file]
+            self.stdout.write(f'  Resuming after checkpoint: {last_file} ({len(films_jsons_files)} films jsons left)')
+        windows_files = [films_jsons_files[i:i + chunk_size] for i in range(0, len(films_jsons_files), chunk_size)]
+        fields_max_lengths = self.get_fields_max_lengths()
+        start = time.perf_counter()
+        processed_count = invalid_count = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            next_parsed_films = self.submit_window(executor, windows_files[0]) if windows_files else None
+            for i, window_files in enumerate(windows_files):
+                parsed_films = next_parsed_films
+                if i + 1 < len(windows_files):
+                    next_parsed_films = self.submit_window(executor, windows_files[i + 1])
+                chunk = []
+                for filmdb_fields in parsed_films:
+                    processed_count += 1
+                    if self.validate_filmdb_fields(filmdb_fields, fields_max_lengths):
+                        chunk.append(filmdb_fields)
+                    else:
+                        invalid_count += 1
+                self.insert_filmdbs(chunk)
+                if checkpoint_file:
+                    self.save_checkpoint(checkpoint_file, {'last_file': window_files[-1]})
+                films_per_sec = processed_count / (time.perf_counter() - start)
+                self.stdout.write(f'  {processed_count}/{len(films_jsons_files)} film jsons processed, '
+                                  f'{invalid_count} invalid ({films_per_sec:.0f} films/s)')
+
+    @staticmethod
+    def iter_dump_films(dump_file, skip_lines=0):
+        """ Streams the FilmDb fields of the films in a JSON Lines dump (None for the invalid ones) """
+        with open_films_dump(dump_file) as dump:
+            for line_number, line in enumerate(dump, start=1):
+                if line_number <= skip_lines or not line.strip():
+                    continue
+                try:
+                    film_json = json.loads(line)
+                    yield line_number, parse_omdb_film_json(film_json['imdbID'], film_json)
+                except (ValueError, KeyError, TypeError):
+                    yield line_number, None
+
+    def process_films_dump(self, dump_file, chunk_size, checkpoint_file=None):
+        """
+        Inserts the films of a .jsonl, .jsonl.gz or .jsonl.zst dump in chunks, keeping only one chunk in memory.
+        After each chunk the last line inserted is written to the checkpoint file, so that an interrupted run
+        resumes after it.
+        """
+        self.stdout.write(f'  Processing films dump: {dump_file}')
+        checkpoint = self.load_checkpoint(checkpoint_file) if checkpoint_file else {}
+        skip_lines = checkpoint.get('last_line', 0) if checkpoint.get('dump_file') == dump_file else 0
+        if skip_lines:
+            self.stdout.write(f'  Resuming after checkpoint: line {skip_lines}')
+        fields_max_lengths = self.get_fields_max_lengths()
+        start = time.perf_counter()
+        processed_count = invalid_count = 0
+        chunk = []
+        line_number = skip_lines
+        for line_number, filmdb_fields in self.iter_dump_films(dump_file, skip_lines):
+            processed_count += 1
+            if self.validate_filmdb_fields(filmdb_fields, fields_max_lengths):
+                chunk.append(filmdb_fields)
+            else:
+                invalid_count += 1
+            if len(chunk) >= chunk_size:
+                self.insert_filmdbs(chunk)
+                chunk = []
+                if checkpoint_file:
+                    self.save_checkpoint(checkpoint_file, {'dump_file': dump_file, 'last_line': line_number})
+                films_per_sec = processed_count / (time.perf_counter() - start)
+                self.stdout.write(f'  {processed_count} films processed, {invalid_count} invalid ({films_per_sec:.0f} films/s)')
+        self.insert_filmdbs(chunk)
+        if checkpoint_file:
+            self.save_checkpoint(checkpoint_file, {'dump_file': dump_file, 'last_line': line_number})
+        self.stdout.write(f'  {processed_count} films processed, {invalid_count} invalid')
+
+    def get_dumps_files(self):
+        dumps_files = []
+        for extension in ['*.jsonl', '*.jsonl.gz', '*.jsonl.zst']:
+            dumps_files += glob.glob(os.path.join(self.FILMS_JSONS_DUMPS_DIR, extension))
+        return sorted(dumps_files)
+
     def add_arguments(self, parser):
         parser.add_argument('--test', action='store_true', help='Feed only test films')
+        parser.add_argument('--bulk', action='store_true',
+                            help='Parse the jsons in parallel and insert them in chunks (new films only)')
+        parser.add_argument('--workers', type=int, default=None, help='Parsing processes in --bulk mode')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Films parsed and inserted per chunk in --bulk and dumps modes')
+        parser.add_argument('--dump', default=None, help='Feed the films of a .jsonl, .jsonl.gz or .jsonl.zst dump')
+        parser.add_argument('--dumps', action='store_true', help='Feed all the films dumps in FILMS_JSONS_DUMPS_DIR')
+        parser.add_argument('--checkpoint-file', default=None,
+                            help='File to record the progress of --bulk and dumps modes and resume from it')
 
     def handle(self, *args, **options):
         self.stdout.write(f'Feeding local film jsons to database:')
-        self.process_films_jsons(options['test'])
+        if options['dump'] or options['dumps']:
+            dumps_files = [options['dump']] if options['dump'] else self.get_dumps_files()
+            for dump_file in dumps_files:
+                self.process_films_dump(dump_file, options['chunk_size'], options['checkpoint_file'])
+        elif options['bulk']:
+            films_jsons_dir = self.FILMS_JSONS_TEST_DIR if options['test'] else self.FILMS_JSONS_TMP_DIR
+            self.bulk_process_films_jsons(films_jsons_dir, options['workers'], options['chunk_size'],
+                                          options['checkpoint_file'])
+        else:
+            self.process_films_jsons(options['test'])
         self.stdout.write(f'  OK')
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from filmdemocracy.democracy.ranking import get_vote_tally_fields
+from filmdemocracy.democracy.models import Film, FilmVoteTally, Vote
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the films vote tallies from the registered votes and verifies them'
+
+    @staticmethod
+    def get_expected_tallies():
+        films_choices_counts = {film_id: {} for film_id in Film.objects.values_list('id', flat=True)}
+        votes_counts = Vote.objects.values_list('film_id', 'choice').annotate(Count('id')).order_by()
+        for film_id, choice, count in votes_counts:
+            films_choices_counts[film_id][choice] = count
+        return {film_id: get_vote_tally_fields(choices_counts) for film_id, choices_counts in films_choices_counts.items()}
+
+    def rebuild_tallies(self):
+        """
+        Counts the votes and replaces the tallies in one transaction, holding the lock of every film row like
+        rebuild_film_vote_tally does for one film, so that no tally increment is lost in between
+        """
+        with transaction.atomic():
+            list(Film.objects.select_for_update().order_by('pk').values_list('pk'))
+            expected_tallies = self.get_expected_tallies()
+            FilmVoteTally.objects.all().delete()
+            FilmVoteTally.objects.bulk_create(
+                [FilmVoteTally(film_id=film_id, **tally_fields) for film_id, tally_fields in expected_tallies.items()],
+                batch_size=1000,
+            )
+        return expected_tallies
+
+    def verify_tallies(self, expected_tallies):
+        empty_tally = get_vote_tally_fields({})
+        current_tallies = {tally['film_id']: tally for tally in FilmVoteTally.objects.values('film_id', *empty_tally)}
+        wrong_tallies = 0
+        for film_id, tally_fields in expected_tallies.items():
+            # Films never voted since the last rebuild may have no tally yet, which stands for an empty one
+            current_tally = current_tallies.get(film_id, empty_tally)
+            if any(current_tally[field] != value for field, value in tally_fields.items()):
+                self.stdout.write(f'  Wrong tally for film: {film_id}')
+                wrong_tallies += 1
+        return wrong_tallies
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only verify the tallies, without rebuilding them')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            expected_tallies = self.get_expected_tallies()
+        else:
+            self.stdout.write(f'Rebuilding vote tallies...')
+            expected_tallies = self.rebuild_tallies()
+            self.stdout.write(f'  Films: {len(expected_tallies)}')
+        self.stdout.write(f'Verifying vote tallies...')
+        wrong_tallies = self.verify_tallies(expected_tallies)
+        if wrong_tallies:
+            raise CommandError(f'{wrong_tallies} wrong vote tallies found')
+        self.stdout.write(f'  OK')
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from filmdemocracy.core.omdb import OmdbClient, get_updatable_filmdbs
+
+
+class Command(BaseCommand):
+    help = 'Refreshes from OMDb the stale films of the database (see FilmDb.updatable), active candidates first'
+
+    def refresh_updatable_films(self, omdb_client, batch_size, limit=None, only_candidates=False):
+        updatable_filmdbs = get_updatable_filmdbs()
+        if only_candidates:
+            updatable_filmdbs = updatable_filmdbs.filter(is_active_candidate=True)
+        imdb_ids = list(updatable_filmdbs.values_list('imdb_id', flat=True)[0:limit])
+        self.stdout.write(f'  Stale films to refresh: {len(imdb_ids)}')
+        start = time.perf_counter()
+        refreshed_count = 0
+        for batch_start in range(0, len(imdb_ids), batch_size):
+            batch_imdb_ids = imdb_ids[batch_start:batch_start + batch_size]
+            refreshed_count += len(omdb_client.refresh_many(batch_imdb_ids, use_cache=False))
+            processed_count = batch_start + len(batch_imdb_ids)
+            elapsed = time.perf_counter() - start
+            films_per_sec = processed_count / elapsed if elapsed else 0
+            eta = (len(imdb_ids) - processed_count) / films_per_sec if films_per_sec else 0
+            self.stdout.write(f'  {processed_count}/{len(imdb_ids)} films processed, {refreshed_count} refreshed '
+                              f'({films_per_sec:.1f} films/s, ETA {eta:.0f} s)')
+        return refreshed_count, len(imdb_ids) - refreshed_count
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Films refreshed in each batch')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent requests to OMDb')
+        parser.add_argument('--requests-per-second', type=float, default=None, help='OMDb rate limit')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of films refreshed in each run')
+        parser.add_argument('--only-candidates', action='store_true',
+                            help='Only refresh the films that are candidates in active clubs')
+        parser.add_argument('--loop', action='store_true', help='Keep refreshing periodically instead of exiting')
+        parser.add_argument('--interval', type=int, default=3600, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        omdb_client = OmdbClient(max_workers=options['concurrency'],
+                                 requests_per_second=options['requests_per_second'])
+        while True:
+            self.stdout.write(f'Refreshing stale films from OMDb...')
+            refreshed_count, failed_count = self.refresh_updatable_films(
+                omdb_client, options['batch_size'], options['limit'], options['only_candidates']
+            )
+            self.stdout.write(f'  Films refreshed: {refreshed_count}, not refreshed: {failed_count}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(f'  OK')
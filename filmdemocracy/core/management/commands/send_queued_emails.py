@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from filmdemocracy.core.outbox import OutboxSender
+
+
+class Command(BaseCommand):
+    help = 'Sends the emails queued in the outbox, retrying the failed deliveries with exponential backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails sent through each connection')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Attempts before marking an email as failed')
+        parser.add_argument('--retry-delay', type=int, default=60, help='Seconds before the first retry')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting when empty')
+        parser.add_argument('--poll-interval', type=int, default=10, help='Seconds between outbox polls with --loop')
+
+    def handle(self, *args, **options):
+        outbox_sender = OutboxSender(
+            batch_size=options['batch_size'],
+            max_attempts=options['max_attempts'],
+            retry_delay_secs=options['retry_delay'],
+        )
+        while True:
+            sent_count, failed_count = outbox_sender.send_pending()
+            if sent_count or failed_count or not options['loop']:
+                self.stdout.write(f'Outbox emails sent: {sent_count}, failed attempts: {failed_count}')
+            if not options['loop']:
+                break
+            time.sleep(options['poll_interval'])
+        self.stdout.write(f'  OK')
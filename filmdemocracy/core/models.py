@@ -1,11 +1,64 @@
 import uuid
 
+from django.core.cache import cache
 from django.db import models
+from django.utils import timezone
 
 from filmdemocracy.registration.models import User
 from filmdemocracy.democracy.models import Club
 
 
+class UnreadNotificationsCounter:
+    """
+    Per-user cache of the unread notifications count shown in the navbar. The count is the one of the notifications
+    list (see NotificationsHelper.count_unread), so it is recomputed from the notifications whenever they change
+    instead of being incremented. The timeout bounds how long the count can include notifications whose object has
+    been deleted since.
+    The count is stored under the current version of the user counter, read before computing it, and invalidating
+    the counter starts a new version: a count computed before an invalidation can only be stored under the old
+    version, where it is never read again.
+    """
+
+    timeout = 60 * 5
+
+    @staticmethod
+    def get_version_key(user_id):
+        return f'unread_notifications_version_{user_id}'
+
+    @staticmethod
+    def get_cache_key(user_id, version):
+        return f'unread_notifications_{user_id}_{version}'
+
+    @classmethod
+    def get_version(cls, user_id):
+        version_key = cls.get_version_key(user_id)
+        cache.add(version_key, uuid.uuid4().hex, None)
+        return cache.get(version_key)
+
+    @classmethod
+    def get(cls, user_id, version):
+        """ The cached count, or None if it has to be recomputed """
+        return cache.get(cls.get_cache_key(user_id, version))
+
+    @classmethod
+    def set(cls, user_id, version, unread_count):
+        """ Stores the count computed for the given version, replacing the one stored for it if any """
+        cache.set(cls.get_cache_key(user_id, version), unread_count, cls.timeout)
+
+    @classmethod
+    def add(cls, user_id, version, unread_count):
+        """ Stores the count computed for the given version, unless a count is already stored for it """
+        cache.add(cls.get_cache_key(user_id, version), unread_count, cls.timeout)
+
+    @classmethod
+    def invalidate(cls, user_id):
+        cache.delete(cls.get_version_key(user_id))
+
+    @classmethod
+    def invalidate_many(cls, users_ids):
+        cache.delete_many([cls.get_version_key(user_id) for user_id in set(users_ids)])
+
+
 class Notification(models.Model):
 
     SIGNUP = 'signup'
@@ -50,5 +103,52 @@ class Notification(models.Model):
     created_datetime = models.DateTimeField('created datetime', auto_now_add=True)
     last_updated_datetime = models.DateTimeField('last updated datetime', auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'read'], name='notification_recipient_read'),
+            models.Index(fields=['recipient', '-created_datetime'], name='notification_recipient_date'),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding and not self.read:
+            UnreadNotificationsCounter.invalidate(self.recipient_id)
+
     def __str__(self):
         return f"{self.activator.username}|{self.club}|{self.type}|{self.created_datetime}|{self.recipient.username}"
+
+
+class OutboxEmail(models.Model):
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    status_choices = (
+        (PENDING, 'Waiting to be sent'),
+        (SENT, 'Delivered to the email backend'),
+        (FAILED, 'Delivery failed after all the attempts'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=7, choices=status_choices, default=PENDING)
+    from_email = models.CharField('from email', max_length=254)
+    to_email = models.EmailField('to email')
+    subject = models.CharField('subject', max_length=998)
+    body = models.TextField('body')
+    html_body = models.TextField('html body', blank=True, default='')
+    attempts = models.PositiveSmallIntegerField('delivery attempts', default=0)
+    last_error = models.TextField('last delivery error', blank=True, default='')
+    next_attempt_datetime = models.DateTimeField('next delivery attempt datetime', default=timezone.now)
+    sent_datetime = models.DateTimeField('sent datetime', null=True, blank=True)
+    created_datetime = models.DateTimeField('created datetime', auto_now_add=True)
+    last_updated_datetime = models.DateTimeField('last updated datetime', auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_datetime'], name='outbox_email_status_next'),
+        ]
+
+    def __str__(self):
+        return f"{self.id}|{self.status}|{self.to_email}|{self.subject}"
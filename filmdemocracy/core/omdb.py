@@ -0,0 +1,220 @@
+import gzip
+import io
+import json
+import os
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from django.conf import settings
+from django.db.models import DateTimeField, DurationField, Exists, ExpressionWrapper, F, OuterRef, Value
+
+from filmdemocracy.democracy.models import Film, FilmDb
+from filmdemocracy.democracy.ranking import RankingCache
+from filmdemocracy.secrets import OMDB_API_KEY
+
+
+class OmdbClient:
+    """
+    OMDb API client reusing pooled connections, with request timeouts, a shared rate limit for the concurrent
+    fetches and an on-disk cache of the responses keyed by IMDb id.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, api_key=OMDB_API_KEY, api_url=None, cache_dir=None, cache_ttl=None, requests_per_second=None,
+                 max_workers=4, timeout=(3.05, 10)):
+        self.api_key = api_key
+        self.api_url = api_url or settings.OMDB_API_URL
+        self.cache_dir = cache_dir or settings.OMDB_CACHE_DIR
+        self.cache_ttl = settings.OMDB_CACHE_TTL if cache_ttl is None else cache_ttl
+        self.min_interval = 1 / (requests_per_second or settings.OMDB_REQUESTS_PER_SECOND)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = self.build_session()
+        self.rate_limit_lock = threading.Lock()
+        self.next_request_time = 0
+
+    @classmethod
+    def get_instance(cls):
+        """ The client shared by the whole process, so that its connections pool and rate limit are reused """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def build_session(self):
+        session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers, max_retries=retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def wait_rate_limit(self):
+        """ Spaces the requests of all the threads at least min_interval seconds apart """
+        with self.rate_limit_lock:
+            now = time.monotonic()
+            wait = self.next_request_time - now
+            self.next_request_time = max(now, self.next_request_time) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def get_cache_path(self, imdb_id):
+        return os.path.join(self.cache_dir, f'tt{imdb_id}.json')
+
+    def load_cached(self, imdb_id):
+        try:
+            with open(self.get_cache_path(imdb_id)) as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached.get('fetched_timestamp', 0) > self.cache_ttl:
+            return None
+        return cached.get('omdb_data')
+
+    def store_cached(self, imdb_id, omdb_data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self.get_cache_path(imdb_id)
+        tmp_cache_path = f'{cache_path}.{threading.get_ident()}.tmp'
+        with open(tmp_cache_path, 'w') as cache_file:
+            json.dump({'fetched_timestamp': time.time(), 'omdb_data': omdb_data}, cache_file)
+        os.replace(tmp_cache_path, cache_path)
+
+    def fetch(self, imdb_id, use_cache=True):
+        """ Returns the OMDb data of the film, or None if it could not be obtained """
+        if use_cache:
+            omdb_data = self.load_cached(imdb_id)
+            if omdb_data is not None:
+                return omdb_data
+        self.wait_rate_limit()
+        params = {'i': f'tt{imdb_id}', 'plot': 'full', 'apikey': self.api_key}
+        try:
+            response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            omdb_data = response.json()
+        except (requests.RequestException, ValueError):
+            return None
+        if omdb_data.get('Response') == 'False':
+            return None
+        self.store_cached(imdb_id, omdb_data)
+        return omdb_data
+
+    def fetch_many(self, imdb_ids, use_cache=True):
+        """ Fetches the films concurrently, returns a dict {imdb_id: omdb_data} of the films obtained """
+        imdb_ids = list(set(imdb_ids))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            omdb_datas = executor.map(lambda imdb_id: self.fetch(imdb_id, use_cache), imdb_ids)
+            return {imdb_id: omdb_data for imdb_id, omdb_data in zip(imdb_ids, omdb_datas) if omdb_data is not None}
+
+    @staticmethod
+    def update_filmdb(filmdb, omdb_data):
+        """ Returns True if the film has been updated, and False otherwise """
+        filmdb_fields = parse_omdb_film_json(filmdb.imdb_id, omdb_data)
+        if filmdb_fields is None:
+            return False
+        for field in FILMDB_OMDB_FIELDS:
+            setattr(filmdb, field, filmdb_fields[field])
+        filmdb.save()
+        return True
+
+    def refresh(self, filmdb, use_cache=True):
+        omdb_data = self.fetch(filmdb.imdb_id, use_cache)
+        updated = omdb_data is not None and self.update_filmdb(filmdb, omdb_data)
+        if updated:
+            RankingCache.invalidate_filmdbs([filmdb.imdb_id])
+        return updated
+
+    def refresh_many(self, imdb_ids, use_cache=True):
+        """ Updates the films in the database with the OMDb data, returns the imdb ids of the films updated """
+        omdb_datas = self.fetch_many(imdb_ids, use_cache)
+        updated_imdb_ids = []
+        for imdb_id, filmdb in FilmDb.objects.in_bulk(list(omdb_datas)).items():
+            if self.update_filmdb(filmdb, omdb_datas[imdb_id]):
+                updated_imdb_ids.append(imdb_id)
+        RankingCache.invalidate_filmdbs(updated_imdb_ids)
+        return updated_imdb_ids
+
+
+FILMDB_OMDB_FIELDS = {
+    'title': 'Title',
+    'imdb_rating': 'imdbRating',
+    'metascore': 'Metascore',
+    'year': 'Year',
+    'director': 'Director',
+    'writer': 'Writer',
+    'actors': 'Actors',
+    'poster_url': 'Poster',
+    'duration': 'Runtime',
+    'language': 'Language',
+    'rated': 'Rated',
+    'country': 'Country',
+    'plot': 'Plot',
+}
+
+
+def parse_omdb_film_json(film_json_id, film_json):
+    """ Returns the FilmDb fields of an OMDb film json, or None if it is not valid """
+    try:
+        filmdb_fields = {field: film_json[json_field] for field, json_field in FILMDB_OMDB_FIELDS.items()}
+        filmdb_fields['imdb_id'] = str(int(str(film_json_id).replace('tt', ''))).zfill(8)
+        filmdb_fields['year'] = int(filmdb_fields['year'][0:4])
+    except (ValueError, KeyError, TypeError):
+        return None
+    filmdb_fields['duration_mins'] = FilmDb.parse_duration_mins(filmdb_fields['duration'])
+    return filmdb_fields
+
+
+def omdb_film_json(filmdb_fields):
+    """ Inverse of parse_omdb_film_json: the OMDb film json of the FilmDb fields """
+    film_json = {'imdbID': f'tt{filmdb_fields["imdb_id"]}'}
+    film_json.update({json_field: filmdb_fields[field] for field, json_field in FILMDB_OMDB_FIELDS.items()})
+    film_json['Year'] = str(film_json['Year'])
+    return film_json
+
+
+def open_films_dump(file_path, mode='r'):
+    """ Opens a JSON Lines films dump as text, (de)compressing it if it ends with .gz or .zst """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, f'{mode}t', encoding='utf-8')
+    elif file_path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('The zstandard package is required for .zst films dumps')
+        binary_file = open(file_path, f'{mode}b')
+        if mode == 'r':
+            zstd_stream = zstandard.ZstdDecompressor().stream_reader(binary_file)
+        else:
+            zstd_stream = zstandard.ZstdCompressor().stream_writer(binary_file)
+        return io.TextIOWrapper(zstd_stream, encoding='utf-8')
+    else:
+        return open(file_path, mode, encoding='utf-8')
+
+
+def get_updatable_filmdbs():
+    """
+    FilmDb rows that are stale according to FilmDb.updatable, evaluated in the database: films last updated longer
+    ago than the time between their creation and their last update. Candidate films of active clubs come first.
+    """
+    now = Value(datetime.now(timezone.utc), output_field=DateTimeField())
+    active_candidate_films = Film.objects.filter(db=OuterRef('pk'), seen=False, club__members__is_active=True)
+    return FilmDb.objects.annotate(
+        time_since_updated=ExpressionWrapper(now - F('last_updated_datetime'), output_field=DurationField()),
+        time_to_update=ExpressionWrapper(F('last_updated_datetime') - F('created_datetime'), output_field=DurationField()),
+        is_active_candidate=Exists(active_candidate_films),
+    ).filter(
+        time_since_updated__gt=F('time_to_update')
+    ).order_by('-is_active_candidate', 'last_updated_datetime')
+
+
+def update_filmdb_omdb_info(filmdb):
+    """ Returns True if the database has been updated, and False otherwise """
+    return OmdbClient.get_instance().refresh(filmdb, use_cache=False)
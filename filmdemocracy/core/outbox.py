@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+from django.db.models import F
+from django.core.mail import EmailMultiAlternatives, get_connection
+
+from filmdemocracy.core.models import OutboxEmail
+
+
+class OutboxSender:
+    """ Delivers the queued outbox emails in batches, reusing a single email backend connection per batch """
+
+    def __init__(self, batch_size=100, max_attempts=5, retry_delay_secs=60, lease_secs=600, backend=None):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay_secs = retry_delay_secs
+        self.lease_secs = lease_secs
+        self.backend = backend
+
+    def claim_batch(self):
+        """
+        Takes the next due pending emails, moving their next attempt forward so that other workers skip them.
+        If the worker dies while sending, the emails are retried once the lease expires.
+        """
+        now = datetime.now(timezone.utc)
+        with transaction.atomic():
+            due_emails = OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+                status=OutboxEmail.PENDING, next_attempt_datetime__lte=now
+            ).order_by('next_attempt_datetime')
+            emails = list(due_emails[0:self.batch_size])
+            OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(
+                attempts=F('attempts') + 1, next_attempt_datetime=now + timedelta(seconds=self.lease_secs)
+            )
+        for email in emails:
+            email.attempts += 1
+        return emails
+
+    @staticmethod
+    def build_email_message(email, connection):
+        email_message = EmailMultiAlternatives(email.subject, email.body, email.from_email, [email.to_email],
+                                               connection=connection)
+        if email.html_body:
+            email_message.attach_alternative(email.html_body, 'text/html')
+        return email_message
+
+    def get_retry_datetime(self, attempts):
+        """ Exponential backoff: retry_delay_secs, then twice as long after each failed attempt """
+        return datetime.now(timezone.utc) + timedelta(seconds=self.retry_delay_secs * 2 ** (attempts - 1))
+
+    def record_failure(self, email, error):
+        email.last_error = repr(error)
+        if email.attempts >= self.max_attempts:
+            email.status = OutboxEmail.FAILED
+        else:
+            email.next_attempt_datetime = self.get_retry_datetime(email.attempts)
+        email.save(update_fields=['status', 'last_error', 'next_attempt_datetime', 'last_updated_datetime'])
+
+    def send_batch(self, emails):
+        """ Sends the emails through a single connection and returns the number of them delivered """
+        sent_count = 0
+        connection = get_connection(self.backend)
+        email_messages = [self.build_email_message(email, connection) for email in emails]
+        try:
+            connection.open()
+        except Exception as error:
+            for email in emails:
+                self.record_failure(email, error)
+            return sent_count
+        try:
+            for email, email_message in zip(emails, email_messages):
+                try:
+                    connection.send_messages([email_message])
+                except Exception as error:
+                    self.record_failure(email, error)
+                else:
+                    email.status = OutboxEmail.SENT
+                    email.sent_datetime = datetime.now(timezone.utc)
+                    email.save(update_fields=['status', 'sent_datetime', 'last_updated_datetime'])
+                    sent_count += 1
+        finally:
+            connection.close()
+        return sent_count
+
+    def send_pending(self):
+        """ Drains the due pending emails, returns the number of emails sent and failed attempts """
+        sent_count = failed_count = 0
+        emails = self.claim_batch()
+        while emails:
+            batch_sent_count = self.send_batch(emails)
+            sent_count += batch_sent_count
+            failed_count += len(emails) - batch_sent_count
+            emails = self.claim_batch()
+        return sent_count, failed_count
@@ -0,0 +1,61 @@
+import json
+from datetime import date, datetime
+
+from django.http import Http404
+from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination of a queryset ordered by order_fields, whose last field must be unique. The cursor holds the
+    ordering values of the last film of the page, hex encoded so it fits in the options string of the film lists.
+    """
+
+    def __init__(self, queryset, order_fields, page_size=30):
+        self.queryset = queryset.order_by(*order_fields)
+        self.order_fields = order_fields
+        self.page_size = page_size
+
+    @staticmethod
+    def encode_cursor(values):
+        # isoformat keeps the microseconds that DjangoJSONEncoder would drop
+        values = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+        return json.dumps(values, cls=DjangoJSONEncoder).encode('utf-8').hex()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(bytes.fromhex(cursor).decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            raise Http404
+        if not isinstance(values, list) or len(values) != len(self.order_fields):
+            raise Http404
+        return values
+
+    @staticmethod
+    def get_field_value(item, field_name):
+        for attribute in field_name.split('__'):
+            item = getattr(item, attribute)
+        return item
+
+    def get_after_cursor_filter(self, values):
+        """ (f1 > v1) | (f1 = v1 & f2 > v2) | ..., with < for the descending fields """
+        after_cursor_filter = Q()
+        for i, order_field in enumerate(self.order_fields):
+            field_name = order_field.lstrip('-')
+            lookup = 'lt' if order_field.startswith('-') else 'gt'
+            previous_fields_equal = {field.lstrip('-'): value for field, value in zip(self.order_fields[0:i], values)}
+            after_cursor_filter |= Q(**previous_fields_equal, **{f'{field_name}__{lookup}': values[i]})
+        return after_cursor_filter
+
+    def get_page(self, cursor=None):
+        """ Returns the items after the cursor and the cursor of the next page, None if it is the last one """
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self.get_after_cursor_filter(self.decode_cursor(cursor)))
+        items = list(queryset[0:self.page_size + 1])
+        if len(items) <= self.page_size:
+            return items, None
+        items = items[0:self.page_size]
+        last_values = [self.get_field_value(items[-1], field.lstrip('-')) for field in self.order_fields]
+        return items, self.encode_cursor(last_values)
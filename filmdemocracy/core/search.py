@@ -0,0 +1,347 @@
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import unicodedata
+from array import array
+from datetime import datetime, timezone
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, Count, FloatField, IntegerField, Max, Q, Value, When
+from django.core.cache import cache
+
+from filmdemocracy.democracy.models import FilmDb
+
+
+FILM_SEARCH_DIRECTOR_REGEXP = re.compile(r'\bdirector:\s*(?P<director>.*)$', re.IGNORECASE)
+
+
+FILM_SEARCH_YEAR_REGEXP = re.compile(r'(?P<prefix>\byear:\s*|\b)(?P<year>(?:18|19|20)\d{2})\b', re.IGNORECASE)
+
+
+def parse_film_search_query(query):
+    """
+    Splits a film search query into (title, year, director, explicit_year). A 4-digit year anywhere in the query
+    filters by year ('year:1999' only by year, a bare 1999 also matches titles containing it, e.g. '1917'), and
+    everything after 'director:' filters by director.
+    """
+    year = director = None
+    explicit_year = False
+    director_match = FILM_SEARCH_DIRECTOR_REGEXP.search(query)
+    if director_match:
+        director = director_match.group('director').strip() or None
+        query = query[:director_match.start()]
+    year_match = FILM_SEARCH_YEAR_REGEXP.search(query)
+    if year_match:
+        year = int(year_match.group('year'))
+        explicit_year = bool(year_match.group('prefix'))
+        query = query[:year_match.start()] + query[year_match.end():]
+    title = ' '.join(query.split())
+    return title, year, director, explicit_year
+
+
+def search_filmdbs(query):
+    """
+    Films matching the search query, titles starting with the query first and then by trigram similarity.
+    In PostgreSQL the title and director filters use the pg_trgm indexes created by create_search_indexes.
+    """
+    title, year, director, explicit_year = parse_film_search_query(query)
+    filmdbs = FilmDb.objects.all()
+    if year and explicit_year:
+        filmdbs = filmdbs.filter(year=year)
+    elif year:
+        filmdbs = filmdbs.filter(Q(year=year) | Q(title__contains=str(year)))
+    if director:
+        filmdbs = filmdbs.filter(director__icontains=director)
+    if not title:
+        return filmdbs.order_by('-year', 'title')
+    if connections[filmdbs.db].vendor == 'postgresql':
+        filmdbs = filmdbs.filter(Q(title__icontains=title) | Q(title__trigram_similar=title))
+        similarity = TrigramSimilarity('title', title)
+    else:
+        filmdbs = filmdbs.filter(title__icontains=title)
+        similarity = Value(0, output_field=FloatField())
+    return filmdbs.annotate(
+        is_prefix=Case(When(title__istartswith=title, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        similarity=similarity,
+    ).order_by('-is_prefix', '-similarity', '-year', 'title')
+
+
+class FilmSearchIndex:
+    """
+    In-process index of the films for the autocomplete (enabled with FILM_SEARCH_INDEX_ENABLED).
+    Prefix matches are found with bisect over the sorted normalized titles, and infix matches by checking the films
+    of the rarest trigram of the query. The index is loaded from a snapshot file (see build_film_search_snapshot)
+    and refreshed incrementally with the films updated since then, both in a background thread.
+    """
+
+    max_prefix_scan = 5000
+    _instance = None
+    _instance_lock = threading.Lock()
+    _updater = None
+    _next_update_time = 0
+
+    def __init__(self):
+        self.films = []  # (imdb_id, normalized title, year, normalized director), None once replaced
+        self.films_positions = {}
+        self.sorted_titles = []  # (normalized title, position in self.films)
+        self.trigrams_postings = {}
+        self.last_updated_datetime = None
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get_instance(cls):
+        """
+        The index of the web process, None until it has been loaded. Requests never wait for the index to be loaded
+        or refreshed: they only start the background thread doing it, at most once per FILM_SEARCH_INDEX_REFRESH_SECS
+        """
+        if time.time() >= cls._next_update_time:
+            cls.start_update()
+        return cls._instance
+
+    @classmethod
+    def start_update(cls):
+        with cls._instance_lock:
+            if time.time() < cls._next_update_time or (cls._updater is not None and cls._updater.is_alive()):
+                return
+            cls._next_update_time = time.time() + settings.FILM_SEARCH_INDEX_REFRESH_SECS
+            cls._updater = threading.Thread(target=cls.update_instance, name='film-search-index', daemon=True)
+            cls._updater.start()
+
+    @classmethod
+    def update_instance(cls):
+        """ Builds the first index apart and then swaps it in, or refreshes the current one """
+        try:
+            if cls._instance is None:
+                film_search_index = cls()
+                film_search_index.load_snapshot(settings.FILM_SEARCH_INDEX_SNAPSHOT)
+                film_search_index.refresh()
+                cls._instance = film_search_index
+            else:
+                cls._instance.refresh()
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii').lower()
+        return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+    @staticmethod
+    def get_trigrams(normalized_text):
+        return {normalized_text[i:i + 3] for i in range(len(normalized_text) - 2)}
+
+    def add_films(self, films_rows):
+        """
+        Adds or replaces films given as (imdb_id, title, year, director) rows. Films are only added by the thread
+        updating the index, so the titles are normalized and the new sorted titles built without the lock, which
+        is only held to swap them in and update the films and trigrams postings.
+        """
+        new_films = [
+            (imdb_id, self.normalize(title), year, self.normalize(director))
+            for imdb_id, title, year, director in {film_row[0]: film_row for film_row in films_rows}.values()
+        ]
+        first_position = len(self.films)
+        replaced_positions = [self.films_positions[film[0]] for film in new_films if film[0] in self.films_positions]
+        replaced_titles = {(self.films[position][1], position) for position in replaced_positions}
+        new_titles = sorted((film[1], first_position + i) for i, film in enumerate(new_films))
+        kept_titles = [title for title in self.sorted_titles if title not in replaced_titles] if replaced_titles \
+            else self.sorted_titles
+        # Both lists are sorted runs, merged in linear time by the sort
+        sorted_titles = sorted(kept_titles + new_titles)
+        with self.lock:
+            for position in replaced_positions:
+                for trigram in self.get_trigrams(self.films[position][1]):
+                    self.trigrams_postings[trigram].remove(position)
+                self.films[position] = None
+            for position, film in enumerate(new_films, start=first_position):
+                self.films.append(film)
+                self.films_positions[film[0]] = position
+                for trigram in self.get_trigrams(film[1]):
+                    self.trigrams_postings.setdefault(trigram, array('I')).append(position)
+            self.sorted_titles = sorted_titles
+
+    def load_snapshot(self, snapshot_file):
+        try:
+            with gzip.open(snapshot_file, 'rt', encoding='utf-8') as snapshot:
+                snapshot_data = json.load(snapshot)
+        except (OSError, ValueError):
+            return False
+        self.add_films(snapshot_data['films'])
+        self.last_updated_datetime = datetime.fromisoformat(snapshot_data['last_updated_datetime'])
+        return True
+
+    def save_snapshot(self, snapshot_file):
+        films_rows = FilmDb.objects.order_by().values_list('imdb_id', 'title', 'year', 'director')
+        last_updated_datetime = FilmDb.objects.aggregate(Max('last_updated_datetime'))['last_updated_datetime__max']
+        snapshot_data = {
+            'last_updated_datetime': (last_updated_datetime or datetime.now(timezone.utc)).isoformat(),
+            'films': list(films_rows.iterator(chunk_size=5000)),
+        }
+        os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+        with gzip.open(f'{snapshot_file}.tmp', 'wt', encoding='utf-8') as snapshot:
+            json.dump(snapshot_data, snapshot)
+        os.replace(f'{snapshot_file}.tmp', snapshot_file)
+        return len(snapshot_data['films'])
+
+    def refresh(self):
+        """ Adds the films created or updated since the last refresh """
+        filmdbs = FilmDb.objects.order_by('last_updated_datetime')
+        if self.last_updated_datetime is not None:
+            filmdbs = filmdbs.filter(last_updated_datetime__gt=self.last_updated_datetime)
+        films_rows = list(filmdbs.values_list('imdb_id', 'title', 'year', 'director', 'last_updated_datetime'))
+        if films_rows:
+            self.add_films([film_row[0:4] for film_row in films_rows])
+            self.last_updated_datetime = films_rows[-1][4]
+
+    def get_prefix_matches(self, normalized_title):
+        start = bisect.bisect_left(self.sorted_titles, (normalized_title, -1))
+        for title, position in self.sorted_titles[start:start + self.max_prefix_scan]:
+            if not title.startswith(normalized_title):
+                break
+            yield position
+
+    def get_infix_matches(self, normalized_title):
+        postings = [self.trigrams_postings.get(trigram, ()) for trigram in self.get_trigrams(normalized_title)]
+        if not postings:
+            return
+        for position in min(postings, key=len):
+            film = self.films[position]
+            if film is not None and normalized_title in film[1]:
+                yield position
+
+    def search(self, query, limit=100):
+        """
+        Imdb ids of the films matching the query (same syntax as search_filmdbs), prefix matches first and then
+        infix matches, most recent films first within each group. None if the query has no title to look up.
+        """
+        title, year, director, explicit_year = parse_film_search_query(query)
+        normalized_title = self.normalize(title)
+        if not normalized_title:
+            return None
+        normalized_director = self.normalize(director) if director else None
+
+        def film_matches(film):
+            if film is None:
+                return False
+            if year and film[2] != year and (explicit_year or str(year) not in film[1]):
+                return False
+            return normalized_director is None or normalized_director in film[3]
+
+        with self.lock:
+            prefix_matches = [self.films[position] for position in self.get_prefix_matches(normalized_title)]
+            prefix_matches = [film for film in prefix_matches if film_matches(film)]
+            prefix_imdb_ids = {film[0] for film in prefix_matches}
+            infix_matches = []
+            if len(normalized_title) >= 3 and len(prefix_matches) < limit:
+                infix_matches = [self.films[position] for position in self.get_infix_matches(normalized_title)]
+                infix_matches = [film for film in infix_matches if film_matches(film) and film[0] not in prefix_imdb_ids]
+        ordered_matches = sorted(prefix_matches, key=lambda film: -(film[2] or 0)) + sorted(infix_matches, key=lambda film: -(film[2] or 0))
+        return [film[0] for film in ordered_matches[0:limit]]
+
+
+def search_filmdbs_indexed(query, limit=100):
+    """
+    search_filmdbs through the in-process FilmSearchIndex if it is enabled, already loaded and the query has a title
+    """
+    film_search_index = FilmSearchIndex.get_instance() if settings.FILM_SEARCH_INDEX_ENABLED else None
+    if film_search_index is not None:
+        imdb_ids = film_search_index.search(query, limit)
+        if imdb_ids is not None:
+            ordering = Case(*[When(imdb_id=imdb_id, then=Value(i)) for i, imdb_id in enumerate(imdb_ids)],
+                            output_field=IntegerField())
+            return FilmDb.objects.filter(imdb_id__in=imdb_ids).order_by(ordering) if imdb_ids else FilmDb.objects.none()
+    return search_filmdbs(query)
+
+
+SYNTHETIC_FILMS_TITLE_WORDS = [
+    'the', 'night', 'city', 'love', 'dark', 'last', 'man', 'woman', 'war', 'star', 'house', 'blood', 'king',
+    'girl', 'river', 'dead', 'summer', 'winter', 'shadow', 'dream', 'lost', 'road', 'secret', 'fire', 'island',
+    'memento', 'vertigo', 'odyssey', 'runner', 'empire', 'return', 'journey', 'silence', 'storm', 'garden',
+]
+
+
+SYNTHETIC_FILMS_DIRECTORS = ['Nolan', 'Hitchcock', 'Kubrick', 'Scott', 'Kurosawa', 'Bergman', 'Almodovar', 'Varda', 'Lynch']
+
+
+def iter_synthetic_films_rows(size, imdb_id_offset=0):
+    """ (imdb_id, title, year, director) rows of the reproducible synthetic catalogue of the search benchmarks """
+    rnd = random.Random(0)
+    for i in range(size):
+        title = ' '.join(rnd.sample(SYNTHETIC_FILMS_TITLE_WORDS, rnd.randint(1, 4))).capitalize()
+        yield str(imdb_id_offset + i).zfill(8), title, rnd.randint(1920, 2020), rnd.choice(SYNTHETIC_FILMS_DIRECTORS)
+
+
+class AutocompleteCache:
+    """
+    Short-lived cache of the film autocomplete responses, keyed by the normalized query and the page number.
+    Queries shorter than min_query_length are answered from the films proposed in most clubs instead of searching.
+    """
+
+    timeout = 60
+    min_query_length = 3
+    popular_timeout = 60 * 60
+    popular_size = 200
+    popular_key = 'autocomplete_popular_filmdbs'
+    hits_key = 'autocomplete_cache_hits'
+    misses_key = 'autocomplete_cache_misses'
+
+    @staticmethod
+    def normalize_query(query):
+        return ' '.join(query.lower().split())
+
+    @classmethod
+    def key(cls, query, page):
+        query_digest = hashlib.sha1(cls.normalize_query(query).encode('utf-8')).hexdigest()
+        return f'autocomplete_{query_digest}_{page}'
+
+    @classmethod
+    def count(cls, counter_key):
+        cache.add(counter_key, 0, None)
+        cache.incr(counter_key)
+
+    @classmethod
+    def get_response_data(cls, query, page):
+        response_data = cache.get(cls.key(query, page))
+        cls.count(cls.misses_key if response_data is None else cls.hits_key)
+        return response_data
+
+    @classmethod
+    def set_response_data(cls, query, page, response_data):
+        cache.set(cls.key(query, page), response_data, cls.timeout)
+
+    @classmethod
+    def is_short_query(cls, query):
+        return len(FilmSearchIndex.normalize(query)) < cls.min_query_length
+
+    @classmethod
+    def get_popular_filmdbs(cls):
+        """ The films proposed in most clubs, recomputed at most once per popular_timeout """
+        popular_filmdbs = cache.get(cls.popular_key)
+        if popular_filmdbs is None:
+            popular_filmdbs = list(FilmDb.objects.annotate(
+                clubs_count=Count('film__club', distinct=True)
+            ).filter(clubs_count__gt=0).order_by('-clubs_count', '-year')[0:cls.popular_size])
+            cache.set(cls.popular_key, popular_filmdbs, cls.popular_timeout)
+        return popular_filmdbs
+
+    @classmethod
+    def get_popular_matches(cls, query):
+        normalized_query = FilmSearchIndex.normalize(query)
+        return [filmdb for filmdb in cls.get_popular_filmdbs() if FilmSearchIndex.normalize(filmdb.title).startswith(normalized_query)]
+
+    @classmethod
+    def get_stats(cls):
+        hits, misses = cache.get(cls.hits_key, 0), cache.get(cls.misses_key, 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+        }
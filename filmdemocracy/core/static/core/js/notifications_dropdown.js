@@ -0,0 +1,37 @@
+$(document).ready(function() {
+    var container = $("#notificationsContainer");
+    var loaded = false;
+
+    function loadNotifications(page) {
+      fetch(container.data("url") + "?page=" + page, {credentials: "same-origin"})
+        .then(function(response) { return response.json(); })
+        .then(function(data) {
+          if (page === 1) {
+            container.html(data.html);
+            if (data.notifications.length === 0) {
+              container.addClass("d-none");
+              $("#notificationsEmpty").removeClass("d-none");
+            }
+          } else {
+            container.find(".ntf-load-more").prev(".dropdown-divider").remove();
+            container.find(".ntf-load-more").remove();
+            container.append(data.html);
+          }
+        });
+    }
+
+    // load the notifications only the first time the dropdown is opened
+    $("#navbarDropdownNotifications").parent().on("show.bs.dropdown", function() {
+      if (!loaded) {
+        loaded = true;
+        loadNotifications(1);
+      }
+    });
+
+    // keep the dropdown open when loading older notifications
+    container.on("click", ".ntf-load-more", function(event) {
+      event.stopPropagation();
+      $(this).prop("disabled", true);
+      loadNotifications(parseInt($(this).data("next-page")));
+    });
+});
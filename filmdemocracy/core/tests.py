@@ -0,0 +1,539 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from smtplib import SMTPException
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from filmdemocracy.core.models import OutboxEmail, Notification, UnreadNotificationsCounter
+from filmdemocracy.core.management.commands.feed_db_with_films import Command as FeedDbWithFilmsCommand
+from filmdemocracy.core.omdb import OmdbClient, FILMDB_OMDB_FIELDS
+from filmdemocracy.core.outbox import OutboxSender
+from filmdemocracy.core.search import FilmSearchIndex, parse_film_search_query
+from filmdemocracy.core.utils import SpamHelper, random_free_id, create_club_with_random_id, \
+    create_film_with_random_public_id, bulk_create_notifications, build_notifications, save_notifications, \
+    NotificationsHelper
+from filmdemocracy.democracy.models import Club, FilmDb, Film
+from filmdemocracy.registration.models import User
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.organizer = User.objects.create_user('organizer', 'organizer@fakemail.com', 'pass')
+        self.members = [User.objects.create_user(f'member{i}', f'member{i}@fakemail.com', 'pass') for i in range(3)]
+        request = RequestFactory().get('/')
+        request.user = self.organizer
+        self.spam_helper = SpamHelper(request, 'democracy/emails/meetings_new_subject.txt',
+                                      'democracy/emails/meetings_new_email.html',
+                                      'democracy/emails/meetings_new_email_html.html')
+        self.email_context = {
+            'organizer': self.organizer,
+            'club': {'id': '123456', 'name': 'Club'},
+            'name': 'Meeting',
+            'description': 'Meeting description',
+            'place': 'Place',
+            'date': date(2020, 1, 1),
+            'time_start': None,
+        }
+
+    def queue_emails(self):
+        self.spam_helper.queue_emails([member.email for member in self.members], self.email_context,
+                                      self.spam_helper.get_members_substitutions(self.members))
+
+    def test_queue_emails(self):
+        self.queue_emails()
+        self.assertEqual(len(mail.outbox), 0)
+        outbox_emails = {email.to_email: email for email in OutboxEmail.objects.all()}
+        self.assertEqual(set(outbox_emails), {member.email for member in self.members})
+        for member in self.members:
+            email = outbox_emails[member.email]
+            self.assertEqual(email.status, OutboxEmail.PENDING)
+            self.assertIn(f'Hi {member.username},', email.body)
+            self.assertIn(member.username, email.html_body)
+            self.assertNotIn('[[', email.body + email.html_body)
+
+    def test_substituted_values_kept_as_is(self):
+        self.members[0].username = '[[recipient_name]] <b>x</b>'
+        self.members[1].username = self.spam_helper.get_substitution_marker('recipient_name')
+        self.queue_emails()
+        first_email = OutboxEmail.objects.get(to_email=self.members[0].email)
+        self.assertIn('Hi [[recipient_name]] <b>x</b>,', first_email.body)
+        self.assertIn('[[recipient_name]] &lt;b&gt;x&lt;/b&gt;', first_email.html_body)
+        self.assertNotIn('<b>x</b>', first_email.html_body)
+        # Even a value looking like one of the markers is not substituted again
+        second_email = OutboxEmail.objects.get(to_email=self.members[1].email)
+        self.assertIn(f'Hi {self.members[1].username},', second_email.body)
+
+    def test_send_pending(self):
+        self.queue_emails()
+        self.assertEqual(OutboxSender(batch_size=2).send_pending(), (3, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [member.email for member in self.members])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.SENT).exists())
+        self.assertEqual(OutboxSender().send_pending(), (0, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+    @mock.patch.object(EmailBackend, 'send_messages', side_effect=SMTPException('Delivery failed'))
+    def test_failed_delivery(self, send_messages):
+        self.queue_emails()
+        outbox_sender = OutboxSender(max_attempts=2)
+        self.assertEqual(outbox_sender.send_pending(), (0, 3))
+        now = datetime.now(timezone.utc)
+        for email in OutboxEmail.objects.all():
+            self.assertEqual(email.status, OutboxEmail.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertIn('Delivery failed', email.last_error)
+            self.assertGreater(email.next_attempt_datetime, now)
+        # Retried only once the backoff delay is over
+        self.assertEqual(outbox_sender.send_pending(), (0, 0))
+        OutboxEmail.objects.update(next_attempt_datetime=now)
+        self.assertEqual(outbox_sender.send_pending(), (0, 3))
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.FAILED).exists())
+        self.assertEqual(send_messages.call_count, 6)
+
+
+class RandomIdTests(TestCase):
+
+    def setUp(self):
+        self.founder = User.objects.create_user('founder', 'founder@fakemail.com', 'pass')
+        self.club = Club.objects.create(id='123456', name='Club', short_description='Club', founder=self.founder)
+        self.filmdb = FilmDb.objects.create(imdb_id='01000000', title='Film')
+
+    def create_film(self):
+        return create_film_with_random_public_id(self.club, proposed_by=self.founder, db=self.filmdb)
+
+    def test_random_free_id(self):
+        for club_id in range(1, 9):
+            Club.objects.create(id=str(club_id), name='Club', short_description='Club', founder=self.founder)
+        clubs = Club.objects.all()
+        free_ids = {random_free_id(clubs, 'id', 1) for i in range(10)}
+        self.assertEqual(free_ids, {'9'})
+
+    @mock.patch('filmdemocracy.core.utils.random_film_public_id_generator', side_effect=['100000', '100000', '100001'])
+    def test_film_public_id_retried_on_collision(self, random_film_public_id_generator):
+        self.assertEqual(self.create_film().public_id, '100000')
+        self.assertEqual(self.create_film().public_id, '100001')
+        self.assertEqual(random_film_public_id_generator.call_count, 3)
+        self.assertEqual(Film.objects.filter(club=self.club).count(), 2)
+
+    @mock.patch('filmdemocracy.core.utils.random_club_id_generator', side_effect=['123456', '654321'])
+    def test_club_id_retried_on_collision(self, random_club_id_generator):
+        club = create_club_with_random_id(name='Other club', short_description='Club', founder=self.founder)
+        self.assertEqual(club.id, '654321')
+        self.assertEqual(Club.objects.get(id='123456').name, 'Club')
+
+    @mock.patch('filmdemocracy.core.utils.random_film_public_id_generator', return_value='100000')
+    def test_collisions_give_up_after_max_attempts(self, random_film_public_id_generator):
+        self.create_film()
+        with self.assertRaises(IntegrityError):
+            self.create_film()
+        self.assertEqual(random_film_public_id_generator.call_count, 1 + 5)
+        self.assertEqual(Film.objects.filter(club=self.club).count(), 1)
+
+
+class FilmsDumpTests(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            FilmDb.objects.create(imdb_id=str(1000000 + i).zfill(8), title=f'Film {i} – Évasion', year=1990 + i,
+                                  director='Director', writer='Writer', actors='Actor, Actress', imdb_rating='7.1',
+                                  metascore='N/A', poster_url=f'https://posters.com/{i}.jpg', duration=f'{90 + i} min',
+                                  language='French', rated='PG-13', country='France', plot=f'Plot "{i}"\nEnd')
+        self.dumps_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dumps_dir)
+
+    @staticmethod
+    def get_filmdbs_values():
+        return list(FilmDb.objects.order_by('imdb_id').values('imdb_id', 'duration_mins', *FILMDB_OMDB_FIELDS))
+
+    def feed_dump(self, dump_file, *args):
+        stdout = StringIO()
+        call_command('feed_db_with_films', '--dump', dump_file, '--chunk-size', '2', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_round_trip(self):
+        filmdbs_values = self.get_filmdbs_values()
+        for dump_name in ['films.jsonl', 'films.jsonl.gz']:
+            dump_file = os.path.join(self.dumps_dir, dump_name)
+            call_command('export_films_db', dump_file, '--chunk-size', '2', stdout=StringIO())
+            FilmDb.objects.all().delete()
+            self.assertIn('5 films processed, 0 invalid', self.feed_dump(dump_file))
+            self.assertEqual(self.get_filmdbs_values(), filmdbs_values)
+
+    def test_resume_from_checkpoint(self):
+        filmdbs_values = self.get_filmdbs_values()
+        dump_file = os.path.join(self.dumps_dir, 'films.jsonl.gz')
+        checkpoint_file = os.path.join(self.dumps_dir, 'checkpoint.json')
+        call_command('export_films_db', dump_file, stdout=StringIO())
+        FilmDb.objects.all().delete()
+        insert_filmdbs = FeedDbWithFilmsCommand.insert_filmdbs
+        inserted_chunks = []
+
+        def interrupt_after_first_chunk(filmdbs_fields):
+            if inserted_chunks:
+                raise KeyboardInterrupt
+            insert_filmdbs(filmdbs_fields)
+            inserted_chunks.append(filmdbs_fields)
+
+        with mock.patch.object(FeedDbWithFilmsCommand, 'insert_filmdbs', staticmethod(interrupt_after_first_chunk)):
+            with self.assertRaises(KeyboardInterrupt):
+                self.feed_dump(dump_file, '--checkpoint-file', checkpoint_file)
+        self.assertEqual(FilmDb.objects.count(), 2)
+        with mock.patch.object(FeedDbWithFilmsCommand, 'insert_filmdbs', wraps=insert_filmdbs) as resumed_insert:
+            self.assertIn('Resuming after checkpoint: line 2', self.feed_dump(dump_file, '--checkpoint-file',
+                                                                             checkpoint_file))
+        self.assertEqual([len(call[0][0]) for call in resumed_insert.call_args_list], [2, 1])
+        self.assertEqual(self.get_filmdbs_values(), filmdbs_values)
+        with open(checkpoint_file) as json_file:
+            self.assertEqual(json.load(json_file), {'dump_file': dump_file, 'last_line': 5})
+
+
+class FilmSearchQueryTests(SimpleTestCase):
+
+    def test_parse_film_search_query(self):
+        queries = {
+            'The Matrix': ('The Matrix', None, None, False),
+            '  the   matrix ': ('the matrix', None, None, False),
+            'matrix year:1999': ('matrix', 1999, None, True),
+            'matrix YEAR: 1999': ('matrix', 1999, None, True),
+            'matrix 1999': ('matrix', 1999, None, False),
+            '2001 a space odyssey': ('a space odyssey', 2001, None, False),
+            'room 237': ('room 237', None, None, False),
+            'matrix year:1699': ('matrix year:1699', None, None, False),
+            'alien director: Ridley Scott': ('alien', None, 'Ridley Scott', False),
+            'alien year:1979 Director:ridley': ('alien', 1979, 'ridley', True),
+            'alien director: 1979': ('alien', None, '1979', False),
+            'alien director:': ('alien', None, None, False),
+            'director: scott': ('', None, 'scott', False),
+        }
+        for query, parsed_query in queries.items():
+            with self.subTest(query=query):
+                self.assertEqual(parse_film_search_query(query), parsed_query)
+
+
+class FilmSearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.filmdbs = [
+            FilmDb.objects.create(imdb_id='01000000', title='Alien', year=1979, director='Ridley Scott'),
+            FilmDb.objects.create(imdb_id='01000001', title='Aliens', year=1986, director='James Cameron'),
+            FilmDb.objects.create(imdb_id='01000002', title='Blade Runner', year=1982, director='Ridley Scott'),
+        ]
+        self.film_search_index = FilmSearchIndex()
+        self.film_search_index.refresh()
+
+    def test_search(self):
+        self.assertEqual(self.film_search_index.search('Alien'), ['01000001', '01000000'])
+        self.assertEqual(self.film_search_index.search('alien year:1979'), ['01000000'])
+        self.assertEqual(self.film_search_index.search('aliens director: ridley'), [])
+        self.assertEqual(self.film_search_index.search('runner director: ridley'), ['01000002'])
+
+    def test_refresh_replaces_renamed_films(self):
+        self.filmdbs[0].title = 'Prometheus'
+        self.filmdbs[0].save()
+        self.film_search_index.refresh()
+        self.assertEqual(self.film_search_index.search('alien'), ['01000001'])
+        self.assertEqual(self.film_search_index.search('lien'), ['01000001'])
+        self.assertEqual(self.film_search_index.search('prometheus'), ['01000000'])
+        self.assertEqual(self.film_search_index.search('methe'), ['01000000'])
+        # The old title is left neither in the sorted titles nor in the trigrams postings
+        self.assertEqual([title for title, position in self.film_search_index.sorted_titles],
+                         ['aliens', 'blade runner', 'prometheus'])
+        for position in [position for postings in self.film_search_index.trigrams_postings.values()
+                         for position in postings]:
+            self.assertIsNotNone(self.film_search_index.films[position])
+
+
+class UnreadNotificationsCountTests(TestCase):
+    """ The navbar badge counts the unread messages of the notifications list, not the notifications """
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@fakemail.com', 'pass')
+        self.activators = [User.objects.create_user(f'member{i}', f'member{i}@fakemail.com', 'pass') for i in range(2)]
+        self.club = Club.objects.create(id='123456', name='Club', short_description='Club', founder=self.user)
+        self.films = []
+        for i in range(3):
+            filmdb = FilmDb.objects.create(imdb_id=str(1000000 + i).zfill(8), title=f'Film {i}')
+            self.films.append(Film.objects.create(public_id=str(100000 + i), proposed_by=self.activators[0],
+                                                  club=self.club, db=filmdb))
+        self.client.force_login(self.user)
+
+    def notify(self, ntf_type, activator, film):
+        bulk_create_notifications(ntf_type, [self.user], activator=activator, club=self.club, object_id=film.id)
+
+    def get_badge_count(self):
+        return self.client.get(reverse('core:faq')).context['notifications']['unread_count']
+
+    def get_list_count(self):
+        return self.client.get(reverse('core:notifications_list')).json()['unread_count']
+
+    def assertUnreadCount(self, unread_count):
+        self.assertEqual(self.get_badge_count(), unread_count)
+        self.assertEqual(self.get_list_count(), unread_count)
+        self.assertEqual(self.get_badge_count(), unread_count)
+
+    def test_badge_matches_list(self):
+        self.assertUnreadCount(0)
+        for film in self.films:
+            self.notify(Notification.ADDED_FILM, self.activators[0], film)
+        # The films added by the same member are a single message
+        self.assertUnreadCount(1)
+        for activator in self.activators:
+            self.notify(Notification.COMM_FILM, activator, self.films[0])
+        self.assertUnreadCount(2)
+        comments_ids = Notification.objects.filter(type=Notification.COMM_FILM).values_list('id', flat=True)
+        self.client.post(
+            reverse('core:notification_dispatcher', kwargs={'ntf_type': Notification.COMM_FILM + 's',
+                                                            'ntf_club_id': self.club.id,
+                                                            'ntf_object_id': self.films[0].id}),
+            {'ntf_ids': '_'.join(str(ntf_id) for ntf_id in comments_ids)},
+        )
+        self.assertUnreadCount(1)
+        self.client.get(reverse('core:notification_cleaner'), HTTP_REFERER=reverse('core:faq'))
+        self.assertUnreadCount(0)
+
+    def test_notifications_of_deleted_objects_not_counted(self):
+        self.notify(Notification.COMM_FILM, self.activators[0], self.films[0])
+        self.notify(Notification.COMM_FILM, self.activators[0], self.films[1])
+        self.assertUnreadCount(2)
+        self.films[1].delete()
+        self.assertEqual(self.get_list_count(), 1)
+        self.assertEqual(self.get_badge_count(), 1)
+
+    def test_badge_count_cached(self):
+        self.notify(Notification.COMM_FILM, self.activators[0], self.films[0])
+        self.assertEqual(self.get_badge_count(), 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_badge_count(), 1)
+        self.assertFalse([query for query in context.captured_queries if 'core_notification' in query['sql']])
+
+    def test_notifications_list_pages(self):
+        # Seen films notifications are not grouped: one message each
+        for i in range(25):
+            self.notify(Notification.SEEN_FILM, self.activators[i % 2], self.films[i % 3])
+        pages = [self.client.get(reverse('core:notifications_list'), {'page': page}).json() for page in [1, 2, 3]]
+        self.assertEqual([page['page'] for page in pages], [1, 2, 3])
+        self.assertEqual([page['has_next'] for page in pages], [True, True, False])
+        self.assertEqual([len(page['notifications']) for page in pages], [10, 10, 5])
+        self.assertEqual([page['html'].count('name="ntf_ids"') for page in pages], [10, 10, 5])
+        self.assertIn('data-next-page="2"', pages[0]['html'])
+        self.assertIn('data-next-page="3"', pages[1]['html'])
+        self.assertNotIn('ntf-load-more', pages[2]['html'])
+        ntf_ids = {ntf['ntf_ids'] for page in pages for ntf in page['notifications']}
+        self.assertEqual(ntf_ids, {str(ntf_id) for ntf_id in Notification.objects.values_list('id', flat=True)})
+        self.assertEqual(self.client.get(reverse('core:notifications_list'), {'page': 'x'}).json()['page'], 1)
+
+    def notify_while_counting(self, method_name):
+        """ Patches the helper method that loads the notifications to count so that a notification arrives meanwhile """
+        method = getattr(NotificationsHelper, method_name)
+
+        def notify_meanwhile(notifications_helper):
+            loaded = method(notifications_helper)
+            self.notify(Notification.COMM_FILM, self.activators[1], self.films[1])
+            return loaded
+
+        return mock.patch.object(NotificationsHelper, method_name, autospec=True, side_effect=notify_meanwhile)
+
+    def test_count_computed_before_a_notification_not_kept(self):
+        self.notify(Notification.COMM_FILM, self.activators[0], self.films[0])
+        with self.notify_while_counting('load_unread_count'):
+            self.assertEqual(self.get_badge_count(), 1)
+        self.assertEqual(self.get_badge_count(), 2)
+
+    def test_list_count_computed_before_a_notification_not_kept(self):
+        self.notify(Notification.COMM_FILM, self.activators[0], self.films[0])
+        with self.notify_while_counting('load_notifications'):
+            self.assertEqual(self.get_list_count(), 1)
+        self.assertEqual(self.get_badge_count(), 2)
+
+
+class OmdbStubHandler(BaseHTTPRequestHandler):
+    """ Answers like the OMDb API, failing or stalling on the first request of some films """
+
+    def do_GET(self):
+        imdb_id = parse_qs(urlparse(self.path).query)['i'][0].replace('tt', '')
+        with self.server.requests_lock:
+            self.server.requests_counts[imdb_id] += 1
+            attempt = self.server.requests_counts[imdb_id]
+        behaviour = OmdbClientTests.FILMS_BEHAVIOURS[imdb_id]
+        if behaviour == 'not_found':
+            self.send_json(404, {'Response': 'False', 'Error': 'Not found'})
+        elif behaviour == 'unknown':
+            self.send_json(200, {'Response': 'False', 'Error': 'Incorrect IMDb ID.'})
+        elif behaviour == 'down' or (behaviour in ('throttled', 'unavailable') and attempt == 1):
+            self.send_json(429 if behaviour == 'throttled' else 503, {})
+        else:
+            if behaviour == 'slow' and attempt == 1:
+                time.sleep(OmdbClientTests.READ_TIMEOUT * 3)
+            self.send_json(200, OmdbClientTests.get_omdb_data(imdb_id))
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OmdbStubServer(ThreadingHTTPServer):
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), OmdbStubHandler)
+        self.requests_counts = Counter()
+        self.requests_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # The stalled responses are written after the client timed out and closed the connection
+        pass
+
+
+class OmdbClientTests(TestCase):
+    READ_TIMEOUT = 0.5
+    FILMS_BEHAVIOURS = {
+        '01000001': 'ok',
+        '01000002': 'throttled',
+        '01000003': 'unavailable',
+        '01000004': 'slow',
+        '01000005': 'down',
+        '01000006': 'not_found',
+        '01000007': 'unknown',
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = OmdbStubServer()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    @staticmethod
+    def get_omdb_data(imdb_id):
+        return {
+            'Title': f'Film {imdb_id}', 'imdbRating': '7.5', 'Metascore': '70', 'Year': '1999', 'Director': 'Director',
+            'Writer': 'Writer', 'Actors': 'Actors', 'Poster': 'N/A', 'Runtime': '101 min', 'Language': 'English',
+            'Rated': 'R', 'Country': 'France', 'Plot': 'Plot', 'Response': 'True',
+        }
+
+    def setUp(self):
+        self.server.requests_counts.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_override = override_settings(OMDB_API_URL=f'http://127.0.0.1:{self.server.server_port}/',
+                                              OMDB_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_client(self):
+        return OmdbClient(api_key='key', requests_per_second=1000, timeout=(1, self.READ_TIMEOUT))
+
+    def test_fetch_cached_on_disk(self):
+        self.assertEqual(self.get_client().fetch('01000001'), self.get_omdb_data('01000001'))
+        self.assertEqual(self.get_client().fetch('01000001'), self.get_omdb_data('01000001'))
+        self.assertEqual(self.server.requests_counts['01000001'], 1)
+        self.get_client().fetch('01000001', use_cache=False)
+        self.assertEqual(self.server.requests_counts['01000001'], 2)
+
+    def test_cache_expires_after_ttl(self):
+        omdb_client = self.get_client()
+        omdb_client.fetch('01000001')
+        cache_path = omdb_client.get_cache_path('01000001')
+        with open(cache_path) as cache_file:
+            cached = json.load(cache_file)
+        cached['fetched_timestamp'] = time.time() - settings.OMDB_CACHE_TTL - 1
+        with open(cache_path, 'w') as cache_file:
+            json.dump(cached, cache_file)
+        self.assertEqual(omdb_client.fetch('01000001'), self.get_omdb_data('01000001'))
+        self.assertEqual(self.server.requests_counts['01000001'], 2)
+        omdb_client.fetch('01000001')
+        self.assertEqual(self.server.requests_counts['01000001'], 2)
+
+    def test_fetch_retried(self):
+        omdb_client = self.get_client()
+        for imdb_id in ['01000002', '01000003', '01000004']:
+            self.assertEqual(omdb_client.fetch(imdb_id), self.get_omdb_data(imdb_id))
+            self.assertEqual(self.server.requests_counts[imdb_id], 2)
+
+    def test_fetch_failures(self):
+        omdb_client = self.get_client()
+        for imdb_id in ['01000005', '01000006', '01000007']:
+            self.assertIsNone(omdb_client.fetch(imdb_id))
+            self.assertIsNone(omdb_client.load_cached(imdb_id))
+        # The server errors are retried up to 3 times, the missing films are not
+        self.assertEqual(self.server.requests_counts, Counter({'01000005': 4, '01000006': 1, '01000007': 1}))
+
+    def test_fetch_many(self):
+        imdb_ids = ['01000001', '01000002', '01000004', '01000006', '01000001']
+        omdb_datas = self.get_client().fetch_many(imdb_ids)
+        self.assertEqual(omdb_datas, {imdb_id: self.get_omdb_data(imdb_id) for imdb_id in ['01000001', '01000002',
+                                                                                              '01000004']})
+        self.assertEqual(self.server.requests_counts, Counter({'01000001': 1, '01000002': 2, '01000004': 2,
+                                                               '01000006': 1}))
+
+    def test_refresh_many(self):
+        for imdb_id in ['01000001', '01000003', '01000006']:
+            FilmDb.objects.create(imdb_id=imdb_id, title='Old title')
+        updated_imdb_ids = self.get_client().refresh_many(['01000001', '01000003', '01000006', '01000007'])
+        self.assertEqual(sorted(updated_imdb_ids), ['01000001', '01000003'])
+        for imdb_id in ['01000001', '01000003']:
+            filmdb = FilmDb.objects.get(imdb_id=imdb_id)
+            self.assertEqual((filmdb.title, filmdb.year, filmdb.duration_mins), (f'Film {imdb_id}', 1999, 101))
+        self.assertEqual(FilmDb.objects.get(imdb_id='01000006').title, 'Old title')
+        self.assertFalse(FilmDb.objects.filter(imdb_id='01000007').exists())
+
+
+class NotificationsFanOutTests(TestCase):
+
+    def setUp(self):
+        self.activator = User.objects.create_user('activator', 'activator@fakemail.com', 'pass')
+        self.club = Club.objects.create(id='123456', name='Club', short_description='Club', founder=self.activator)
+        self.recipients = [User.objects.create_user(f'member{i}', f'member{i}@fakemail.com', 'pass') for i in range(5)]
+
+    def test_one_notification_per_recipient_in_batches(self):
+        counters_versions = {}
+        for recipient in self.recipients:
+            counters_versions[recipient.id] = UnreadNotificationsCounter.get_version(recipient.id)
+            UnreadNotificationsCounter.add(recipient.id, counters_versions[recipient.id], 0)
+        recipients = self.recipients + [self.recipients[0], self.recipients[1].id]
+        notifications = build_notifications(Notification.ABANDONED, recipients, club=self.club)
+        with CaptureQueriesContext(connection) as context:
+            save_notifications(notifications, batch_size=2)
+        inserts = [query for query in context.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(sorted(Notification.objects.values_list('recipient_id', flat=True)),
+                         sorted(recipient.id for recipient in self.recipients))
+        for recipient in self.recipients:
+            counter_version = UnreadNotificationsCounter.get_version(recipient.id)
+            self.assertNotEqual(counter_version, counters_versions[recipient.id])
+            self.assertIsNone(UnreadNotificationsCounter.get(recipient.id, counter_version))
+
+    def test_recipients_queryset_fetched_in_one_query(self):
+        with self.assertNumQueries(1):
+            notifications = build_notifications(Notification.ABANDONED, User.objects.exclude(id=self.activator.id),
+                                                club=self.club)
+        self.assertEqual({ntf.recipient_id for ntf in notifications}, {recipient.id for recipient in self.recipients})
@@ -35,9 +35,19 @@ urlpatterns = [
         views.notification_dispatcher,
         name='notification_dispatcher'
     ),
+    path(
+        'notifications_list/',
+        views.notifications_list,
+        name='notifications_list'
+    ),
     path(
         'notification_cleaner/',
         views.notification_cleaner,
         name='notification_cleaner'
     ),
+    path(
+        'cache_stats/',
+        views.cache_stats,
+        name='cache_stats'
+    ),
 ]
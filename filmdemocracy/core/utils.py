@@ -1,45 +1,108 @@
 import random
-import requests
+import uuid
 from datetime import datetime, timezone
 import re
 
-from django.contrib import messages
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.shortcuts import get_object_or_404
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMultiAlternatives
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
 from django.template import loader
+from django.utils.html import escape
 
-from filmdemocracy.core.models import Notification
-from filmdemocracy.democracy.models import Film, Vote, Club, Meeting, Invitation
+from filmdemocracy.core.models import Notification, OutboxEmail, UnreadNotificationsCounter
+from filmdemocracy.democracy.models import Film, Club, Meeting, Invitation
 from filmdemocracy.chat.models import ChatUsersInfo
 from filmdemocracy.democracy.models import CLUB_ID_N_DIGITS, FILM_ID_N_DIGITS
 from filmdemocracy.registration.models import User
-from filmdemocracy.secrets import OMDB_API_KEY
 
 
-def user_is_club_member_check(user, club_id=None, club=None):
-    if club is None and club_id:
-        club = get_object_or_404(Club, id=club_id)
-    club_members = club.members.filter(is_active=True)
-    return user in club_members
+class ClubResolver:
+    """
+    Request-scoped access to a club and to its active members and admins, so that the permission checks, the
+    views and the context processors load each of them at most once per request.
+    """
 
+    def __init__(self, club_id, club=None):
+        self.club_id = club_id
+        self._club = club
+        self._members = None
+        self._admins = None
+        self._members_ids = None
+        self._admins_ids = None
+
+    @classmethod
+    def for_request(cls, request, club_id=None, club=None):
+        club_id = str(club.id if club is not None else club_id)
+        if not hasattr(request, 'club_resolvers'):
+            request.club_resolvers = {}
+        if club_id not in request.club_resolvers:
+            request.club_resolvers[club_id] = cls(club_id, club)
+        return request.club_resolvers[club_id]
+
+    @property
+    def club(self):
+        if self._club is None:
+            self._club = get_object_or_404(Club, id=self.club_id)
+        return self._club
+
+    @property
+    def members(self):
+        if self._members is None:
+            self._members = list(self.club.members.filter(is_active=True))
+        return self._members
+
+    @property
+    def admins(self):
+        if self._admins is None:
+            self._admins = list(self.club.admin_members.filter(is_active=True))
+        return self._admins
+
+    @property
+    def members_ids(self):
+        if self._members_ids is None:
+            if self._members is not None:
+                self._members_ids = {member.id for member in self._members}
+            else:
+                self._members_ids = set(self.club.members.filter(is_active=True).values_list('id', flat=True))
+        return self._members_ids
+
+    @property
+    def admins_ids(self):
+        if self._admins_ids is None:
+            if self._admins is not None:
+                self._admins_ids = {admin.id for admin in self._admins}
+            else:
+                self._admins_ids = set(self.club.admin_members.filter(is_active=True).values_list('id', flat=True))
+        return self._admins_ids
+
+    def is_member(self, user):
+        return user.id in self.members_ids
+
+    def is_admin(self, user):
+        return self.is_member(user) and user.id in self.admins_ids
+
+    def is_organizer(self, user, meeting_id):
+        meeting = get_object_or_404(Meeting, id=meeting_id)
+        return self.is_member(user) and user.id == meeting.organizer_id
+
+
+def get_request_club(request, club_id):
+    return ClubResolver.for_request(request, club_id).club
 
-def user_is_club_admin_check(user, club_id=None, club=None):
-    if club is None and club_id:
-        club = get_object_or_404(Club, id=club_id)
-    club_members = club.members.filter(is_active=True)
-    club_admins = club.admin_members.filter(is_active=True)
-    return user in club_members and user in club_admins
 
+def user_is_club_member_check(request, club_id=None, club=None):
+    return ClubResolver.for_request(request, club_id, club).is_member(request.user)
 
-def user_is_organizer_check(user, club_id=None, club=None, meeting_id=None):
-    if club is None and club_id:
-        club = get_object_or_404(Club, id=club_id)
-    meeting = get_object_or_404(Meeting, id=meeting_id)
-    club_members = club.members.filter(is_active=True)
-    return user in club_members and user == meeting.organizer
+
+def user_is_club_admin_check(request, club_id=None, club=None):
+    return ClubResolver.for_request(request, club_id, club).is_admin(request.user)
+
+
+def user_is_organizer_check(request, club_id=None, club=None, meeting_id=None):
+    return ClubResolver.for_request(request, club_id, club).is_organizer(request.user, meeting_id)
 
 
 def users_know_each_other_check(user, chat_user_id=None, chat_user=None):
@@ -60,7 +123,7 @@ def add_club_context(context, club):
     return context
 
 
-def fill_options_string(view_option=None, order_option=None, display_option=None):
+def fill_options_string(view_option=None, order_option=None, display_option=None, cursor=None):
     options_string = ''
     if view_option and view_option != 'all':
         options_string += f'&view={view_option}'
@@ -68,6 +131,8 @@ def fill_options_string(view_option=None, order_option=None, display_option=None
         options_string += f'&order={order_option}'
     if display_option and display_option != 'posters':
         options_string += f'&display={display_option}'
+    if cursor:
+        options_string += f'&after={cursor}'
     return options_string
 
 
@@ -84,229 +149,82 @@ def extract_options(options_string=None):
         return '', '', ''
 
 
-def update_filmdb_omdb_info(filmdb):
-    """ Returns True if the database has been updated, and False otherwise """
-    omdb_api_url = f'http://www.omdbapi.com/?i=tt{filmdb.imdb_id}&plot=full&apikey={OMDB_API_KEY}'
-    response = requests.get(omdb_api_url)
-    if response.status_code == requests.codes.ok:
-        try:
-            omdb_data = response.json()
-            filmdb.title = omdb_data['Title']
-            filmdb.year = int(omdb_data['Year'][0:4])
-            filmdb.director = omdb_data['Director']
-            filmdb.writer = omdb_data['Writer']
-            filmdb.actors = omdb_data['Actors']
-            filmdb.poster_url = omdb_data['Poster']
-            filmdb.duration = omdb_data['Runtime']
-            filmdb.language = omdb_data['Language']
-            filmdb.rated = omdb_data['Rated']
-            filmdb.country = omdb_data['Country']
-            filmdb.plot = omdb_data['Plot']
-            filmdb.save()
-        except KeyError:
-            return False
-        return True
-    else:
-        return False
+def extract_cursor(options_string=None):
+    """ Keyset pagination cursor of the options string (see KeysetPaginator), or None for the first page """
+    cursor = re.search(r'&after=([0-9a-f]+)', options_string) if options_string else None
+    return cursor.group(1) if cursor else None
 
 
-class RankingFilm:
-    """ Helping class to process each film in the generate_ranking method of the RankingAlgorithm class """
-
-    def __init__(self, film, participants, ranking_config):
-        self.film = film
-        self.id = film.public_id
-        self.participants = participants
-        self.ranking_config = ranking_config
-        self.film_votes = None
-        self.film_voters = None
-        self.abstentionists = None
-        self.positive_votes = None
-        self.neutral_votes = None
-        self.negative_votes = None
-        self.veto = False
-        self.points = None
-        self.warnings = None
-
-    def process_votes(self):
-        self.film_votes = self.film.vote_set.all()
-        if self.film_votes:
-            self.film_voters = [vote.user for vote in self.film_votes]
-            self.abstentionists = self.get_abstentionists()
-            self.positive_votes = self.get_positive_votes()
-            self.neutral_votes = self.get_neutral_votes()
-            self.negative_votes = self.get_negative_votes()
-            self.veto = self.veto_test()
-            self.points = self.get_points()
-            self.warnings = self.get_warnings()
-
-    def get_abstentionists(self):
-        abstentionists = []
-        for participant in self.participants:
-            if participant not in self.film_voters:
-                abstentionists.append(participant)
-        return abstentionists
-
-    def get_positive_votes(self):
-        positive_votes = []
-        for vote in self.film_votes:
-            if vote.user in self.participants and vote.vote_karma is 'positive':
-                positive_votes.append(vote)
-        return positive_votes
-
-    def get_neutral_votes(self):
-        neutral_votes = []
-        for vote in self.film_votes:
-            if vote.user in self.participants and vote.vote_karma is 'neutral':
-                neutral_votes.append(vote)
-        return neutral_votes
-
-    def get_negative_votes(self):
-        negative_votes = []
-        for vote in self.film_votes:
-            if vote.user in self.participants and vote.vote_karma is 'negative':
-                negative_votes.append(vote)
-        return negative_votes
-
-    def veto_test(self):
-        for vote in self.negative_votes:
-            if vote.choice == Vote.VETO:
-                return True
-        return False
+def random_free_id(queryset, id_field, n_digits, max_attempts=20):
+    """
+    Picks an integer in the [10**(n_digits-1), 10**n_digits-1] range that is not already used as id_field in the
+    queryset. Random candidates are checked one by one, so the cost does not depend on how many ids are taken.
+    Only when the range is almost full it falls back to computing all the free ids.
+    """
+    for attempt in range(max_attempts):
+        candidate_id = str(random.randrange(10**(n_digits-1), 10**n_digits))
+        if not queryset.filter(**{id_field: candidate_id}).exists():
+            return candidate_id
+    used_ids = set(queryset.values_list(id_field, flat=True))
+    free_ids = [free_id for free_id in map(str, range(10**(n_digits-1), 10**n_digits)) if free_id not in used_ids]
+    return random.choice(free_ids)
 
-    def get_veto_warnings(self):
-        veto_warnings = []
-        for vote in self.negative_votes:
-            if vote.choice == Vote.VETO:
-                veto_warnings.append({
-                    'type': Vote.VETO,
-                    'film': self.film.db.title,
-                    'voter': vote.user.username,
-                })
-        return veto_warnings
-
-    def get_not_present_omg_warnings(self):
-        not_present_omg_warnings = []
-        for vote in self.film_votes:
-            if vote.user not in self.participants and vote.choice == Vote.OMG:
-                not_present_omg_warnings.append({
-                    'type': Vote.OMG,
-                    'film': self.film.db.title,
-                    'voter': vote.user.username,
-                })
-        return not_present_omg_warnings
-
-    def get_proposer_not_present_warning(self):
-        proposer_not_present_warning = []
-        if self.film.proposed_by not in self.participants:
-            proposer_not_present_warning.append({
-                'type': 'proposer missing',
-                'film': self.film.db.title,
-                'voter': self.film.proposed_by.username,
-            })
-        return proposer_not_present_warning
-
-    def get_points(self):
-        points_mapping = self.ranking_config['points_mapping']
-        points = 0
-        for vote in self.positive_votes + self.neutral_votes + self.negative_votes:
-            points += points_mapping[vote.choice]
-        return points
-
-    def get_warnings(self):
-        warnings = []
-        warnings_generators = [
-            self.get_veto_warnings,
-            self.get_not_present_omg_warnings,
-            self.get_proposer_not_present_warning,
-        ]
-        for warnings_generator in warnings_generators:
-            warnings += warnings_generator()
-        return warnings
 
+def random_club_id_generator(n_digits=CLUB_ID_N_DIGITS):
+    """ Picks a free club id """
+    return random_free_id(Club.objects.all(), 'id', n_digits)
 
-class RankingGenerator:
-    """ The algorithm to produce the film ranking """
 
-    def __init__(self, request, club_id):
-        self.request = request
-        self.club_id = club_id
-        self.participants = None
-        self.config = {}
+def random_film_public_id_generator(club, n_digits=FILM_ID_N_DIGITS):
+    """ Picks a free film public id among the ones in the club """
+    return random_free_id(Film.objects.filter(club=club), 'public_id', n_digits)
 
-    @staticmethod
-    def get_points_mapping():
-        points_mapping = {
-            Vote.VETO: -10000,
-            Vote.SEENNO: -50,
-            Vote.NO: -25,
-            Vote.MEH: 0,
-            Vote.SEENOK: +5,
-            Vote.YES: +10,
-            Vote.OMG: +20,
-        }
-        return points_mapping
-
-    def init_config(self):
-        self.config['points_mapping'] = self.get_points_mapping()
-        self.config['exclude_not_present'] = self.request.GET.get('exclude_not_present')
-        max_duration_input = self.request.GET.get('max_duration')
-        if max_duration_input == '':
-            self.config['max_duration'] = 999
-        else:
-            try:
-                self.config['max_duration'] = int(max_duration_input)
-            except ValueError:
-                messages.error(self.request, _('Invalid maximum film duration input! Filter not applied.'))
-                self.config['max_duration'] = 999
-
-    def include_film_in_ranking_check(self, film):
-        if film.proposed_by not in self.participants and self.config['exclude_not_present']:
-            return False
-        else:
-            if film.db.duration_in_mins_int > self.config['max_duration']:
-                return False
-            else:
-                return True
-
-    def generate_ranking(self):
-        ranking_results = []
-        self.init_config()
-        self.participants = [get_object_or_404(User, id=mid) for mid in self.request.GET.getlist('members')]
-        club_films = Film.objects.filter(club_id=self.club_id, seen=False)
-        for film in club_films:
-            if self.include_film_in_ranking_check(film):
-                ranking_film = RankingFilm(film, self.participants, self.config)
-                ranking_film.process_votes()
-                ranking_results.append({
-                    'film': ranking_film.film,
-                    'duration': str(ranking_film.film.db.duration_in_mins_int),
-                    'positive_votes': ranking_film.positive_votes,
-                    'neutral_votes': ranking_film.neutral_votes,
-                    'negative_votes': ranking_film.negative_votes,
-                    'abstentionists': ranking_film.abstentionists,
-                    'points': ranking_film.points,
-                    'veto': ranking_film.veto,
-                    'warnings': ranking_film.warnings,
-                })
-        return ranking_results, self.participants
 
+def create_with_random_id(model, id_field, id_generator, max_attempts=5, **fields):
+    """
+    Creates the object with an id from id_generator. A concurrent request may take the same id between the check
+    and the insert, in which case the unique constraint rejects the insert and the object is retried with another id.
+    """
+    for attempt in range(max_attempts):
+        try:
+            with transaction.atomic():
+                return model.objects.create(**{id_field: id_generator()}, **fields)
+        except IntegrityError:
+            if attempt == max_attempts - 1:
+                raise
 
-def random_club_id_generator(n_digits=CLUB_ID_N_DIGITS):
-    """ Picks an integer in the [10**(n_digits-1), 10**n_digits-1] range among the free ones """
-    base_ids = list(range(10**(n_digits-1), 10**n_digits - 1))
-    club_ids = Club.objects.values_list('id', flat=True)
-    free_ids = list(set(base_ids) - set(club_ids))
-    return str(random.choice(free_ids)).zfill(n_digits)
 
+def create_club_with_random_id(**fields):
+    return create_with_random_id(Club, 'id', random_club_id_generator, **fields)
 
-def random_film_public_id_generator(club, n_digits=FILM_ID_N_DIGITS):
-    """ Picks an integer in the [10**(n_digits-1), 10^n_digits-1] range among the free ones in the club """
-    club_films = Film.objects.filter(club=club)
-    base_ids = list(range(10**(n_digits-1), 10**n_digits - 1))
-    films_public_ids = club_films.values_list('public_id', flat=True)
-    free_ids = list(set(base_ids) - set(films_public_ids))
-    return str(random.choice(free_ids)).zfill(n_digits)
+
+def create_film_with_random_public_id(club, **fields):
+    return create_with_random_id(Film, 'public_id', lambda: random_film_public_id_generator(club), club=club, **fields)
+
+
+def build_notifications(ntf_type, recipients, activator=None, club=None, object_id=None):
+    """ Unsaved notifications for the given recipients, a users queryset (fetched in one query) or users/ids list """
+    if isinstance(recipients, QuerySet):
+        recipients_ids = recipients.values_list('id', flat=True)
+    else:
+        recipients_ids = [getattr(recipient, 'id', recipient) for recipient in recipients]
+    return [
+        Notification(type=ntf_type, activator=activator, club=club, object_id=object_id, recipient_id=recipient_id)
+        for recipient_id in set(recipients_ids)
+    ]
+
+
+def save_notifications(notifications, batch_size=500):
+    """ Inserts the notifications in batches and invalidates the unread counters of their recipients """
+    if not notifications:
+        return
+    with transaction.atomic():
+        Notification.objects.bulk_create(notifications, batch_size=batch_size)
+    UnreadNotificationsCounter.invalidate_many(ntf.recipient_id for ntf in notifications if not ntf.read)
+
+
+def bulk_create_notifications(ntf_type, recipients, activator=None, club=None, object_id=None):
+    save_notifications(build_notifications(ntf_type, recipients, activator, club, object_id))
 
 
 class NotificationsHelper:
@@ -317,14 +235,17 @@ class NotificationsHelper:
         self.messages = []
         self.unread_count = 0
         self.max_notifications = 50
+        self.max_notifications_loaded = 200
+        self.page_size = 10
+        self.has_next = False
 
     def check_user_is_anonymous(self):
         return self.request.user.is_anonymous
 
-    def build_ntf_message(self, ntf, ntf_type, ntf_ids, object_id=None, object_name=None, counter=0, image_url=None):
+    def build_ntf_message(self, ntf, ntf_type, ntf_ids, object_id=None, object_name=None, counter=0, ntf_object=None):
         ntf_message = {
             'type': ntf_type,
-            'image_url': self.get_notification_image_url(ntf, ntf_type, object_id),
+            'image_url': self.get_notification_image_url(ntf, ntf_type, ntf_object),
             'activator': ntf.activator,
             'object_id': object_id,
             'object_name': object_name,
@@ -363,40 +284,38 @@ class NotificationsHelper:
         }
         return image_url_generator_mapping
 
-    def get_notification_image_url(self, ntf, ntf_type, object_id):
+    def get_notification_image_url(self, ntf, ntf_type, ntf_object):
         image_url_generator_mapping = self.get_image_url_object_mapping()
         image_url_generator = image_url_generator_mapping[ntf_type]
-        return image_url_generator(ntf, object_id)
+        return image_url_generator(ntf, ntf_object)
 
     @staticmethod
-    def get_website_image_url(ntf, object_id):
+    def get_website_image_url(ntf, ntf_object):
         return '/static/core/svg/web_letters.svg'
 
     @staticmethod
-    def get_activator_image_url(ntf, object_id):
+    def get_activator_image_url(ntf, ntf_object):
         if ntf.activator.profile_image:
             return ntf.activator.profile_image.url
         else:
             return '/static/registration/svg/user_no_profile_image.svg'
 
     @staticmethod
-    def get_member_image_url(ntf, object_id):
-        member = User.objects.get(id=object_id)
-        if member.profile_image:
-            return member.profile_image.url
+    def get_member_image_url(ntf, ntf_object):
+        if ntf_object.profile_image:
+            return ntf_object.profile_image.url
         else:
             return '/static/registration/svg/user_no_profile_image.svg'
 
     @staticmethod
-    def get_film_image_url(ntf, object_id):
-        film = Film.objects.get(id=object_id)
-        if film.db.poster_url:
-            return film.db.poster_url
+    def get_film_image_url(ntf, ntf_object):
+        if ntf_object.db.poster_url:
+            return ntf_object.db.poster_url
         else:
             return None
 
     @staticmethod
-    def get_club_image_url(ntf, object_id):
+    def get_club_image_url(ntf, ntf_object):
         if ntf.club.logo_image:
             return ntf.club.logo_image.url
         else:
@@ -405,128 +324,185 @@ class NotificationsHelper:
     def get_user_notifications(self):
         return Notification.objects.filter(recipient=self.request.user)
 
-    def get_processing_mapping(self):
-        processing_mapping = {
-            Notification.SIGNUP: self.process_base_notifications,
-            Notification.JOINED: self.process_member_notifications,
-            Notification.LEFT: self.process_base_notifications,
-            Notification.MEET_ORGAN: self.process_meetings_notifications,
-            Notification.MEET_EDIT: self.process_meetings_notifications,
-            Notification.MEET_DEL: self.process_meetings_notifications,
-            Notification.SEEN_FILM: self.process_seen_films_notifications,
-            Notification.PROMOTED: self.process_member_notifications,
-            Notification.KICKED: self.process_member_notifications,
-            Notification.ADDED_FILM: self.process_added_films_notification,
-            Notification.COMM_FILM: self.process_comments_notifications,
-            Notification.COMM_COMM: self.process_comments_notifications,
-            Notification.ABANDONED: self.process_base_notifications,
-            Notification.INVITED: self.process_invitation_notifications,
+    def get_unread_count(self):
+        """ Number of unread messages of the notifications list, cached until the user notifications change """
+        counter_version = UnreadNotificationsCounter.get_version(self.request.user.id)
+        unread_count = UnreadNotificationsCounter.get(self.request.user.id, counter_version)
+        if unread_count is None:
+            unread_count = self.load_unread_count()
+            UnreadNotificationsCounter.add(self.request.user.id, counter_version, unread_count)
+        return unread_count
+
+    def mark_as_read(self, ntf_ids=None):
+        """ Marks the given notifications of the user as read (all of them if no ids are given) """
+        unread_notifications = self.get_user_notifications().filter(read=False)
+        if ntf_ids is None:
+            unread_notifications.update(read=True)
+        else:
+            unread_notifications.filter(id__in=ntf_ids).update(read=True)
+        UnreadNotificationsCounter.invalidate(self.request.user.id)
+
+    @staticmethod
+    def serialize_ntf_message(ntf_message):
+        serialized_message = dict(ntf_message)
+        serialized_message['activator'] = ntf_message['activator'].username if ntf_message['activator'] else None
+        serialized_message['object_id'] = str(ntf_message['object_id']) if ntf_message['object_id'] else None
+        serialized_message['created_datetime'] = ntf_message['created_datetime'].isoformat()
+        return serialized_message
+
+    @staticmethod
+    def get_object_queryset_mapping():
+        """ Querysets to fetch the object referenced by each notification type, None if it references no object """
+        films = Film.objects.select_related('db')
+        object_queryset_mapping = {
+            Notification.SIGNUP: None,
+            Notification.JOINED: User.objects.all(),
+            Notification.LEFT: None,
+            Notification.MEET_ORGAN: Meeting.objects.all(),
+            Notification.MEET_EDIT: Meeting.objects.all(),
+            Notification.MEET_DEL: Meeting.objects.all(),
+            Notification.SEEN_FILM: films,
+            Notification.PROMOTED: User.objects.all(),
+            Notification.KICKED: User.objects.all(),
+            Notification.ADDED_FILM: films,
+            Notification.COMM_FILM: films,
+            Notification.COMM_COMM: films,
+            Notification.ABANDONED: None,
+            Notification.INVITED: Invitation.objects.all(),
         }
-        return processing_mapping
+        return object_queryset_mapping
+
+    def get_notifications_objects(self, notifications):
+        """ Fetches the objects referenced by the notifications with one in_bulk query per model """
+        object_queryset_mapping = self.get_object_queryset_mapping()
+        model_querysets = {}
+        model_objects_ids = {}
+        for ntf in notifications:
+            object_queryset = object_queryset_mapping[ntf.type]
+            if object_queryset is not None:
+                model_querysets.setdefault(object_queryset.model, object_queryset)
+                model_objects_ids.setdefault(object_queryset.model, set()).add(ntf.object_id)
+        notifications_objects = {}
+        for model, objects_ids in model_objects_ids.items():
+            for object_id, ntf_object in model_querysets[model].in_bulk(objects_ids).items():
+                notifications_objects[model, object_id] = ntf_object
+        return notifications_objects
 
-    def process_notifications(self):
-        self.notifications = self.get_user_notifications()
-        if self.notifications:
-            processing_mapping = self.get_processing_mapping()
-            for ntf_type, processing_function in processing_mapping.items():
-                processing_function(ntf_type)
-        self.messages = sorted(self.messages, key=lambda k: k['created_datetime'], reverse=True)[0:self.max_notifications]
-
-    def process_base_notifications(self, notification_type):
-        for ntf in self.notifications.filter(type=notification_type):
-            if not ntf.read:
-                self.unread_count += 1
-            self.messages.append(self.build_ntf_message(ntf, ntf.type, ntf.id))
-
-    def process_meetings_notifications(self, notification_type):
-        for ntf in self.notifications.filter(type=notification_type):
-            try:
-                object_meeting = Meeting.objects.get(id=ntf.object_id)
-                if not ntf.read:
-                    self.unread_count += 1
-                self.messages.append(self.build_ntf_message(ntf, ntf.type, ntf.id, object_meeting.id, object_meeting.name))
-            except Meeting.DoesNotExist:
-                pass
-
-    def process_seen_films_notifications(self, notification_type):
-        for ntf in self.notifications.filter(type=notification_type):
-            try:
-                object_film = Film.objects.get(id=ntf.object_id)
-                if not ntf.read:
-                    self.unread_count += 1
-                self.messages.append(self.build_ntf_message(ntf, ntf.type, ntf.id, object_film.id, object_film.db.title))
-            except Film.DoesNotExist:
-                pass
-
-    def process_member_notifications(self, notification_type):
-        for ntf in self.notifications.filter(type=notification_type):
-            try:
-                object_member = User.objects.get(id=ntf.object_id)
-                if not ntf.read:
-                    self.unread_count += 1
-                if object_member == self.request.user:
-                    ntf_type = ntf.type + '_self'
-                else:
-                    ntf_type = ntf.type
-                self.messages.append(self.build_ntf_message(ntf, ntf_type, ntf.id, object_member.id, object_member.username))
-            except User.DoesNotExist:
-                pass
-
-    def process_added_films_notification(self, notification_type):
-        ntfs_group = self.notifications.filter(type=notification_type).order_by('-created_datetime')
-        for i, ntfs_subgroup in enumerate([ntfs_group.filter(read=True), ntfs_group.filter(read=False)]):
-            ntf_activators = set(ntf.activator for ntf in ntfs_subgroup)
-            for ntf_activator in ntf_activators:
-                ntf_activator_group = ntfs_subgroup.filter(activator=ntf_activator.id)
-                ntf_ids = [ntf.id for ntf in ntf_activator_group]
-                last_ntf = ntf_activator_group.last()
-                try:
-                    object_film = Film.objects.get(id=last_ntf.object_id)
-                    if len(ntf_activator_group) > 1:
-                        counter = len(ntf_activator_group)
-                        ntf_type = last_ntf.type + 's'
-                    else:
-                        counter = 0
-                        ntf_type = last_ntf.type
-                    if i == 1:
-                        if not last_ntf.read:
-                            self.unread_count += 1
-                    self.messages.append(self.build_ntf_message(last_ntf, ntf_type, ntf_ids, object_film.id, object_film.db.title, counter))
-                except Film.DoesNotExist:
-                    pass
-
-    def process_comments_notifications(self, notification_type):
-        ntfs_group = self.notifications.filter(type=notification_type).order_by('-created_datetime')
-        for i, ntfs_subgroup in enumerate([ntfs_group.filter(read=True), ntfs_group.filter(read=False)]):
-            ntf_films = set(ntf.object_film for ntf in ntfs_subgroup)
-            for ntf_film in ntf_films:
-                ntf_film_group = ntfs_subgroup.filter(object_film=ntf_film.public_id)
-                ntf_ids = [ntf.id for ntf in ntf_film_group]
-                last_ntf = ntf_film_group.last()
-                try:
-                    object_film = Film.objects.get(id=last_ntf.object_id)
-                    if len(ntf_film_group) > 1:
-                        counter = len(ntf_film_group)
-                        ntf_type = last_ntf.type + 's'
-                    else:
-                        counter = 0
-                        ntf_type = last_ntf.type
-                    if i == 1:
-                        if not last_ntf.read:
-                            self.unread_count += 1
-                    self.messages.append(self.build_ntf_message(last_ntf, ntf_type, ntf_ids, object_film.public_id, object_film.db.title, counter))
-                except Film.DoesNotExist:
-                    pass
-
-    def process_invitation_notifications(self, notification_type):
-        for ntf in self.notifications.filter(type=notification_type):
-            try:
-                object_invitation = Invitation.objects.get(id=ntf.object_id)
-                if not ntf.read:
-                    self.unread_count += 1
-                self.messages.append(self.build_ntf_message(ntf, ntf.type, ntf.id, object_invitation.id))
-            except Invitation.DoesNotExist:
-                pass
+    @staticmethod
+    def get_ntf_group_key(ntf):
+        """ Notifications with the same group key are displayed as a single message """
+        if ntf.type == Notification.ADDED_FILM:
+            return ntf.type, ntf.read, ntf.activator_id
+        elif ntf.type in [Notification.COMM_FILM, Notification.COMM_COMM]:
+            return ntf.type, ntf.read, ntf.object_id
+        else:
+            return ntf.id
+
+    def get_ntf_object_name(self, ntf, ntf_object):
+        if ntf.type in [Notification.MEET_ORGAN, Notification.MEET_EDIT, Notification.MEET_DEL]:
+            return ntf_object.name
+        elif ntf.type in [Notification.SEEN_FILM, Notification.ADDED_FILM, Notification.COMM_FILM, Notification.COMM_COMM]:
+            return ntf_object.db.title
+        elif ntf.type in [Notification.JOINED, Notification.PROMOTED, Notification.KICKED]:
+            return ntf_object.username
+        else:
+            return None
+
+    def get_ntf_type(self, ntf, ntf_object, counter):
+        if ntf.type in [Notification.JOINED, Notification.PROMOTED, Notification.KICKED] and ntf_object == self.request.user:
+            return ntf.type + '_self'
+        elif counter > 1:
+            return ntf.type + 's'
+        else:
+            return ntf.type
+
+    def load_notifications(self):
+        return list(
+            self.get_user_notifications().select_related('activator', 'club').order_by('-created_datetime')[
+                0:self.max_notifications_loaded]
+        )
+
+    def get_ntfs_groups(self, notifications):
+        """
+        Groups the notifications displayed as a single message in a single pass over them: the added films
+        notifications by activator and the comments notifications by film. Notifications whose object no longer
+        exists are left out.
+        """
+        object_queryset_mapping = self.get_object_queryset_mapping()
+        notifications_objects = self.get_notifications_objects(notifications)
+        ntfs_groups = {}
+        for ntf in notifications:
+            object_queryset = object_queryset_mapping[ntf.type]
+            if object_queryset is not None:
+                ntf_object = notifications_objects.get((object_queryset.model, ntf.object_id))
+                if ntf_object is None:
+                    continue
+            else:
+                ntf_object = None
+            ntfs_group = ntfs_groups.setdefault(self.get_ntf_group_key(ntf), {'ntf': ntf, 'object': ntf_object, 'ids': []})
+            ntfs_group['ids'].append(ntf.id)
+        return list(ntfs_groups.values())
+
+    @staticmethod
+    def count_unread(ntfs_groups):
+        return sum(1 for ntfs_group in ntfs_groups if not ntfs_group['ntf'].read)
+
+    def load_unread_count(self):
+        """
+        Same count as count_unread over the groups of the loaded notifications, but fetching only the fields of the
+        notifications used to group them and the ids of the objects that still exist, instead of whole rows
+        """
+        ntfs_fields = self.get_user_notifications().order_by('-created_datetime').values_list(
+            'id', 'type', 'activator_id', 'object_id', 'read')[0:self.max_notifications_loaded]
+        unread_notifications = [
+            Notification(id=ntf_id, type=ntf_type, activator_id=activator_id, object_id=object_id, read=read)
+            for ntf_id, ntf_type, activator_id, object_id, read in ntfs_fields if not read
+        ]
+        object_queryset_mapping = self.get_object_queryset_mapping()
+        model_objects_ids = {}
+        for ntf in unread_notifications:
+            object_queryset = object_queryset_mapping[ntf.type]
+            if object_queryset is not None:
+                model_objects_ids.setdefault(object_queryset.model, set()).add(ntf.object_id)
+        existing_objects = {
+            (model, object_id)
+            for model, objects_ids in model_objects_ids.items()
+            for object_id in model.objects.filter(pk__in=objects_ids).values_list('pk', flat=True)
+        }
+        unread_groups_keys = set()
+        for ntf in unread_notifications:
+            object_queryset = object_queryset_mapping[ntf.type]
+            if object_queryset is None or (object_queryset.model, ntf.object_id) in existing_objects:
+                unread_groups_keys.add(self.get_ntf_group_key(ntf))
+        return len(unread_groups_keys)
+
+    def process_notifications(self, page=None):
+        """
+        Builds the messages of the newest notifications of the user, one per group of notifications.
+        If a page is given, only the messages of that page are built.
+        """
+        counter_version = UnreadNotificationsCounter.get_version(self.request.user.id)
+        self.notifications = self.load_notifications()
+        ntfs_groups = self.get_ntfs_groups(self.notifications)
+        self.unread_count = self.count_unread(ntfs_groups)
+        # The list count also drops the notifications of objects deleted since the cached count was computed
+        UnreadNotificationsCounter.set(self.request.user.id, counter_version, self.unread_count)
+        ntfs_groups = ntfs_groups[0:self.max_notifications]
+        if page is not None:
+            self.has_next = len(ntfs_groups) > page * self.page_size
+            ntfs_groups = ntfs_groups[(page - 1) * self.page_size:page * self.page_size]
+        for ntfs_group in ntfs_groups:
+            ntf, ntf_object, ntf_ids = ntfs_group['ntf'], ntfs_group['object'], ntfs_group['ids']
+            counter = len(ntf_ids) if len(ntf_ids) > 1 else 0
+            self.messages.append(self.build_ntf_message(
+                ntf,
+                self.get_ntf_type(ntf, ntf_object, counter),
+                ntf_ids,
+                ntf_object.id if ntf_object is not None else None,
+                self.get_ntf_object_name(ntf, ntf_object),
+                counter,
+                ntf_object,
+            ))
 
     def get_dispatch_url_mapping(self):
         processing_mapping = {
@@ -603,6 +579,9 @@ class SpamHelper:
         self.html_email_template = html_email_template
         self.domain_override = None
         self.default_context = self.get_default_context()
+        # Random, so that no text of the emails (usernames, club names...) can contain a substitution marker
+        self.substitution_token = uuid.uuid4().hex
+        self.substitution_regexp = re.compile(re.escape(f'[[{self.substitution_token}:') + r'(?P<key>\w+)\]\]')
 
     def get_default_context(self):
         default_context = {'user': self.request.user,
@@ -616,17 +595,60 @@ class SpamHelper:
             default_context['site_name'] = default_context['domain'] = self.domain_override
         return default_context
 
-    def send_emails(self, to_emails_list, email_context=None):
-        context = {**self.default_context, **email_context}
+    def get_substitution_marker(self, key):
+        return f'[[{self.substitution_token}:{key}]]'
+
+    def render_emails(self, email_context=None, substitution_keys=()):
+        """
+        Renders the subject and bodies once. The per-recipient substitution keys are rendered as markers, replaced
+        for each recipient by personalize_email.
+        """
+        context = {**self.default_context, **(email_context or {})}
+        context.update({key: self.get_substitution_marker(key) for key in substitution_keys})
         subject = loader.render_to_string(self.subject_template, context)
         subject = ''.join(subject.splitlines())  # http://nyphp.org/phundamentals/8_Preventing-Email-Header-Injection
         body = loader.render_to_string(self.email_template, context)
+        html_body = loader.render_to_string(self.html_email_template, context) if self.html_email_template else ''
+        return subject, body, html_body
+
+    def substitute_markers(self, text, substitutions, format_value):
+        """ Replaces all the markers in a single pass, so that the substituted values are never scanned again """
+        return self.substitution_regexp.sub(
+            lambda match: format_value(substitutions[match.group('key')]) if match.group('key') in substitutions
+            else match.group(0),
+            text,
+        )
+
+    def personalize_email(self, subject, body, html_body, substitutions):
+        subject = self.substitute_markers(subject, substitutions, lambda value: ''.join(str(value).splitlines()))
+        body = self.substitute_markers(body, substitutions, str)
+        html_body = self.substitute_markers(html_body, substitutions, escape)
+        return subject, body, html_body
+
+    def build_outbox_emails(self, to_emails_list, email_context=None, recipients_substitutions=None):
+        """
+        One outbox email per recipient, personalized with recipients_substitutions ({to_email: {key: value}}) if given
+        """
+        recipients_substitutions = recipients_substitutions or {}
+        substitution_keys = {key for substitutions in recipients_substitutions.values() for key in substitutions}
+        subject, body, html_body = self.render_emails(email_context, substitution_keys)
+        outbox_emails = []
         for to_email in to_emails_list:
-            email_messages = EmailMultiAlternatives(subject, body, self.from_email, [to_email])
-            if self.html_email_template:
-                html_email = loader.render_to_string(self.html_email_template, context)
-                email_messages.attach_alternative(html_email, 'text/html')
-            email_messages.send()
+            substitutions = {key: '' for key in substitution_keys}
+            substitutions.update(recipients_substitutions.get(to_email, {}))
+            email_subject, email_body, email_html_body = self.personalize_email(subject, body, html_body, substitutions)
+            outbox_emails.append(OutboxEmail(from_email=self.from_email, to_email=to_email, subject=email_subject,
+                                             body=email_body, html_body=email_html_body))
+        return outbox_emails
+
+    def queue_emails(self, to_emails_list, email_context=None, recipients_substitutions=None):
+        """ Renders the email once and queues a copy for each recipient, sent later by send_queued_emails """
+        outbox_emails = self.build_outbox_emails(to_emails_list, email_context, recipients_substitutions)
+        OutboxEmail.objects.bulk_create(outbox_emails, batch_size=500)
+
+    @staticmethod
+    def get_members_substitutions(members):
+        return {member.email: {'recipient_name': member.username} for member in members}
 
 
 def time_ago_format(datetime_diff):
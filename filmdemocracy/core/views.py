@@ -1,39 +1,69 @@
 import hashlib
 import uuid
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect
-from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.template.loader import render_to_string
 from django.views import generic
 from django.utils.decorators import method_decorator
 
-from filmdemocracy.core.models import Notification
 from filmdemocracy.democracy.models import Invitation
 from filmdemocracy.core.utils import NotificationsHelper
+from filmdemocracy.core.search import AutocompleteCache
+from filmdemocracy.democracy.ranking import RankingCache
 
 
 @login_required
 def notification_dispatcher(request, ntf_type, ntf_club_id, ntf_object_id):
-    notifications_helper = NotificationsHelper()
+    notifications_helper = NotificationsHelper(request)
     url = notifications_helper.get_dispatch_url(ntf_type, ntf_club_id, ntf_object_id)
     ntf_ids_string = request.POST.get('ntf_ids')
-    for ntf_id in ntf_ids_string.split('_'):
-        ntf = get_object_or_404(Notification, id=uuid.UUID(ntf_id).hex, recipient=request.user)
-        ntf.read = True
-        ntf.save()
+    try:
+        ntf_ids = [uuid.UUID(ntf_id) for ntf_id in ntf_ids_string.split('_')]
+    except (AttributeError, ValueError):
+        raise Http404
+    notifications_helper.mark_as_read(ntf_ids)
     return HttpResponseRedirect(url)
 
 
+@login_required
+def notifications_list(request):
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    notifications_helper = NotificationsHelper(request)
+    notifications_helper.process_notifications(page=page)
+    html = render_to_string('core/notifications_list.html', {
+        'notifications': notifications_helper.messages,
+        'has_next': notifications_helper.has_next,
+        'next_page': page + 1,
+    }, request=request)
+    return JsonResponse({
+        'page': page,
+        'has_next': notifications_helper.has_next,
+        'unread_count': notifications_helper.unread_count,
+        'notifications': [notifications_helper.serialize_ntf_message(ntf) for ntf in notifications_helper.messages],
+        'html': html,
+    })
+
+
 @login_required
 def notification_cleaner(request):
     notifications_helper = NotificationsHelper(request)
-    notifications = notifications_helper.get_user_notifications()
-    for ntf in notifications:
-        ntf.read = True
-        ntf.save()
+    notifications_helper.mark_as_read()
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse({
+        'autocomplete': AutocompleteCache.get_stats(),
+        'ranking': RankingCache.get_stats(),
+    })
+
+
 class HomeView(generic.TemplateView):
 
     def get_context_data(self, **kwargs):
@@ -107,9 +107,10 @@ class FilmDb(models.Model):
     imdb_rating = models.CharField('IMDb rating', default='', max_length=3)
     metascore = models.CharField('Metascore', default='', max_length=3)
     title = models.CharField(default='', max_length=1000)
-    year = models.IntegerField(default=0)
+    year = models.IntegerField(default=0, db_index=True)
     rated = models.CharField(default='', max_length=20)
     duration = models.CharField(default='', max_length=20)
+    duration_mins = models.IntegerField('duration in minutes', default=0, db_index=True)
     director = models.CharField(default='', max_length=1000)
     writer = models.CharField(default='', max_length=1000)
     actors = models.CharField(default='', max_length=1000)
@@ -118,30 +119,28 @@ class FilmDb(models.Model):
     language = models.CharField(default='', max_length=1000)
     plot = models.CharField(default='', max_length=20000)
     created_datetime = models.DateTimeField('created datetime', auto_now_add=True)
-    last_updated_datetime = models.DateTimeField('last updated datetime', auto_now=True)
+    last_updated_datetime = models.DateTimeField('last updated datetime', auto_now=True, db_index=True)
     comment = models.TextField('site admin comments about the film', null=True, blank=True, max_length=1000)
 
     def __str__(self):
         return f'{self.title}'
 
-    @property
-    def slug(self):
-        return slugify(self.title)
+    def save(self, *args, **kwargs):
+        self.duration_mins = self.parse_duration_mins(self.duration)
+        return super().save(*args, **kwargs)
 
-    @property
-    def duration_in_mins_int(self):
-        """ Util to safely obtain the film duration in minutes (int) """
-        duration = str(self.duration)
+    @staticmethod
+    def parse_duration_mins(duration):
+        """ Util to safely obtain the film duration in minutes (int) from the duration string """
+        duration = str(duration).replace('min', '').strip()
         try:
-            duration_int = int(duration)
+            return int(duration)
         except ValueError:
-            if ' min' in self.duration:
-                duration_int = int(duration.replace(' min', ''))
-            elif 'min' in self.duration:
-                duration_int = int(duration.replace('min', ''))
-            else:
-                duration_int = 0
-        return duration_int
+            return 0
+
+    @property
+    def slug(self):
+        return slugify(self.title)
 
     @property
     def duration_str(self):
@@ -192,6 +191,11 @@ class Film(models.Model):
     created_datetime = models.DateTimeField('created datetime', auto_now_add=True)
     last_updated_datetime = models.DateTimeField('last updated datetime', auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['club', 'public_id'], name='unique_film_public_id_in_club'),
+        ]
+
     def __str__(self):
         return f'{self.id}|{self.db.title}'
 
@@ -262,6 +266,28 @@ class Vote(models.Model):
         return f'{self.user}|{self.film.db.title}|{self.choice}'
 
 
+class FilmVoteTally(models.Model):
+    """ Denormalized vote counts of a film, updated together with its votes. Fields are named after the vote choices """
+
+    film = models.OneToOneField(Film, primary_key=True, on_delete=models.CASCADE, related_name='vote_tally')
+    omg = models.PositiveIntegerField(default=0)
+    yes = models.PositiveIntegerField(default=0)
+    seenok = models.PositiveIntegerField(default=0)
+    meh = models.PositiveIntegerField(default=0)
+    no = models.PositiveIntegerField(default=0)
+    seenno = models.PositiveIntegerField(default=0)
+    veto = models.PositiveIntegerField(default=0)
+    points = models.IntegerField('points under the default points mapping', default=0)
+    last_updated_datetime = models.DateTimeField('last updated datetime', auto_now=True)
+
+    @property
+    def votes_count(self):
+        return sum(getattr(self, choice) for choice, choice_text in Vote.vote_choices)
+
+    def __str__(self):
+        return f'{self.film_id}|{self.votes_count}|{self.points}'
+
+
 class FilmComment(models.Model):
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -0,0 +1,400 @@
+import hashlib
+import numpy as np
+import uuid
+
+from django.contrib import messages
+from django.http import Http404
+from django.utils.translation import gettext_lazy as _
+from django.db import transaction
+from django.db.models import Count, F
+from django.core.cache import cache
+
+from filmdemocracy.democracy.models import Club, Film, FilmVoteTally, Vote
+from filmdemocracy.registration.models import User
+
+
+VOTE_CHOICES_CODES = {choice: code for code, (choice, choice_text) in enumerate(Vote.vote_choices)}
+
+
+class VoteMatrix:
+    """
+    Dense films x voters matrix with the int8 vote choice codes of the candidate films of a club.
+    The ranking of any subset of participants is computed with masked array operations over their columns.
+    """
+
+    NO_VOTE = -1
+    POSITIVE_CODES = [VOTE_CHOICES_CODES[choice] for choice in (Vote.OMG, Vote.YES, Vote.SEENOK)]
+    NEUTRAL_CODES = [VOTE_CHOICES_CODES[Vote.MEH]]
+    NEGATIVE_CODES = [VOTE_CHOICES_CODES[choice] for choice in (Vote.NO, Vote.SEENNO, Vote.VETO)]
+    VETO_CODE = VOTE_CHOICES_CODES[Vote.VETO]
+    OMG_CODE = VOTE_CHOICES_CODES[Vote.OMG]
+
+    def __init__(self, films, votes):
+        self.version = 0
+        self.films = list(films)
+        self.films_index = {film.id: i for i, film in enumerate(self.films)}
+        voters_ids = [film.proposed_by_id for film in self.films if film.proposed_by_id] + [vote.user_id for vote in votes]
+        self.voters_index = {}
+        for voter_id in voters_ids:
+            self.voters_index.setdefault(voter_id, len(self.voters_index))
+        self.codes = np.full((len(self.films), len(self.voters_index)), self.NO_VOTE, dtype=np.int8)
+        self.votes = {}
+        for vote in votes:
+            self.set_vote(vote)
+        self.durations = np.array([film.db.duration_mins for film in self.films], dtype=int)
+        self.proposers = np.array([self.voters_index.get(film.proposed_by_id, -1) for film in self.films], dtype=int)
+
+    def get_voter_index(self, voter_id):
+        """ Returns the column of the voter, appending an empty one if the voter is not in the matrix yet """
+        if voter_id not in self.voters_index:
+            self.voters_index[voter_id] = len(self.voters_index)
+            new_column = np.full((len(self.films), 1), self.NO_VOTE, dtype=np.int8)
+            self.codes = np.hstack([self.codes, new_column])
+        return self.voters_index[voter_id]
+
+    def set_vote(self, vote):
+        film_index, voter_index = self.films_index[vote.film_id], self.get_voter_index(vote.user_id)
+        self.codes[film_index, voter_index] = VOTE_CHOICES_CODES[vote.choice]
+        self.votes[film_index, voter_index] = vote
+
+    def refresh_films(self, films_ids):
+        """ Reloads from the database the votes of the given films, leaving the rest of the matrix untouched """
+        films_ids = [film_id for film_id in films_ids if film_id in self.films_index]
+        films_indexes = {self.films_index[film_id] for film_id in films_ids}
+        self.codes[list(films_indexes), :] = self.NO_VOTE
+        self.votes = {key: vote for key, vote in self.votes.items() if key[0] not in films_indexes}
+        for vote in Vote.objects.filter(film_id__in=films_ids).select_related('user'):
+            self.set_vote(vote)
+
+    @classmethod
+    def from_club(cls, club_id):
+        """ Builds the matrix of the club candidate films with one query for the films and one for their votes """
+        club_films = Film.objects.filter(club_id=club_id, seen=False).select_related('db', 'proposed_by')
+        club_votes = Vote.objects.filter(film__club_id=club_id, film__seen=False).select_related('user')
+        return cls(club_films, list(club_votes))
+
+    def get_participants_codes(self, participants_columns):
+        """ Choice codes of the participants columns. Participants not in the matrix have not voted any film """
+        participants_codes = np.full((len(self.films), len(participants_columns)), self.NO_VOTE, dtype=np.int8)
+        in_matrix = participants_columns >= 0
+        participants_codes[:, in_matrix] = self.codes[:, participants_columns[in_matrix]]
+        return participants_codes
+
+    def get_points(self, participants_codes, points_mapping):
+        # NO_VOTE (-1) picks the trailing zero of the points lookup vector
+        points_vector = np.array([points_mapping[choice] for choice in VOTE_CHOICES_CODES] + [0], dtype=int)
+        return points_vector[participants_codes].sum(axis=1)
+
+    def get_proposers_present(self, participants_mask):
+        proposers_present = np.zeros(len(self.films), dtype=bool)
+        has_proposer = self.proposers >= 0
+        proposers_present[has_proposer] = participants_mask[self.proposers[has_proposer]]
+        return proposers_present
+
+    def get_included_films(self, proposers_present, config):
+        included_films = self.durations <= config['max_duration']
+        if config['exclude_not_present']:
+            included_films &= proposers_present
+        return included_films
+
+    def get_film_votes(self, film_index, votes_mask, participants_columns):
+        return [self.votes[film_index, participants_columns[k]] for k in np.flatnonzero(votes_mask[film_index])]
+
+    def get_not_present_omg_warnings(self, participants_mask):
+        not_present_omg_warnings = {}
+        not_present_omg = (self.codes == self.OMG_CODE) & ~participants_mask
+        for film_index, voter_index in zip(*np.nonzero(not_present_omg)):
+            not_present_omg_warnings.setdefault(film_index, []).append({
+                'type': Vote.OMG,
+                'film': self.films[film_index].db.title,
+                'voter': self.votes[film_index, voter_index].user.username,
+            })
+        return not_present_omg_warnings
+
+    def rank(self, participants, config, films_ids=None):
+        """
+        Returns the ranking results of the candidate films for the given participants and ranking config.
+        If films_ids is given, only the results of those films are returned.
+        """
+        ranking_results = []
+        participants_columns = np.array([self.voters_index.get(p.id, -1) for p in participants], dtype=int)
+        participants_mask = np.zeros(len(self.voters_index), dtype=bool)
+        participants_mask[participants_columns[participants_columns >= 0]] = True
+        participants_codes = self.get_participants_codes(participants_columns)
+        abstentions = participants_codes == self.NO_VOTE
+        positive = np.isin(participants_codes, self.POSITIVE_CODES)
+        neutral = np.isin(participants_codes, self.NEUTRAL_CODES)
+        negative = np.isin(participants_codes, self.NEGATIVE_CODES)
+        vetoes = participants_codes == self.VETO_CODE
+        points = self.get_points(participants_codes, config['points_mapping'])
+        proposers_present = self.get_proposers_present(participants_mask)
+        included_films = self.get_included_films(proposers_present, config)
+        if films_ids is not None:
+            films_indexes = [self.films_index[film_id] for film_id in films_ids if film_id in self.films_index]
+            included_films &= np.isin(np.arange(len(self.films)), films_indexes)
+        not_present_omg_warnings = self.get_not_present_omg_warnings(participants_mask)
+        for film_index in np.flatnonzero(included_films):
+            film = self.films[film_index]
+            negative_votes = self.get_film_votes(film_index, negative, participants_columns)
+            warnings = [{
+                'type': Vote.VETO,
+                'film': film.db.title,
+                'voter': vote.user.username,
+            } for vote in negative_votes if vote.choice == Vote.VETO]
+            warnings += not_present_omg_warnings.get(film_index, [])
+            if film.proposed_by and not proposers_present[film_index]:
+                warnings.append({
+                    'type': 'proposer missing',
+                    'film': film.db.title,
+                    'voter': film.proposed_by.username,
+                })
+            ranking_results.append({
+                'film': film,
+                'duration': str(self.durations[film_index]),
+                'positive_votes': self.get_film_votes(film_index, positive, participants_columns),
+                'neutral_votes': self.get_film_votes(film_index, neutral, participants_columns),
+                'negative_votes': negative_votes,
+                'abstentionists': [participants[k] for k in np.flatnonzero(abstentions[film_index])],
+                'points': int(points[film_index]),
+                'veto': bool(vetoes[film_index].any()),
+                'warnings': warnings,
+            })
+        return ranking_results
+
+
+class RankingCache:
+    """
+    Per-club cache of the vote matrix and of the ranking snapshots computed from it for each participants set and
+    ranking config. A vote change only marks its film as touched, and the next ranking rescores just the touched
+    films. Changes in the club candidate films invalidate the whole club cache.
+    """
+
+    timeout = 60 * 60
+    hits_key = 'ranking_cache_hits'
+    misses_key = 'ranking_cache_misses'
+
+    def __init__(self, club_id):
+        self.club_id = club_id
+        self.generation = self.get_generation()
+
+    @staticmethod
+    def get_generation_key(club_id):
+        return f'ranking_generation_{club_id}'
+
+    def get_generation(self):
+        return cache.get(self.get_generation_key(self.club_id))
+
+    def start_generation(self):
+        self.generation = uuid.uuid4().hex
+        cache.set(self.get_generation_key(self.club_id), self.generation, self.timeout)
+        cache.set(self.key('version'), 0, self.timeout)
+
+    def key(self, *parts):
+        return '_'.join(['ranking', str(self.club_id), str(self.generation)] + [str(part) for part in parts])
+
+    @classmethod
+    def invalidate(cls, club_id):
+        """
+        To be called whenever the candidate films of the club change. Deferred until the current transaction
+        commits, so that no ranking is cached again from the data being replaced.
+        """
+        transaction.on_commit(lambda: cache.delete(cls.get_generation_key(club_id)))
+
+    @classmethod
+    def invalidate_filmdbs(cls, imdb_ids):
+        """ To be called whenever the database info of films changes, as the cached rankings show it """
+        clubs_ids = Film.objects.filter(db_id__in=list(imdb_ids), seen=False).values_list('club_id', flat=True)
+        for club_id in clubs_ids.order_by().distinct():
+            cls.invalidate(club_id)
+
+    @classmethod
+    def invalidate_member(cls, user_id):
+        """ To be called whenever the user info shown in the rankings (username, profile image) changes """
+        for club_id in Club.objects.filter(members__id=user_id).values_list('id', flat=True):
+            cls.invalidate(club_id)
+
+    @classmethod
+    def touch_film(cls, club_id, film_id):
+        """ To be called whenever a vote of the film changes. Deferred until the current transaction commits """
+        transaction.on_commit(lambda: cls.mark_film_touched(club_id, film_id))
+
+    @classmethod
+    def mark_film_touched(cls, club_id, film_id):
+        ranking_cache = cls(club_id)
+        if ranking_cache.generation is None:
+            return
+        try:
+            version = cache.incr(ranking_cache.key('version'))
+        except ValueError:
+            cls.invalidate(club_id)
+            return
+        cache.set(ranking_cache.key('touched', version), film_id, cls.timeout)
+
+    @classmethod
+    def count(cls, counter_key):
+        cache.add(counter_key, 0, None)
+        cache.incr(counter_key)
+
+    @classmethod
+    def get_stats(cls):
+        hits, misses = cache.get(cls.hits_key, 0), cache.get(cls.misses_key, 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+        }
+
+    def get_version(self):
+        version = cache.get(self.key('version')) if self.generation else None
+        if version is None:
+            # Without the version counter there is no way to know which films were touched
+            self.start_generation()
+            version = 0
+        return version
+
+    def get_touched_films(self, from_version, to_version):
+        """ Returns the ids of the films touched between both versions, or None if they are not known anymore """
+        if from_version > to_version:
+            return None
+        touched_keys = [self.key('touched', version) for version in range(from_version + 1, to_version + 1)]
+        touched_films = cache.get_many(touched_keys)
+        if len(touched_films) < len(touched_keys):
+            return None
+        return set(touched_films.values())
+
+    def get_vote_matrix(self, version):
+        vote_matrix = cache.get(self.key('matrix'))
+        touched_films = self.get_touched_films(vote_matrix.version, version) if vote_matrix else None
+        if touched_films is None:
+            vote_matrix = VoteMatrix.from_club(self.club_id)
+        elif touched_films:
+            vote_matrix.refresh_films(touched_films)
+        else:
+            return vote_matrix
+        vote_matrix.version = version
+        cache.set(self.key('matrix'), vote_matrix, self.timeout)
+        return vote_matrix
+
+    @staticmethod
+    def get_snapshot_digest(participants, config):
+        snapshot_id = '|'.join([
+            ','.join(sorted(str(participant.id) for participant in participants)),
+            str(config['max_duration']),
+            str(bool(config['exclude_not_present'])),
+            str(sorted(config['points_mapping'].items())),
+        ])
+        return hashlib.sha1(snapshot_id.encode('utf-8')).hexdigest()
+
+    def get_ranking(self, participants, config):
+        version = self.get_version()
+        snapshot_key = self.key('snapshot', self.get_snapshot_digest(participants, config))
+        snapshot = cache.get(snapshot_key)
+        if snapshot and snapshot['version'] == version:
+            self.count(self.hits_key)
+            return list(snapshot['results'].values())
+        vote_matrix = self.get_vote_matrix(version)
+        touched_films = self.get_touched_films(snapshot['version'], version) if snapshot else None
+        if touched_films is None:
+            self.count(self.misses_key)
+            results = {}
+            ranking_results = vote_matrix.rank(participants, config)
+        else:
+            self.count(self.hits_key)
+            results = {film_id: result for film_id, result in snapshot['results'].items() if film_id not in touched_films}
+            ranking_results = vote_matrix.rank(participants, config, films_ids=touched_films)
+        for result in ranking_results:
+            results[result['film'].id] = result
+        cache.set(snapshot_key, {'version': version, 'results': results}, self.timeout)
+        return list(results.values())
+
+
+class RankingGenerator:
+    """ The algorithm to produce the film ranking """
+
+    def __init__(self, request, club_id):
+        self.request = request
+        self.club_id = club_id
+        self.participants = None
+        self.config = {}
+
+    @staticmethod
+    def get_points_mapping():
+        points_mapping = {
+            Vote.VETO: -10000,
+            Vote.SEENNO: -50,
+            Vote.NO: -25,
+            Vote.MEH: 0,
+            Vote.SEENOK: +5,
+            Vote.YES: +10,
+            Vote.OMG: +20,
+        }
+        return points_mapping
+
+    def init_config(self):
+        self.config['points_mapping'] = self.get_points_mapping()
+        self.config['exclude_not_present'] = self.request.GET.get('exclude_not_present')
+        max_duration_input = self.request.GET.get('max_duration')
+        if max_duration_input == '':
+            self.config['max_duration'] = 999
+        else:
+            try:
+                self.config['max_duration'] = int(max_duration_input)
+            except ValueError:
+                messages.error(self.request, _('Invalid maximum film duration input! Filter not applied.'))
+                self.config['max_duration'] = 999
+
+    def get_participants(self):
+        participants_ids = set(self.request.GET.getlist('members'))
+        participants = list(User.objects.filter(id__in=participants_ids))
+        if len(participants) != len(participants_ids):
+            raise Http404('No User matches the given query.')
+        return participants
+
+    def generate_ranking(self):
+        self.init_config()
+        self.participants = self.get_participants()
+        ranking_results = RankingCache(self.club_id).get_ranking(self.participants, self.config)
+        return ranking_results, self.participants
+
+
+def get_vote_tally_fields(choices_counts):
+    """ Builds the FilmVoteTally fields from a {vote choice: number of votes} dict """
+    points_mapping = RankingGenerator.get_points_mapping()
+    tally_fields = {choice: choices_counts.get(choice, 0) for choice, choice_text in Vote.vote_choices}
+    tally_fields['points'] = sum(points_mapping[choice] * count for choice, count in tally_fields.items())
+    return tally_fields
+
+
+def lock_film_vote_tally(film):
+    """
+    Locks the film row until the end of the transaction, so that the tally writes of the film run one at a time:
+    a rebuild counting the votes cannot interleave with another rebuild or with an increment
+    """
+    list(Film.objects.select_for_update().filter(pk=film.pk).values_list('pk'))
+
+
+def rebuild_film_vote_tally(film):
+    with transaction.atomic():
+        lock_film_vote_tally(film)
+        choices_counts = dict(Vote.objects.filter(film=film).values_list('choice').annotate(Count('id')).order_by())
+        FilmVoteTally.objects.update_or_create(film=film, defaults=get_vote_tally_fields(choices_counts))
+
+
+def update_film_vote_tally(film, old_choice=None, new_choice=None):
+    """ Applies a vote change, already saved in the current transaction, to the film tally with atomic increments """
+    if old_choice == new_choice:
+        return
+    lock_film_vote_tally(film)
+    if not FilmVoteTally.objects.filter(film=film).exists():
+        # Built from the votes, so the change is already included
+        rebuild_film_vote_tally(film)
+        return
+    points_mapping = RankingGenerator.get_points_mapping()
+    increments = {'points': F('points')}
+    if old_choice:
+        increments[old_choice] = F(old_choice) - 1
+        increments['points'] -= points_mapping[old_choice]
+    if new_choice:
+        increments[new_choice] = F(new_choice) + 1
+        increments['points'] += points_mapping[new_choice]
+    FilmVoteTally.objects.filter(film=film).update(**increments)
@@ -0,0 +1,58 @@
+$(document).ready(function() {
+    var nextPage = document.getElementById("filmsNextPage");
+    var nextPageLink = document.getElementById("filmsNextPageLink");
+    var nextPageSpinner = document.getElementById("filmsNextPageSpinner");
+    var container = $("#filmsContainer");
+    var loading = false;
+
+    if (!nextPage || !("IntersectionObserver" in window)) {
+      return;
+    }
+
+    // the link to the next page stays as fallback, the spinner replaces it while scrolling works
+    nextPageLink.classList.add("d-none");
+    nextPageSpinner.classList.remove("d-none");
+
+    function showNextPageLink() {
+      observer.disconnect();
+      nextPageSpinner.classList.add("d-none");
+      nextPageLink.classList.remove("d-none");
+    }
+
+    function loadNextPage() {
+      loading = true;
+      fetch(nextPage.dataset.url, {credentials: "same-origin", headers: {"X-Requested-With": "XMLHttpRequest"}})
+        .then(function(response) {
+          if (!response.ok) {
+            throw new Error(response.status + " " + response.statusText);
+          }
+          return response.json();
+        })
+        .then(function(data) {
+          container.append(data.html);
+          loading = false;
+          if (data.next_page_url) {
+            nextPage.dataset.url = data.next_page_url;
+            nextPageLink.href = data.next_page_url;
+            // observe again so that a sentinel still in view triggers the following page
+            observer.unobserve(nextPage);
+            observer.observe(nextPage);
+          } else {
+            observer.disconnect();
+            nextPage.remove();
+          }
+        })
+        .catch(function() {
+          loading = false;
+          showNextPageLink();
+        });
+    }
+
+    // load the next page of films when the bottom of the list becomes visible
+    var observer = new IntersectionObserver(function(entries) {
+      if (entries[0].isIntersecting && !loading) {
+        loadNextPage();
+      }
+    }, {rootMargin: "400px"});
+    observer.observe(nextPage);
+});
@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.cache import cache
+
+from filmdemocracy.democracy.models import Film, FilmComment, Vote, Meeting
+from filmdemocracy.registration.models import User
+
+
+def count_subquery(queryset, outer_field='club'):
+    """ Scalar subquery counting the rows of the queryset related to the outer row through outer_field """
+    counts = queryset.filter(**{outer_field: OuterRef('pk')}).order_by().values(outer_field).annotate(count=Count('*'))
+    return Coalesce(Subquery(counts.values('count'), output_field=IntegerField()), 0)
+
+
+class MemberStatsHelper:
+    """
+    Participation statistics of club members, computed for any number of members in one query of count subqueries:
+    votes cast, votes on candidate films, films seen, films proposed, comments, meeting RSVPs and the votes of
+    each choice.
+    """
+
+    stats_fields = ['num_of_votes', 'num_of_pending_votes', 'num_of_films_seen', 'num_of_films_proposed',
+                    'num_of_comments', 'num_of_rsvps']
+
+    def __init__(self, club):
+        self.club = club
+
+    @staticmethod
+    def get_choice_field(choice):
+        return f'num_of_{choice}_votes'
+
+    def get_queryset(self, members=None):
+        """ The members (all the active club members if None) annotated with their stats """
+        if members is None:
+            members_queryset = self.club.members.filter(is_active=True)
+        else:
+            members_queryset = User.objects.filter(id__in=[member.id for member in members])
+        club_votes = Vote.objects.filter(club=self.club)
+        return members_queryset.annotate(
+            num_of_votes=count_subquery(club_votes, 'user'),
+            num_of_pending_votes=count_subquery(club_votes.filter(film__seen=False), 'user'),
+            num_of_films_seen=count_subquery(Film.seen_by.through.objects.filter(film__club=self.club), 'user'),
+            num_of_films_proposed=count_subquery(Film.objects.filter(club=self.club), 'proposed_by'),
+            num_of_comments=count_subquery(FilmComment.objects.filter(club=self.club, deleted=False), 'user'),
+            num_of_rsvps=sum(
+                count_subquery(meeting_members.through.objects.filter(meeting__club=self.club, meeting__active=True), 'user')
+                for meeting_members in (Meeting.members_yes, Meeting.members_maybe, Meeting.members_no)
+            ),
+            **{self.get_choice_field(choice): count_subquery(club_votes.filter(choice=choice), 'user')
+               for choice, choice_text in Vote.vote_choices},
+        )
+
+    def get_stats(self, members=None):
+        """ Returns the stats of the members by member id """
+        choices_fields = [self.get_choice_field(choice) for choice, choice_text in Vote.vote_choices]
+        members_stats = {}
+        for member_values in self.get_queryset(members).values('id', *self.stats_fields, *choices_fields):
+            members_stats[member_values['id']] = {
+                **{field: member_values[field] for field in self.stats_fields},
+                'votes_histogram': [
+                    {'choice': choice, 'choice_text': choice_text, 'count': member_values[self.get_choice_field(choice)]}
+                    for choice, choice_text in Vote.vote_choices
+                ],
+            }
+        return members_stats
+
+    def get_member_stats(self, member):
+        return self.get_stats([member])[member.id]
+
+
+class MemberLeaderboard:
+    """
+    Participation of the active members of a club, most active first, computed by MemberStatsHelper in one query.
+    Cached per club until a write to the votes, films, comments, meetings RSVPs or members of the club invalidates it.
+    """
+
+    timeout = 60 * 60 * 24
+    fields = ['num_of_votes', 'num_of_films_proposed', 'num_of_films_seen', 'num_of_comments', 'num_of_rsvps']
+
+    @staticmethod
+    def key(club_id):
+        return f'member_leaderboard_{club_id}'
+
+    @classmethod
+    def get(cls, club):
+        leaderboard = cache.get(cls.key(club.id))
+        if leaderboard is None:
+            members_stats = MemberStatsHelper(club).get_queryset().annotate(
+                participation=sum(F(field) for field in cls.fields),
+            )
+            leaderboard = list(members_stats.order_by('-participation', 'username'))
+            cache.set(cls.key(club.id), leaderboard, cls.timeout)
+        return leaderboard
+
+    @classmethod
+    def invalidate(cls, club_id):
+        """ To be called whenever the participation of any member of the club changes, once the transaction commits """
+        transaction.on_commit(lambda: cache.delete(cls.key(club_id)))
+
+    @classmethod
+    def serialize(cls, member):
+        return {
+            'id': str(member.id),
+            'username': member.username,
+            'participation': member.participation,
+            **{field: getattr(member, field) for field in cls.fields},
+        }
@@ -0,0 +1,442 @@
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from filmdemocracy.core.management.commands.rebuild_vote_tallies import Command as RebuildVoteTalliesCommand
+from filmdemocracy.core.omdb import OmdbClient
+from filmdemocracy.core.search import AutocompleteCache
+from filmdemocracy.democracy.models import Club, ClubMemberInfo, FilmDb, Film, Vote, FilmComment, Meeting, FilmVoteTally
+from filmdemocracy.democracy.views.club import CandidateFilmsView, SeenFilmsView
+from filmdemocracy.democracy.ranking import VoteMatrix, RankingCache, RankingGenerator, get_vote_tally_fields
+from filmdemocracy.democracy.stats import MemberLeaderboard
+from filmdemocracy.registration.admin import RankingCacheUserAdmin
+from filmdemocracy.registration.models import User
+
+
+VOTE_CHOICES = [choice for choice, choice_text in Vote.vote_choices]
+
+
+class ClubDataMixin:
+    """ Builds a club whose members vote, comment and propose films, and logs in its founder """
+
+    def setUp(self):
+        cache.clear()
+        self.founder = User.objects.create_user('founder', 'founder@fakemail.com', 'pass')
+        self.club = Club.objects.create(id='123456', name='Club', short_description='Club', founder=self.founder)
+        self.club.admin_members.add(self.founder)
+        self.members = []
+        self.films = []
+        self.add_members(3)
+        self.add_films(4, seen=False)
+        self.add_films(2, seen=True)
+        self.add_meeting()
+        self.client.force_login(self.founder)
+
+    def add_members(self, n_members):
+        for i in range(n_members):
+            member = User.objects.create_user(f'member{len(self.members)}', f'member{len(self.members)}@fakemail.com',
+                                              'pass')
+            self.club.members.add(member)
+            ClubMemberInfo.objects.create(club=self.club, member=member)
+            self.members.append(member)
+        if self.founder not in self.members:
+            self.club.members.add(self.founder)
+            ClubMemberInfo.objects.create(club=self.club, member=self.founder)
+            self.members.append(self.founder)
+
+    def add_films(self, n_films, seen=False):
+        for i in range(n_films):
+            position = len(self.films)
+            filmdb = FilmDb.objects.create(imdb_id=str(1000000 + position).zfill(8), title=f'Film {position}',
+                                           year=1990 + position, duration=f'{90 + position} min')
+            film = Film.objects.create(public_id=str(100000 + position), proposed_by=self.members[position % 2],
+                                       club=self.club, db=filmdb, seen=seen,
+                                       seen_date=date(2020, 1, 1 + position) if seen else None)
+            if seen:
+                film.seen_by.add(*self.members)
+            for j, member in enumerate(self.members):
+                Vote.objects.create(user=member, film=film, club=self.club,
+                                    choice=VOTE_CHOICES[(position + j) % len(VOTE_CHOICES)])
+            FilmComment.objects.create(user=self.members[position % len(self.members)], film=film, club=self.club,
+                                       text='Comment')
+            self.films.append(film)
+
+    def add_meeting(self):
+        meeting = Meeting.objects.create(club=self.club, name='Meeting', organizer=self.founder, place='Place',
+                                         date=date.today())
+        meeting.members_yes.add(*self.members)
+        return meeting
+
+    def get_url(self, url_name, **kwargs):
+        return reverse(f'democracy:{url_name}', kwargs={'club_id': self.club.id, **kwargs})
+
+    def assertPageQueries(self, num_queries, url):
+        """ The page costs num_queries with an empty cache, with the club data of setUp and with four times more """
+        for i in range(2):
+            cache.clear()
+            with self.assertNumQueries(num_queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.add_members(3 * len(self.members))
+            self.add_films(3 * len(self.films))
+            self.add_meeting()
+
+
+class ClubPagesQueriesTests(ClubDataMixin, TestCase):
+
+    def test_club_detail_queries(self):
+        self.assertPageQueries(23, self.get_url('club_detail'))
+
+    def test_candidate_films_queries(self):
+        self.assertPageQueries(16, self.get_url('candidate_films'))
+
+    def test_candidate_films_list_display_queries(self):
+        self.assertPageQueries(16, self.get_url('candidate_films') + '&order=user_vote&display=list')
+
+    def test_seen_films_queries(self):
+        self.assertPageQueries(16, self.get_url('seen_films'))
+
+    def test_member_detail_queries(self):
+        self.assertPageQueries(21, self.get_url('club_member_detail', member_id=self.members[0].id))
+
+    def test_leaderboard_queries(self):
+        self.assertPageQueries(16, self.get_url('club_leaderboard'))
+
+    def test_ranking_results_queries(self):
+        participants = '&'.join(f'members={member.id}' for member in self.members)
+        self.assertPageQueries(18, self.get_url('ranking_results') + f'?{participants}&max_duration=')
+
+
+class VoteMatrixTests(ClubDataMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.config = {'points_mapping': RankingGenerator.get_points_mapping(), 'exclude_not_present': None,
+                       'max_duration': 999}
+        filmdb = FilmDb.objects.create(imdb_id='02000000', title='Film without votes', duration='100 min')
+        self.film = Film.objects.create(public_id='200000', proposed_by=self.members[0], club=self.club, db=filmdb)
+
+    def test_film_without_votes_ranked(self):
+        """
+        The films nobody voted get no points and all the participants as abstentionists, like the films voted by
+        other members only, instead of the None values the ranking template could not sort
+        """
+        participants = self.members[1:]
+        film_results = VoteMatrix.from_club(self.club.id).rank(participants, self.config, [self.film.id])
+        self.assertEqual(film_results, [{
+            'film': self.film,
+            'duration': '100',
+            'positive_votes': [],
+            'neutral_votes': [],
+            'negative_votes': [],
+            'abstentionists': participants,
+            'points': 0,
+            'veto': False,
+            'warnings': [{'type': 'proposer missing', 'film': 'Film without votes', 'voter': self.members[0].username}],
+        }])
+
+    def test_ranking_page_shows_film_without_votes(self):
+        participants = '&'.join(f'members={member.id}' for member in self.members)
+        response = self.client.get(self.get_url('ranking_results') + f'?{participants}&max_duration=')
+        self.assertEqual(len(response.context['ranking_results']), 5)
+        self.assertContains(response, 'Film without votes')
+        for film in self.films[:4]:
+            self.assertContains(response, film.db.title)
+
+
+class RankingCacheTests(ClubDataMixin, TransactionTestCase):
+    """ Transactional, as the cache is only invalidated once the vote changes are committed """
+
+    def setUp(self):
+        super().setUp()
+        self.config = {'points_mapping': RankingGenerator.get_points_mapping(), 'exclude_not_present': None,
+                       'max_duration': 999}
+
+    @staticmethod
+    def summarize(ranking_results):
+        return sorted((result['film'].id, result['points'], result['veto']) for result in ranking_results)
+
+    def assertCachedRankingIsFresh(self, participants):
+        cached_ranking = RankingCache(self.club.id).get_ranking(participants, self.config)
+        fresh_ranking = VoteMatrix.from_club(self.club.id).rank(participants, self.config)
+        self.assertEqual(self.summarize(cached_ranking), self.summarize(fresh_ranking))
+
+    def test_ranking_follows_vote_changes(self):
+        self.assertCachedRankingIsFresh(self.members)
+        for film, choice in zip(self.films[:4], [Vote.VETO, Vote.OMG, Vote.NO, Vote.YES]):
+            self.client.post(reverse('democracy:vote_film', kwargs={'club_id': self.club.id,
+                                                                    'film_public_id': film.public_id}),
+                             {'choice': choice})
+            self.assertCachedRankingIsFresh(self.members)
+            self.assertCachedRankingIsFresh(self.members[:2])
+        self.client.post(reverse('democracy:delete_vote', kwargs={'club_id': self.club.id,
+                                                                  'film_public_id': self.films[0].public_id}))
+        self.assertCachedRankingIsFresh(self.members)
+
+    def test_touch_film_waits_for_commit(self):
+        ranking_cache = RankingCache(self.club.id)
+        ranking_cache.get_ranking(self.members, self.config)
+        version = ranking_cache.get_version()
+        with transaction.atomic():
+            RankingCache.touch_film(self.club.id, self.films[0].id)
+            self.assertEqual(ranking_cache.get_version(), version)
+        self.assertEqual(ranking_cache.get_version(), version + 1)
+
+    def get_cached_result(self, film):
+        ranking = RankingCache(self.club.id).get_ranking(self.members, self.config)
+        return next(result for result in ranking if result['film'].id == film.id)
+
+    def test_filmdb_changes_invalidate_rankings(self):
+        film = self.films[0]
+        self.assertEqual(self.get_cached_result(film)['duration'], '90')
+        FilmDb.objects.filter(imdb_id=film.db_id).update(duration='120 min')
+        call_command('backfill_films_durations', '--all', stdout=StringIO())
+        self.assertEqual(self.get_cached_result(film)['duration'], '120')
+        omdb_data = {'Title': 'New title', 'imdbRating': '7.5', 'Metascore': '70', 'Year': '1999',
+                     'Director': 'Director', 'Writer': 'Writer', 'Actors': 'Actors', 'Poster': 'N/A',
+                     'Runtime': '95 min', 'Language': 'English', 'Rated': 'R', 'Country': 'France', 'Plot': 'Plot'}
+        with mock.patch.object(OmdbClient, 'fetch_many', return_value={film.db_id: omdb_data}):
+            self.assertEqual(OmdbClient(api_key='key').refresh_many([film.db_id]), [film.db_id])
+        film_result = self.get_cached_result(film)
+        self.assertEqual((film_result['film'].db.title, film_result['duration']), ('New title', '95'))
+
+    def test_member_changes_invalidate_rankings(self):
+        voter = self.members[0]
+        self.assertIn(voter.username, self.summarize_voters(self.get_cached_result(self.films[0])))
+        voter.username = 'renamed'
+        RankingCacheUserAdmin(User, admin.site).save_model(None, voter, None, True)
+        self.assertIn('renamed', self.summarize_voters(self.get_cached_result(self.films[0])))
+        self.client.force_login(voter)
+        response = self.client.post(reverse('registration:account_info'), {'email': 'renamed@fakemail.com'})
+        self.assertEqual(response.status_code, 302)
+        film_result = self.get_cached_result(self.films[0])
+        self.assertIn('renamed@fakemail.com', [vote.user.email for vote in self.get_votes(film_result)])
+
+    @staticmethod
+    def get_votes(film_result):
+        return film_result['positive_votes'] + film_result['neutral_votes'] + film_result['negative_votes']
+
+    def summarize_voters(self, film_result):
+        return [vote.user.username for vote in self.get_votes(film_result)]
+
+    def test_invalidate_waits_for_commit(self):
+        ranking_cache = RankingCache(self.club.id)
+        ranking_cache.get_ranking(self.members, self.config)
+        with transaction.atomic():
+            RankingCache.invalidate(self.club.id)
+            self.assertEqual(RankingCache(self.club.id).generation, ranking_cache.generation)
+        self.assertIsNone(RankingCache(self.club.id).generation)
+
+
+class FilmVoteTallyTests(ClubDataMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.film = self.films[0]
+        call_command('rebuild_vote_tallies', stdout=StringIO())
+
+    def get_film_url(self, url_name):
+        return reverse(f'democracy:{url_name}', kwargs={'club_id': self.club.id, 'film_public_id': self.film.public_id})
+
+    def assertTallyMatchesVotes(self):
+        votes_choices = list(Vote.objects.filter(film=self.film).values_list('choice', flat=True))
+        choices_counts = {choice: votes_choices.count(choice) for choice in set(votes_choices)}
+        tally = FilmVoteTally.objects.filter(film=self.film).values(*get_vote_tally_fields({})).get()
+        self.assertEqual(tally, get_vote_tally_fields(choices_counts))
+
+    def test_tally_follows_votes(self):
+        for choice in [Vote.OMG, Vote.VETO, Vote.VETO, Vote.MEH]:
+            self.client.post(self.get_film_url('vote_film'), {'choice': choice})
+            self.assertTallyMatchesVotes()
+        self.client.post(self.get_film_url('delete_vote'))
+        self.assertFalse(Vote.objects.filter(film=self.film, user=self.founder).exists())
+        self.assertTallyMatchesVotes()
+        call_command('rebuild_vote_tallies', '--verify', stdout=StringIO())
+
+    def test_missing_tally_is_rebuilt(self):
+        FilmVoteTally.objects.filter(film=self.film).delete()
+        self.client.post(self.get_film_url('vote_film'), {'choice': Vote.NO})
+        self.assertTallyMatchesVotes()
+        call_command('rebuild_vote_tallies', '--verify', stdout=StringIO())
+
+    def test_verify_accepts_missing_tallies_of_films_without_votes(self):
+        Vote.objects.filter(film=self.film).delete()
+        FilmVoteTally.objects.filter(film=self.film).delete()
+        call_command('rebuild_vote_tallies', '--verify', stdout=StringIO())
+
+    def test_verify_detects_wrong_tallies(self):
+        FilmVoteTally.objects.filter(film=self.film).update(yes=99)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_vote_tallies', '--verify', stdout=StringIO())
+        call_command('rebuild_vote_tallies', stdout=StringIO())
+        self.assertTallyMatchesVotes()
+
+    def test_rebuild_counts_votes_under_films_locks(self):
+        calls = []
+        select_for_update = QuerySet.select_for_update
+        get_expected_tallies = RebuildVoteTalliesCommand.get_expected_tallies
+
+        def lock_films(queryset, *args, **kwargs):
+            calls.append(('lock', queryset.model, len(connection.savepoint_ids)))
+            return select_for_update(queryset, *args, **kwargs)
+
+        def count_votes():
+            calls.append(('count', None, len(connection.savepoint_ids)))
+            return get_expected_tallies()
+
+        # Both run inside the rebuild transaction, one level deeper than the test case one
+        atomic_depth = len(connection.savepoint_ids) + 1
+
+        FilmVoteTally.objects.filter(film=self.film).update(yes=99)
+        with mock.patch.object(QuerySet, 'select_for_update', lock_films), \
+                mock.patch.object(RebuildVoteTalliesCommand, 'get_expected_tallies', staticmethod(count_votes)):
+            call_command('rebuild_vote_tallies', stdout=StringIO())
+        self.assertEqual(calls, [('lock', Film, atomic_depth), ('count', None, atomic_depth)])
+        self.assertTallyMatchesVotes()
+
+
+class MemberLeaderboardTests(ClubDataMixin, TransactionTestCase):
+    """ Transactional, as the leaderboard is only invalidated once the changes are committed """
+
+    def get_film_url(self, url_name, film):
+        return self.get_url(url_name, film_public_id=film.public_id)
+
+    def get_expected_counts(self, member):
+        meetings = Meeting.objects.filter(club=self.club, active=True)
+        return {
+            'num_of_votes': Vote.objects.filter(club=self.club, user=member).count(),
+            'num_of_films_proposed': Film.objects.filter(club=self.club, proposed_by=member).count(),
+            'num_of_films_seen': Film.objects.filter(club=self.club, seen_by=member).count(),
+            'num_of_comments': FilmComment.objects.filter(club=self.club, user=member, deleted=False).count(),
+            'num_of_rsvps': sum(meetings.filter(**{f'members_{rsvp}': member}).count() for rsvp in ['yes', 'maybe', 'no']),
+        }
+
+    def assertLeaderboardMatchesCounts(self):
+        leaderboard = self.client.get(self.get_url('club_leaderboard_json')).json()['members']
+        expected_leaderboard = []
+        for member in self.club.members.filter(is_active=True):
+            expected_counts = self.get_expected_counts(member)
+            expected_leaderboard.append({'id': str(member.id), 'username': member.username,
+                                         'participation': sum(expected_counts.values()), **expected_counts})
+        expected_leaderboard.sort(key=lambda member: (-member['participation'], member['username']))
+        self.assertEqual(leaderboard, expected_leaderboard)
+
+    def test_leaderboard_follows_participation(self):
+        self.assertLeaderboardMatchesCounts()
+        self.client.post(self.get_film_url('delete_vote', self.films[0]))
+        self.assertLeaderboardMatchesCounts()
+        self.client.post(self.get_film_url('vote_film', self.films[0]), {'choice': Vote.OMG})
+        self.assertLeaderboardMatchesCounts()
+        for i in range(3):
+            self.client.post(self.get_film_url('comment_film', self.films[1]), {'text': f'Comment {i}'})
+        self.assertLeaderboardMatchesCounts()
+
+    def test_invalidate_waits_for_commit(self):
+        MemberLeaderboard.get(self.club)
+        with transaction.atomic():
+            FilmComment.objects.create(user=self.founder, film=self.films[0], club=self.club, text='Comment')
+            MemberLeaderboard.invalidate(self.club.id)
+            self.assertIsNotNone(cache.get(MemberLeaderboard.key(self.club.id)))
+        self.assertIsNone(cache.get(MemberLeaderboard.key(self.club.id)))
+        self.assertLeaderboardMatchesCounts()
+
+
+@mock.patch.object(SeenFilmsView, 'page_size', 3)
+@mock.patch.object(CandidateFilmsView, 'page_size', 3)
+class FilmsPagesTests(ClubDataMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_films(8, seen=False)
+        self.add_films(5, seen=True)
+        # Ties in the ordering fields, which only the film id breaks
+        FilmDb.objects.filter(imdb_id__in=[film.db_id for film in self.films[::2]]).update(title='Same title', year=2000, duration_mins=100)
+        Film.objects.filter(id__in=[film.id for film in self.films if film.seen][::2]).update(seen_date=None)
+        Vote.objects.filter(user=self.founder, film__in=self.films[::3]).delete()
+
+    def get_all_pages(self, url, films_context_key):
+        """ Follows the next page urls from the film list page, the next ones requested by the infinite scroll """
+        response = self.client.get(url)
+        films_ids = [film.id for film in response.context[films_context_key]]
+        next_page_url = response.context['next_page_url']
+        while next_page_url:
+            response = self.client.get(next_page_url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertIn('html', page)
+            films_ids += [film.id for film in response.context[films_context_key]]
+            self.assertEqual(page['next_page_url'], response.context['next_page_url'])
+            next_page_url = page['next_page_url']
+        return films_ids
+
+    def get_single_page(self, view_class, url, films_context_key):
+        with mock.patch.object(view_class, 'page_size', len(self.films)):
+            response = self.client.get(url)
+        self.assertIsNone(response.context['next_page_url'])
+        return [film.id for film in response.context[films_context_key]]
+
+    def test_candidate_films_pages(self):
+        candidate_films_ids = {film.id for film in self.films if not film.seen}
+        for options_string in ['', '&order=date_proposed', '&order=year', '&order=duration', '&order=user_vote',
+                               '&view=only_voted&order=user_vote&display=list', '&view=not_voted']:
+            url = self.get_url('candidate_films', options_string=options_string)
+            films_ids = self.get_all_pages(url, 'candidate_films')
+            self.assertEqual(films_ids, self.get_single_page(CandidateFilmsView, url, 'candidate_films'))
+            self.assertEqual(len(films_ids), len(set(films_ids)))
+            if '&view=' not in options_string:
+                self.assertEqual(set(films_ids), candidate_films_ids)
+
+    def test_seen_films_pages(self):
+        url = self.get_url('seen_films')
+        films_ids = self.get_all_pages(url, 'seen_films')
+        self.assertEqual(films_ids, self.get_single_page(SeenFilmsView, url, 'seen_films'))
+        self.assertEqual(sorted(films_ids), sorted(film.id for film in self.films if film.seen))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.get_url('candidate_films', options_string='&after=0123abc'))
+        self.assertEqual(response.status_code, 404)
+
+
+class NewFilmAutocompleteTests(ClubDataMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(60):
+            FilmDb.objects.create(imdb_id=str(3000000 + i).zfill(8), title=f'Matrix {i}', year=1950 + i)
+
+    def get_autocomplete(self, query, page=1):
+        response = self.client.get(reverse('democracy:new_film_autocomplete'), {'q': query, 'page': page})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_repeated_query_cached(self):
+        first_results = self.get_autocomplete('matrix')
+        self.assertEqual(len(first_results['results']), 10)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_autocomplete('  MATRIX '), first_results)
+        self.assertFalse([query for query in context.captured_queries if 'democracy_filmdb' in query['sql']])
+        self.assertEqual(AutocompleteCache.get_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+        self.assertNotEqual(self.get_autocomplete('matrix', page=2), first_results)
+
+    def test_short_queries_answered_from_popular_films(self):
+        candidate_filmdbs_ids = [film.db_id for film in sorted(self.films, key=lambda film: -film.db.year)]
+        self.assertEqual([result['id'] for result in self.get_autocomplete('fi')['results']], candidate_filmdbs_ids)
+        self.assertEqual(self.get_autocomplete('ma')['results'], [])
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(len(self.get_autocomplete('f')['results']), len(self.films))
+        self.assertFalse([query for query in context.captured_queries if 'democracy_filmdb' in query['sql']])
+
+    def test_pages_capped(self):
+        pages = [self.get_autocomplete('matrix', page) for page in range(1, 7)]
+        self.assertEqual([page['pagination']['more'] for page in pages], [True, True, True, True, False, False])
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 10, 10, 10, 0])
@@ -48,6 +48,16 @@ club_urlpatterns = [
             club_views.ClubMemberDetailView.as_view(template_name='democracy/club_member_detail.html'),
             name='club_member_detail'
         ),
+        path(
+            'leaderboard/',
+            club_views.ClubLeaderboardView.as_view(template_name='democracy/club_leaderboard.html'),
+            name='club_leaderboard'
+        ),
+        path(
+            'leaderboard/json/',
+            club_views.club_leaderboard_json,
+            name='club_leaderboard_json'
+        ),
         path(
             'leave_club/',
             club_views.LeaveClubView.as_view(template_name='democracy/leave_club.html'),
@@ -83,8 +93,8 @@ club_urlpatterns = [
             club_views.AddNewFilmView.as_view(template_name='democracy/add_new_film.html'),
             name='add_new_film'
         ),
-        path(
-            'seen_films/',
+        re_path(
+            r'seen_films/' + options_regexp,
             club_views.SeenFilmsView.as_view(template_name='democracy/seen_films_list.html'),
             name='seen_films'
         ),
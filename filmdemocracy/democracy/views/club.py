@@ -1,9 +1,15 @@
 import hashlib
+from datetime import date
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.cache import cache
+from django.db.models import Case, CharField, DateField, FloatField, Max, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
@@ -17,15 +23,21 @@ from django.utils.html import format_html
 from dal import autocomplete
 
 from filmdemocracy.democracy import forms
-from filmdemocracy.core.models import Notification
+from filmdemocracy.core.models import Notification, UnreadNotificationsCounter
 from filmdemocracy.democracy.models import Club, ClubMemberInfo, Invitation, Meeting, FilmDb, Film, Vote, FilmComment
 from filmdemocracy.chat.models import ChatClubInfo
 from filmdemocracy.registration.models import User
 
 from filmdemocracy.core.utils import user_is_club_member_check, user_is_club_admin_check
-from filmdemocracy.core.utils import extract_options
-from filmdemocracy.core.utils import random_club_id_generator, random_film_public_id_generator
-from filmdemocracy.core.utils import RankingGenerator, SpamHelper
+from filmdemocracy.core.utils import get_request_club
+from filmdemocracy.core.utils import extract_options, extract_cursor, fill_options_string
+from filmdemocracy.core.utils import create_club_with_random_id, create_film_with_random_public_id
+from filmdemocracy.core.utils import SpamHelper
+from filmdemocracy.core.utils import build_notifications, save_notifications, bulk_create_notifications
+from filmdemocracy.core.paginator import KeysetPaginator
+from filmdemocracy.core.search import AutocompleteCache, search_filmdbs_indexed
+from filmdemocracy.democracy.ranking import RankingGenerator, RankingCache
+from filmdemocracy.democracy.stats import count_subquery, MemberStatsHelper, MemberLeaderboard
 
 
 @method_decorator(login_required, name='dispatch')
@@ -38,8 +50,7 @@ class CreateClubView(generic.FormView):
 
     def form_valid(self, form):
         user = self.request.user
-        new_club = Club.objects.create(
-            id=random_club_id_generator(),
+        new_club = create_club_with_random_id(
             name=form.cleaned_data['name'],
             founder=user,
             short_description=form.cleaned_data['short_description'],
@@ -60,33 +71,57 @@ class CreateClubView(generic.FormView):
 class ClubDetailView(UserPassesTestMixin, generic.DetailView):
     model = Club
     pk_url_kwarg = 'club_id'
+    num_of_last_pub = 12
+    summary_timeout = 30
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
+
+    def get_object(self, queryset=None):
+        return get_request_club(self.request, self.kwargs['club_id'])
+
+    def get_club_films_summary(self, club):
+        """ Club counts and last proposed and seen films, cached for a short while as they are the same for all members """
+        cache_key = f'club_films_summary_{club.id}'
+        club_films_summary = cache.get(cache_key)
+        if club_films_summary is None:
+            club_counts = Club.objects.filter(id=club.id).annotate(
+                num_of_members=count_subquery(Club.members.through.objects.filter(user__is_active=True)),
+                num_of_films=count_subquery(Film.objects.all()),
+                num_of_seen_films=count_subquery(Film.objects.filter(seen=True)),
+                num_of_votes=count_subquery(Vote.objects.all()),
+            ).values('num_of_members', 'num_of_films', 'num_of_seen_films', 'num_of_votes').get()
+            club_films = Film.objects.filter(club=club).select_related('db')
+            club_films_summary = {
+                'counts': club_counts,
+                'films_last_pub': list(club_films.order_by('-created_datetime')[0:self.num_of_last_pub]),
+                'films_last_seen': list(club_films.filter(seen=True).order_by('-seen_date')[0:3]),
+            }
+            cache.set(cache_key, club_films_summary, self.summary_timeout)
+        return club_films_summary
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page'] = 'club_detail'
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_meetings = Meeting.objects.filter(club=club, active=True, date__gte=timezone.now().date())
-        if club_meetings:
-            context['next_meetings'] = club_meetings.order_by('date')[0:3]
-            context['extra_meetings'] = len(club_meetings) > 3
-        last_comments = FilmComment.objects.filter(club=club, deleted=False)
-        if last_comments:
-            context['last_comments'] = last_comments.order_by('-created_datetime')[0:5]
-        club_films = Film.objects.filter(club=club)
-        if club_films:
-            films_last_pub = club_films.order_by('-created_datetime')
-            groups_last_pub = [films_last_pub[i:i+3] for i in [0, 3, 6, 9]]
-            context['groups_last_pub'] = groups_last_pub
-            seen_films = club_films.filter(seen=True)
-            context['films_last_seen'] = seen_films.order_by('-seen_date')[0:3]
-            context['num_of_candidate_films'] = len(club_films)
-            context['num_of_seen_films'] = len(seen_films)
-        else:
-            context['num_of_candidate_films'] = 0
-            context['num_of_seen_films'] = 0
+        next_meetings = list(club_meetings.order_by('date').select_related('organizer').prefetch_related(
+            'members_yes', 'members_no', 'members_maybe'
+        )[0:4])
+        if next_meetings:
+            context['next_meetings'] = next_meetings[0:3]
+            context['extra_meetings'] = len(next_meetings) > 3
+        last_comments = FilmComment.objects.filter(club=club, deleted=False).select_related('user', 'film__db')
+        context['last_comments'] = list(last_comments.order_by('-created_datetime')[0:5])
+        club_films_summary = self.get_club_films_summary(club)
+        films_last_pub = club_films_summary['films_last_pub']
+        if films_last_pub:
+            context['groups_last_pub'] = [films_last_pub[i:i+3] for i in [0, 3, 6, 9]]
+            context['films_last_seen'] = club_films_summary['films_last_seen']
+        context['num_of_members'] = club_films_summary['counts']['num_of_members']
+        context['num_of_candidate_films'] = club_films_summary['counts']['num_of_films']
+        context['num_of_seen_films'] = club_films_summary['counts']['num_of_seen_films']
+        context['num_of_votes'] = club_films_summary['counts']['num_of_votes']
         return context
 
 
@@ -94,42 +129,55 @@ class ClubDetailView(UserPassesTestMixin, generic.DetailView):
 class ClubMemberDetailView(UserPassesTestMixin, generic.TemplateView):
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         member = get_object_or_404(User, id=self.kwargs['member_id'])
         context['member'] = member
         club_member_info = get_object_or_404(ClubMemberInfo, club=club, member=member)
         context['club_member_info'] = club_member_info
-        all_votes = member.vote_set.filter(club=club)
-        context['num_of_votes'] = all_votes.count()
-        club_films = Film.objects.filter(club=club)
-        club_films_not_seen = club_films.filter(seen=False)
-        votes = [vote for vote in all_votes if vote.film in club_films_not_seen]
-        context['member_votes'] = votes
-        member_seen_films = member.seen_by.filter(club=club)
-        context['member_seen_films'] = member_seen_films
-        context['num_of_films_seen'] = member_seen_films.count()
-        proposed = club_films.filter(proposed_by=member)
-        context['num_of_films_proposed'] = proposed.count()
+        context.update(MemberStatsHelper(club).get_member_stats(member))
+        context['member_votes'] = member.vote_set.filter(club=club, film__seen=False).select_related('film__db')
+        context['member_seen_films'] = member.seen_by.filter(club=club).select_related('db')
+        return context
+
+
+@method_decorator(login_required, name='dispatch')
+class ClubLeaderboardView(UserPassesTestMixin, generic.TemplateView):
+
+    def test_func(self):
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        club = get_request_club(self.request, self.kwargs['club_id'])
+        context['leaderboard'] = MemberLeaderboard.get(club)
         return context
 
 
+@login_required
+def club_leaderboard_json(request, club_id):
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
+        return HttpResponseForbidden()
+    return JsonResponse({'members': [MemberLeaderboard.serialize(member) for member in MemberLeaderboard.get(club)]})
+
+
 @method_decorator(login_required, name='dispatch')
 class EditClubInfoView(UserPassesTestMixin, generic.UpdateView):
     pk_url_kwarg = 'club_id'
     form_class = forms.EditClubForm
 
     def test_func(self):
-        return user_is_club_admin_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_admin_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_success_url(self):
         return reverse_lazy('democracy:club_detail', kwargs={'club_id': self.kwargs['club_id']})
 
     def get_object(self, queryset=None):
-        return get_object_or_404(Club, id=self.kwargs['club_id'])
+        return get_request_club(self.request, self.kwargs['club_id'])
 
 
 @method_decorator(login_required, name='dispatch')
@@ -139,11 +187,14 @@ class EditClubPanelView(UserPassesTestMixin, generic.UpdateView):
     fields = ['panel']
 
     def test_func(self):
-        return user_is_club_admin_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_admin_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_success_url(self):
         return reverse_lazy('democracy:club_detail', kwargs={'club_id': self.kwargs['club_id']})
 
+    def get_object(self, queryset=None):
+        return get_request_club(self.request, self.kwargs['club_id'])
+
 
 @method_decorator(login_required, name='dispatch')
 class LeaveClubView(UserPassesTestMixin, generic.FormView):
@@ -151,7 +202,7 @@ class LeaveClubView(UserPassesTestMixin, generic.FormView):
     success = False
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_success_url(self):
         if self.success:
@@ -160,7 +211,7 @@ class LeaveClubView(UserPassesTestMixin, generic.FormView):
             return reverse_lazy('democracy:promote_members', kwargs={'club_id': self.kwargs['club_id']})
 
     def form_valid(self, form):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_members = club.members.filter(is_active=True)
         club_admins = club.admin_members.all()
         user = self.request.user
@@ -171,6 +222,7 @@ class LeaveClubView(UserPassesTestMixin, generic.FormView):
             else:
                 club.admin_members.remove(user)
         club.members.remove(user)
+        MemberLeaderboard.invalidate(club.id)
         club.save()
         Notification.objects.filter(club=club, recipient=user).delete()
         club_member_info = get_object_or_404(ClubMemberInfo, club=club, member=user)
@@ -189,7 +241,7 @@ class SelfDemoteView(UserPassesTestMixin, generic.FormView):
     success = False
 
     def test_func(self):
-        return user_is_club_admin_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_admin_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_success_url(self):
         if self.success:
@@ -198,7 +250,7 @@ class SelfDemoteView(UserPassesTestMixin, generic.FormView):
             return reverse_lazy('democracy:promote_members', kwargs={'club_id': self.kwargs['club_id']})
 
     def form_valid(self, form):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_admins = club.admin_members.all()
         user = self.request.user
         if user in club_admins:
@@ -217,11 +269,11 @@ class KickMembersView(UserPassesTestMixin, generic.FormView):
     form_class = forms.KickMembersForm
 
     def test_func(self):
-        return user_is_club_admin_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_admin_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_form_kwargs(self):
         kwargs = super(KickMembersView, self).get_form_kwargs()
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_members = club.members.filter(is_active=True)
         kickable_members = club_members.exclude(id=self.request.user.id)
         kwargs.update({'kickable_members': kickable_members})
@@ -232,38 +284,33 @@ class KickMembersView(UserPassesTestMixin, generic.FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         candidate_members = club.members.filter(is_active=True).exclude(id=self.request.user.id)
         context['candidate_members'] = candidate_members
         return context
 
     @staticmethod
     def create_notifications(user, club, kicked_members):
-        club_members = club.members.filter(is_active=True).exclude(id=user.id)
+        club_members_ids = list(club.members.filter(is_active=True).exclude(id=user.id).values_list('id', flat=True))
+        notifications = []
         for kicked in kicked_members:
-            Notification.objects.create(type=Notification.KICKED,
-                                        activator=user,
-                                        club=club,
-                                        object_id=kicked.id,
-                                        recipient=kicked)
-            for member in club_members:
-                Notification.objects.create(type=Notification.KICKED,
-                                            activator=user,
-                                            club=club,
-                                            object_id=kicked.id,
-                                            recipient=member)
+            notifications += build_notifications(Notification.KICKED, [kicked.id] + club_members_ids,
+                                                 activator=user, club=club, object_id=kicked.id)
+        save_notifications(notifications)
 
     def form_valid(self, form):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_admins = club.admin_members.all()
         kicked_members = form.cleaned_data['members']
         for member in kicked_members:
             if member in club_admins:
                 club.admin_members.remove(member)
             club.members.remove(member)
+            MemberLeaderboard.invalidate(club.id)
             club_member_info = get_object_or_404(ClubMemberInfo, club=club, member=member)
             club_member_info.delete()
             Notification.objects.filter(club=club, recipient=member).delete()
+            UnreadNotificationsCounter.invalidate(member.id)
         club.save()
         self.create_notifications(self.request.user, club, kicked_members)
         if len(kicked_members) == 1:
@@ -278,11 +325,11 @@ class PromoteMembersView(UserPassesTestMixin, generic.FormView):
     form_class = forms.PromoteMembersForm
 
     def test_func(self):
-        return user_is_club_admin_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_admin_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_form_kwargs(self):
         kwargs = super(PromoteMembersView, self).get_form_kwargs()
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_members = club.members.filter(is_active=True)
         promotable_members = club_members.exclude(id=self.request.user.id)
         kwargs.update({'promotable_members': promotable_members})
@@ -293,24 +340,22 @@ class PromoteMembersView(UserPassesTestMixin, generic.FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         candidate_members = club.members.filter(is_active=True).exclude(id=self.request.user.id)
         context['candidate_members'] = candidate_members
         return context
 
     @staticmethod
     def create_notifications(user, club, promoted_members):
-        club_members = club.members.filter(is_active=True).exclude(id=user.id)
+        club_members_ids = list(club.members.filter(is_active=True).exclude(id=user.id).values_list('id', flat=True))
+        notifications = []
         for promoted in promoted_members:
-            for member in club_members:
-                Notification.objects.create(type=Notification.PROMOTED,
-                                            activator=user,
-                                            club=club,
-                                            object_id=promoted.id,
-                                            recipient=member)
+            notifications += build_notifications(Notification.PROMOTED, club_members_ids,
+                                                 activator=user, club=club, object_id=promoted.id)
+        save_notifications(notifications)
 
     def form_valid(self, form):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         promoted_members = form.cleaned_data['members']
         for member in promoted_members:
             club.admin_members.add(member)
@@ -323,18 +368,63 @@ class PromoteMembersView(UserPassesTestMixin, generic.FormView):
         return super().form_valid(form)
 
 
+class FilmsPageMixin:
+    """ Answers the infinite scroll requests of the film lists with the next page fragment and its url """
+    page_size = 30
+    page_template_name = None
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.is_ajax():
+            return JsonResponse({
+                'html': render_to_string(self.page_template_name, context, request=self.request),
+                'next_page_url': context['next_page_url'],
+            })
+        return super().render_to_response(context, **response_kwargs)
+
+
 @method_decorator(login_required, name='dispatch')
-class CandidateFilmsView(UserPassesTestMixin, generic.TemplateView):
+class CandidateFilmsView(FilmsPageMixin, UserPassesTestMixin, generic.TemplateView):
+    page_template_name = 'democracy/candidate_films_page.html'
+    order_fields = {
+        '&order=date_proposed': ['created_datetime', 'db__title', 'id'],
+        '&order=year': ['db__year', 'db__title', 'id'],
+        '&order=duration': ['db__duration_mins', 'db__title', 'id'],
+        '&order=user_vote': ['-user_vote_score', 'db__title', 'id'],
+        '': ['db__title', 'id'],
+    }
+    # Films not voted yet sort between the neutral and the negative votes
+    not_voted_score = 2.5
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
+
+    def get_candidate_films(self, club, view_option):
+        """ Candidate films of the club annotated with the vote of the user and filtered by the view option """
+        user_votes = Vote.objects.filter(film=OuterRef('pk'), user=self.request.user)
+        vote_choices = [choice for choice, choice_text in Vote.vote_choices]
+        candidate_films = Film.objects.filter(club=club, seen=False).select_related('db', 'proposed_by').annotate(
+            user_vote_choice=Subquery(user_votes.values('choice')[:1]),
+        ).annotate(
+            user_vote_score=Case(
+                *[When(user_vote_choice=choice, then=Value(Vote(choice=choice).vote_score)) for choice in vote_choices],
+                default=Value(self.not_voted_score), output_field=FloatField(),
+            ),
+            user_vote_karma=Case(
+                *[When(user_vote_choice=choice, then=Value(Vote(choice=choice).vote_karma)) for choice in vote_choices],
+                default=Value(''), output_field=CharField(),
+            ),
+        )
+        if view_option == '&view=only_voted':
+            candidate_films = candidate_films.filter(user_vote_choice__isnull=False)
+        elif view_option == '&view=not_voted':
+            candidate_films = candidate_films.filter(user_vote_choice__isnull=True)
+        return candidate_films
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page'] = 'candidate_films'
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         context['club'] = club
-        club_films = Film.objects.filter(club=club, seen=False)
         options_string = self.kwargs['options_string'] if 'options_string' in self.kwargs and self.kwargs['options_string'] else None
         view_option, order_option, display_option = extract_options(options_string)
         context['view_option'] = view_option
@@ -347,62 +437,55 @@ class CandidateFilmsView(UserPassesTestMixin, generic.TemplateView):
         else:
             context['view_option_tag'] = _("All")
         if order_option == '&order=date_proposed':
-            context['order_option_string'] = "film.created_datetime"
             context['order_option_tag'] = _("Proposed on")
         elif order_option == '&order=year':
-            context['order_option_string'] = "film.db.year"
             context['order_option_tag'] = _("Year")
         elif order_option == '&order=duration':
-            context['order_option_string'] = "duration"
             context['order_option_tag'] = _("Duration")
         elif order_option == '&order=user_vote':
-            context['order_option_string'] = "vote_points"
             context['order_option_tag'] = _("My vote")
         else:
-            context['order_option_string'] = "film.db.title"
             context['order_option_tag'] = _("Title")
         if display_option == '&display=list':
             context['display_option_tag'] = _("List")
         else:
             context['display_option_tag'] = _("Posters")
-        candidate_films = []
-        for film in club_films:
-            film_voters = [vote.user.username for vote in film.vote_set.all()]
-            if self.request.user.username in film_voters:
-                if not view_option or view_option == '&view=only_voted':
-                    user_vote = get_object_or_404(Vote, user=self.request.user, film=film)
-                    candidate_films.append({
-                        'film': film,
-                        'voted': True,
-                        'vote_points': - user_vote.vote_score,
-                        'duration': film.db.duration_in_mins_int,
-                        'vote': user_vote.vote_karma,
-                    })
-            elif view_option != '&view=only_voted':
-                candidate_films.append({
-                    'film': film,
-                    'voted': False,
-                    'vote_points': -2.5,
-                    'duration': film.db.duration_in_mins_int,
-                    'vote': False,
-                })
-        context['candidate_films'] = candidate_films
+        order_fields = self.order_fields.get(order_option, self.order_fields[''])
+        paginator = KeysetPaginator(self.get_candidate_films(club, view_option), order_fields, self.page_size)
+        context['candidate_films'], next_cursor = paginator.get_page(extract_cursor(options_string))
+        if next_cursor:
+            next_options_string = view_option + order_option + display_option + fill_options_string(cursor=next_cursor)
+            context['next_page_url'] = reverse('democracy:candidate_films', kwargs={'club_id': club.id, 'options_string': next_options_string})
+        else:
+            context['next_page_url'] = None
         return context
 
 
 @method_decorator(login_required, name='dispatch')
-class SeenFilmsView(UserPassesTestMixin, generic.TemplateView):
+class SeenFilmsView(FilmsPageMixin, UserPassesTestMixin, generic.TemplateView):
+    page_template_name = 'democracy/seen_films_page.html'
+    order_fields = ['seen_sort_date', 'id']
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page'] = 'seen_films'
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         context['club'] = club
-        seen_films = Film.objects.filter(club=club, seen=True)
-        context['seen_films'] = seen_films
+        options_string = self.kwargs.get('options_string')
+        # Films without seen date come first, as they did when sorting them in the template
+        seen_films = Film.objects.filter(club=club, seen=True).select_related('db').annotate(
+            seen_sort_date=Coalesce('seen_date', Value(date.min, output_field=DateField())),
+        )
+        paginator = KeysetPaginator(seen_films, self.order_fields, self.page_size)
+        context['seen_films'], next_cursor = paginator.get_page(extract_cursor(options_string))
+        if next_cursor:
+            next_options_string = fill_options_string(cursor=next_cursor)
+            context['next_page_url'] = reverse('democracy:seen_films', kwargs={'club_id': club.id, 'options_string': next_options_string})
+        else:
+            context['next_page_url'] = None
         return context
 
 
@@ -482,10 +565,10 @@ class AddNewFilmView(UserPassesTestMixin, generic.FormView):
     new_film_public_id = None
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_success_url(self):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         if self.films_added_counter == 1:
             film = get_object_or_404(Film, club=club, public_id=self.new_film_public_id)
             return reverse('democracy:film_detail', kwargs={'club_id': club.id,
@@ -498,23 +581,18 @@ class AddNewFilmView(UserPassesTestMixin, generic.FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         context['club'] = club
         return context
 
     @staticmethod
     def create_notifications(user, club, film):
         club_members = club.members.filter(is_active=True).exclude(id=user.id)
-        for member in club_members:
-            Notification.objects.create(type=Notification.ADDED_FILM,
-                                        activator=user,
-                                        club=club,
-                                        object_id=film.id,
-                                        recipient=member)
+        bulk_create_notifications(Notification.ADDED_FILM, club_members, activator=user, club=club, object_id=film.id)
 
     def form_valid(self, form):
         user = self.request.user
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         filmdbs = form.cleaned_data['filmdbs']
 
         for filmdb in filmdbs:
@@ -523,10 +601,9 @@ class AddNewFilmView(UserPassesTestMixin, generic.FormView):
                 message_warning = '%s %s' % (_('This film is already in the candidate list:'), f'{film[0].db.title}')
                 messages.warning(self.request, message_warning)
             else:
-                film = Film.objects.create(
-                    public_id=random_film_public_id_generator(club),
+                film = create_film_with_random_public_id(
+                    club,
                     proposed_by=user,
-                    club=club,
                     db=filmdb,
                 )
                 self.films_added_counter += 1
@@ -534,6 +611,8 @@ class AddNewFilmView(UserPassesTestMixin, generic.FormView):
                 self.new_film_public_id = film.public_id
 
         if self.films_added_counter >= 1:
+            RankingCache.invalidate(club.id)
+            MemberLeaderboard.invalidate(club.id)
             if self.films_added_counter == 1:
                 messages.success(self.request, _('New film added! Be the first to vote it!'))
             elif self.films_added_counter > 1:
@@ -543,6 +622,31 @@ class AddNewFilmView(UserPassesTestMixin, generic.FormView):
 
 
 class NewFilmAutocompleteView(autocomplete.Select2QuerySetView):
+    paginate_by = 10
+    max_pages = 5
+    max_query_length = 100
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+        self.q = self.q[0:self.max_query_length]
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            raise Http404
+        if page > self.max_pages:
+            return JsonResponse({'results': [], 'pagination': {'more': False}})
+        response_data = AutocompleteCache.get_response_data(self.q, page)
+        if response_data is None:
+            super().get(request, *args, **kwargs)
+            response_data = self.response_data
+            AutocompleteCache.set_response_data(self.q, page, response_data)
+        return JsonResponse(response_data)
+
+    def render_to_response(self, context):
+        more = self.has_more(context) and context['page_obj'].number < self.max_pages
+        self.response_data = {'results': self.get_results(context), 'pagination': {'more': more}}
+        return JsonResponse(self.response_data)
 
     def get_result_label(self, item):
         return format_html(
@@ -559,10 +663,9 @@ class NewFilmAutocompleteView(autocomplete.Select2QuerySetView):
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return FilmDb.objects.none()
-        qs = FilmDb.objects.all()
-        if self.q:
-            qs = qs.filter(title__icontains=self.q)
-        return qs
+        if AutocompleteCache.is_short_query(self.q):
+            return AutocompleteCache.get_popular_matches(self.q)
+        return search_filmdbs_indexed(self.q)
 
 
 @method_decorator(login_required, name='dispatch')
@@ -570,15 +673,15 @@ class RankingGeneratorView(UserPassesTestMixin, generic.TemplateView):
     range_step = 10
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page'] = 'ranking_generator'
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_films = Film.objects.filter(club=club, seen=False)
         context['range_step'] = self.range_step
-        max_film_duration = max([film.db.duration_in_mins_int for film in club_films]) if club_films else None
+        max_film_duration = club_films.aggregate(Max('db__duration_mins'))['db__duration_mins__max']
         context['max_film_duration'] = max_film_duration + (self.range_step - max_film_duration % 10) if max_film_duration else 990
         return context
 
@@ -587,12 +690,12 @@ class RankingGeneratorView(UserPassesTestMixin, generic.TemplateView):
 class RankingResultsView(UserPassesTestMixin, generic.TemplateView):
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page'] = 'ranking_results'
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         context['club'] = club
         ranking_generator = RankingGenerator(self.request, club.id)
         ranking_results, participants = ranking_generator.generate_ranking()
@@ -610,7 +713,7 @@ class InviteNewMemberView(UserPassesTestMixin, generic.FormView):
     html_email_template = 'democracy/emails/invite_new_member_email_html.html'
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     @method_decorator(csrf_protect)
     def dispatch(self, *args, **kwargs):
@@ -623,18 +726,11 @@ class InviteNewMemberView(UserPassesTestMixin, generic.FormView):
 
     @staticmethod
     def create_notifications(user, club, email, invitation):
-        try:
-            invited_user = User.objects.get(email=email)
-            Notification.objects.create(type=Notification.INVITED,
-                                        activator=user,
-                                        object_id=invitation.id,
-                                        club=club,
-                                        recipient=invited_user)
-        except User.DoesNotExist:
-            pass
+        invited_users = User.objects.filter(email=email)
+        bulk_create_notifications(Notification.INVITED, invited_users, activator=user, club=club, object_id=invitation.id)
 
     def form_valid(self, form):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_members = club.members.filter(is_active=True)
         email = form.cleaned_data["email"]
         for club_member in club_members:
@@ -651,7 +747,7 @@ class InviteNewMemberView(UserPassesTestMixin, generic.FormView):
             email_context = {'invitation': invitation}
             to_emails_list = [email]
             spam_helper = SpamHelper(self.request, self.subject_template, self.email_template, self.html_email_template)
-            spam_helper.send_emails(to_emails_list, email_context)
+            spam_helper.queue_emails(to_emails_list, email_context)
         messages.success(self.request, _('An invitation has been sent to: ') + form.cleaned_data['email'])
         return super().form_valid(form)
 
@@ -660,7 +756,7 @@ class InviteNewMemberView(UserPassesTestMixin, generic.FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         context['club'] = club
         return context
 
@@ -702,12 +798,7 @@ class InviteNewMemberConfirmView(generic.FormView):
     @staticmethod
     def create_notifications(user, club):
         club_members = club.members.filter(is_active=True)
-        for member in club_members:
-            Notification.objects.create(type=Notification.JOINED,
-                                        activator=user,
-                                        club=club,
-                                        object_id=user.id,
-                                        recipient=member)
+        bulk_create_notifications(Notification.JOINED, club_members, activator=user, club=club, object_id=user.id)
 
     def form_valid(self, form):
         user = self.request.user
@@ -717,6 +808,7 @@ class InviteNewMemberConfirmView(generic.FormView):
             if form.cleaned_data['response_choice'] == 'accept':
                 self.accepted = True
                 club.members.add(self.request.user)
+                MemberLeaderboard.invalidate(club.id)
                 club.save()
                 ClubMemberInfo.objects.create(club=club, member=user)
                 self.create_notifications(user, club)
@@ -1,8 +1,9 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.http import HttpResponseRedirect, HttpResponseForbidden
+from django.http import HttpResponseRedirect, HttpResponseForbidden, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
@@ -10,10 +11,14 @@ from django.views import generic
 
 from filmdemocracy.democracy import forms
 from filmdemocracy.core.models import Notification
-from filmdemocracy.democracy.models import FilmDb, Film, Vote, FilmComment, Club
+from filmdemocracy.democracy.models import FilmDb, Film, FilmVoteTally, Vote, FilmComment
 
 from filmdemocracy.core.utils import user_is_club_member_check, user_is_club_admin_check
+from filmdemocracy.core.utils import get_request_club
 from filmdemocracy.core.utils import extract_options
+from filmdemocracy.core.utils import build_notifications, save_notifications, bulk_create_notifications
+from filmdemocracy.democracy.ranking import RankingCache, update_film_vote_tally
+from filmdemocracy.democracy.stats import MemberLeaderboard
 
 
 @method_decorator(login_required, name='dispatch')
@@ -34,11 +39,11 @@ class FilmDetailView(UserPassesTestMixin, generic.TemplateView):
         return vote_karma_dict[vote_choice]
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         film = get_object_or_404(Film, club=club, public_id=self.kwargs['film_public_id'])
         context['page'] = 'film_detail'
         options_string = self.kwargs['options_string'] if 'options_string' in self.kwargs and self.kwargs['options_string'] else None
@@ -51,6 +56,7 @@ class FilmDetailView(UserPassesTestMixin, generic.TemplateView):
         context['film_duration'] = film.db.duration_str
         film_comments = FilmComment.objects.filter(club=club.id, film=film)
         context['film_comments'] = film_comments.order_by('created_datetime')
+        context['film_vote_tally'] = FilmVoteTally.objects.filter(film=film).first()
         choice_dict = {}
         for choice in Vote.vote_choices:
             choice_dict[choice[0]] = {
@@ -74,10 +80,10 @@ class FilmSeenView(UserPassesTestMixin, generic.FormView):
     form_class = forms.FilmSeenForm
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_success_url(self):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         film = get_object_or_404(Film, club=club, public_id=self.kwargs['film_public_id'])
         return reverse('democracy:film_detail', kwargs={'club_id': club.id,
                                                         'film_public_id': film.public_id,
@@ -93,15 +99,10 @@ class FilmSeenView(UserPassesTestMixin, generic.FormView):
     @staticmethod
     def create_notifications(_user, _club, _film):
         club_members = _club.members.filter(is_active=True).exclude(id=_user.id)
-        for member in club_members:
-            Notification.objects.create(type=Notification.SEEN_FILM,
-                                        activator=_user,
-                                        club=_club,
-                                        recipient=member,
-                                        object_id=_film.id)
+        bulk_create_notifications(Notification.SEEN_FILM, club_members, activator=_user, club=_club, object_id=_film.id)
 
     def form_valid(self, form):
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         film = get_object_or_404(Film, club=club, public_id=self.kwargs['film_public_id'])
         film.seen_date = form.cleaned_data['seen_date']
         members = form.cleaned_data['members']
@@ -110,13 +111,15 @@ class FilmSeenView(UserPassesTestMixin, generic.FormView):
         film.seen = True
         film.marked_seen_by = self.request.user
         film.save()
+        RankingCache.invalidate(club.id)
+        MemberLeaderboard.invalidate(club.id)
         self.create_notifications(self.request.user, club, film)
         messages.success(self.request, _('Film marked as seen.'))
         return super().form_valid(form)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         film = get_object_or_404(Film, club=club, public_id=self.kwargs['film_public_id'])
         context['film'] = film
         return context
@@ -124,13 +127,20 @@ class FilmSeenView(UserPassesTestMixin, generic.FormView):
 
 @login_required
 def vote_film(request, club_id, film_public_id, options_string):
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_member_check(request.user, club=club):
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
         return HttpResponseForbidden()
     film = get_object_or_404(Film, club=club, public_id=film_public_id)
-    user_vote, tmp = Vote.objects.get_or_create(user=request.user, film=film, club=club)
-    user_vote.choice = request.POST['choice']
-    user_vote.save()
+    if request.POST.get('choice') not in dict(Vote.vote_choices):
+        return HttpResponseBadRequest()
+    with transaction.atomic():
+        user_vote, tmp = Vote.objects.select_for_update().get_or_create(user=request.user, film=film, club=club)
+        old_choice = user_vote.choice
+        user_vote.choice = request.POST['choice']
+        user_vote.save()
+        update_film_vote_tally(film, old_choice=old_choice, new_choice=user_vote.choice)
+    RankingCache.touch_film(club.id, film.id)
+    MemberLeaderboard.invalidate(club.id)
     return HttpResponseRedirect(reverse('democracy:film_detail', kwargs={'club_id': club.id,
                                                                          'film_public_id': film.public_id,
                                                                          'film_slug': film.db.slug,
@@ -139,12 +149,16 @@ def vote_film(request, club_id, film_public_id, options_string):
 
 @login_required
 def delete_vote(request, club_id, film_public_id, options_string):
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_member_check(request.user, club=club):
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
         return HttpResponseForbidden()
     film = get_object_or_404(Film, club=club, public_id=film_public_id)
-    vote = get_object_or_404(Vote, user=request.user, film=film, club=club)
-    vote.delete()
+    with transaction.atomic():
+        vote = get_object_or_404(Vote.objects.select_for_update(), user=request.user, film=film, club=club)
+        vote.delete()
+        update_film_vote_tally(film, old_choice=vote.choice)
+    RankingCache.touch_film(club.id, film.id)
+    MemberLeaderboard.invalidate(club.id)
     return HttpResponseRedirect(reverse('democracy:film_detail', kwargs={'club_id': club.id,
                                                                          'film_public_id': film.public_id,
                                                                          'film_slug': film.db.slug,
@@ -155,34 +169,30 @@ def delete_vote(request, club_id, film_public_id, options_string):
 def comment_film(request, club_id, film_public_id, options_string):
 
     def create_notifications(_user, _club, _film):
-        proposer = _film.proposed_by
-        film_commenters = [fc.user for fc in FilmComment.objects.filter(film=_film, deleted=False)]
+        proposer_id = _film.proposed_by_id
+        film_commenters_ids = FilmComment.objects.filter(film=_film, deleted=False).values_list('user_id', flat=True)
+        notifications = []
 
         # Notification to film proposer:
-        if _user != proposer:
-            Notification.objects.create(type=Notification.COMM_FILM,
-                                        activator=_user,
-                                        club=_club,
-                                        object_id=_film.id,
-                                        recipient=proposer)
+        if proposer_id is not None and _user.id != proposer_id:
+            notifications += build_notifications(Notification.COMM_FILM, [proposer_id],
+                                                 activator=_user, club=_club, object_id=_film.id)
 
         # Notifications to people that commented on that film before (film_commenters):
-        for commenter in film_commenters:
-            if commenter != proposer and commenter != _user:
-                Notification.objects.create(type=Notification.COMM_COMM,
-                                            activator=_user,
-                                            club=_club,
-                                            recipient=commenter,
-                                            object_id=_film.id)
-
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_member_check(request.user, club=club):
+        commenters_ids = set(film_commenters_ids) - {proposer_id, _user.id}
+        notifications += build_notifications(Notification.COMM_COMM, commenters_ids,
+                                             activator=_user, club=_club, object_id=_film.id)
+        save_notifications(notifications)
+
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
         return HttpResponseForbidden()
     film = get_object_or_404(Film, club=club, public_id=film_public_id)
     comment_text = request.POST['text']
     if not comment_text == '':
         film_comment = FilmComment.objects.create(user=request.user, film=film, club=club, text=comment_text)
         film_comment.save()
+        MemberLeaderboard.invalidate(club.id)
         create_notifications(request.user, club, film)
     return HttpResponseRedirect(reverse('democracy:film_detail', kwargs={'club_id': club.id,
                                                                          'film_public_id': film.public_id,
@@ -192,14 +202,15 @@ def comment_film(request, club_id, film_public_id, options_string):
 
 @login_required
 def delete_film_comment(request, club_id, film_public_id, comment_id, options_string):
-    club = get_object_or_404(Club, id=club_id)
+    club = get_request_club(request, club_id)
     film = get_object_or_404(Film, club=club, public_id=film_public_id)
     film_comment = get_object_or_404(FilmComment, id=comment_id)
     if request.user != film_comment.user:
-        if not user_is_club_admin_check(request.user, club=club):
+        if not user_is_club_admin_check(request, club=club):
             return HttpResponseForbidden()
     film_comment.deleted = True
     film_comment.save()
+    MemberLeaderboard.invalidate(club.id)
     return HttpResponseRedirect(reverse('democracy:film_detail', kwargs={'club_id': club.id,
                                                                          'film_public_id': film.public_id,
                                                                          'film_slug': film.db.slug,
@@ -208,8 +219,8 @@ def delete_film_comment(request, club_id, film_public_id, comment_id, options_st
 
 @login_required
 def add_filmaffinity_url(request, club_id, film_public_id, options_string):
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_member_check(request.user, club=club):
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
         return HttpResponseForbidden()
     film = get_object_or_404(Film, club=club, public_id=film_public_id)
     faff_url = request.POST.get('faff_url')
@@ -244,19 +255,21 @@ def add_filmaffinity_url(request, club_id, film_public_id, options_string):
 
 @login_required
 def delete_film(request, club_id, film_public_id, options_string):
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_member_check(request.user, club=club):
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
         return HttpResponseForbidden()
     film = get_object_or_404(Film, club=club, public_id=film_public_id)
     film.delete()
+    RankingCache.invalidate(club.id)
+    MemberLeaderboard.invalidate(club.id)
     return HttpResponseRedirect(reverse('democracy:candidate_films', kwargs={'club_id': club.id,
                                                                              'options_string': options_string}))
 
 
 @login_required
 def unsee_film(request, club_id, film_public_id, options_string):
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_admin_check(request.user, club=club):
+    club = get_request_club(request, club_id)
+    if not user_is_club_admin_check(request, club=club):
         return HttpResponseForbidden()
     film = get_object_or_404(Film, club=club, public_id=film_public_id)
     if Film.objects.filter(club=club_id, db=film.db, seen=False):
@@ -270,5 +283,7 @@ def unsee_film(request, club_id, film_public_id, options_string):
         film.seen_by.clear()
         film.seen_date = None
         film.save()
+        RankingCache.invalidate(club.id)
+        MemberLeaderboard.invalidate(club.id)
         return HttpResponseRedirect(reverse('democracy:candidate_films', kwargs={'club_id': club.id,
                                                                                  'options_string': options_string}))
\ No newline at end of file
@@ -11,10 +11,12 @@ from django.views import generic
 
 from filmdemocracy.democracy import forms
 from filmdemocracy.core.models import Notification
-from filmdemocracy.democracy.models import Club, Meeting
+from filmdemocracy.democracy.models import Meeting
 
 from filmdemocracy.core.utils import user_is_club_member_check, user_is_club_admin_check, user_is_organizer_check
-from filmdemocracy.core.utils import SpamHelper
+from filmdemocracy.core.utils import get_request_club
+from filmdemocracy.core.utils import SpamHelper, bulk_create_notifications
+from filmdemocracy.democracy.stats import MemberLeaderboard
 
 
 @method_decorator(login_required, name='dispatch')
@@ -25,14 +27,14 @@ class MeetingsNewView(UserPassesTestMixin, generic.FormView):
     html_email_template = 'democracy/emails/meetings_new_email_html.html'
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_success_url(self):
         return reverse_lazy('democracy:club_detail', kwargs={'club_id': self.kwargs['club_id']})
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         context['club'] = club
         context['new_meeting'] = True
         return context
@@ -40,16 +42,11 @@ class MeetingsNewView(UserPassesTestMixin, generic.FormView):
     @staticmethod
     def create_notifications(_user, _club, _meeting):
         club_members = _club.members.filter(is_active=True).exclude(id=_user.id)
-        for member in club_members:
-            Notification.objects.create(type=Notification.MEET_ORGAN,
-                                        activator=_user,
-                                        club=_club,
-                                        object_id=_meeting.id,
-                                        recipient=member)
+        bulk_create_notifications(Notification.MEET_ORGAN, club_members, activator=_user, club=_club, object_id=_meeting.id)
 
     def form_valid(self, form):
         user = self.request.user
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         new_meeting = Meeting.objects.create(
             club=club,
             name=form.cleaned_data['name'],
@@ -74,7 +71,8 @@ class MeetingsNewView(UserPassesTestMixin, generic.FormView):
             }
             spammable_members = club.members.filter(is_active=True)
             to_emails_list = [member.email for member in spammable_members]
-            spam_helper.send_emails(to_emails_list, email_context)
+            recipients_substitutions = spam_helper.get_members_substitutions(spammable_members)
+            spam_helper.queue_emails(to_emails_list, email_context, recipients_substitutions)
             messages.success(self.request, _('Meeting planned! A notification email has been sent to club members.'))
         else:
             messages.success(self.request, _('Meeting planned!'))
@@ -89,7 +87,7 @@ class MeetingsEditView(UserPassesTestMixin, generic.FormView):
     html_email_template = 'democracy/emails/meetings_edit_email_html.html'
 
     def test_func(self):
-        return user_is_organizer_check(self.request.user, club_id=self.kwargs['club_id'], meeting_id=self.kwargs['meeting_id'])
+        return user_is_organizer_check(self.request, club_id=self.kwargs['club_id'], meeting_id=self.kwargs['meeting_id'])
 
     def get_form_kwargs(self):
         kwargs = super(MeetingsEditView, self).get_form_kwargs()
@@ -101,7 +99,7 @@ class MeetingsEditView(UserPassesTestMixin, generic.FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['club'] = get_object_or_404(Club, id=self.kwargs['club_id'])
+        context['club'] = get_request_club(self.request, self.kwargs['club_id'])
         context['meeting'] = get_object_or_404(Meeting, id=self.kwargs['meeting_id'])
         context['new_meeting'] = False
         return context
@@ -109,12 +107,7 @@ class MeetingsEditView(UserPassesTestMixin, generic.FormView):
     @staticmethod
     def create_notifications(_user, _club, _meeting):
         meeting_members = _meeting.members_yes.all() | _meeting.members_maybe.all() | _meeting.members_no.all()
-        for member in meeting_members:
-            Notification.objects.create(type=Notification.MEET_EDIT,
-                                        activator=_user,
-                                        club=_club,
-                                        object_id=_meeting.id,
-                                        recipient=member)
+        bulk_create_notifications(Notification.MEET_EDIT, meeting_members, activator=_user, club=_club, object_id=_meeting.id)
 
     def form_valid(self, form):
         meeting = get_object_or_404(Meeting, id=self.kwargs['meeting_id'])
@@ -124,7 +117,7 @@ class MeetingsEditView(UserPassesTestMixin, generic.FormView):
         meeting.date = form.cleaned_data['date']
         meeting.time_start = form.cleaned_data['time_start']
         meeting.save()
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         self.create_notifications(self.request.user, club, meeting)
         spam_option = form.cleaned_data['spam_options']
         if spam_option == 'all' or spam_option == 'interested':
@@ -141,12 +134,14 @@ class MeetingsEditView(UserPassesTestMixin, generic.FormView):
             if spam_option == 'all':
                 spammable_members = club.members.filter(is_active=True)
                 to_emails_list = [member.email for member in spammable_members]
-                spam_helper.send_emails(to_emails_list, email_context)
+                recipients_substitutions = spam_helper.get_members_substitutions(spammable_members)
+                spam_helper.queue_emails(to_emails_list, email_context, recipients_substitutions)
                 messages.success(self.request, _('Meeting edited! A notification email has been sent to club members.'))
             else:
                 spammable_members = meeting.members_yes.all() | meeting.members_maybe.all() | meeting.members_no.all()
                 to_emails_list = [member.email for member in spammable_members]
-                spam_helper.send_emails(to_emails_list, email_context)
+                recipients_substitutions = spam_helper.get_members_substitutions(spammable_members)
+                spam_helper.queue_emails(to_emails_list, email_context, recipients_substitutions)
                 messages.success(self.request, _('Meeting edited! A notification email has been sent to members interested in it.'))
         else:
             messages.success(self.request, _('Meeting edited!'))
@@ -156,8 +151,8 @@ class MeetingsEditView(UserPassesTestMixin, generic.FormView):
 @login_required
 def meeting_assistance(request, club_id, meeting_id):
     user = request.user
-    club = get_object_or_404(Club, id=club_id)
-    if not user_is_club_member_check(user, club=club):
+    club = get_request_club(request, club_id)
+    if not user_is_club_member_check(request, club=club):
         return HttpResponseForbidden()
     meeting = get_object_or_404(Meeting, id=meeting_id)
     if 'assist_yes' in request.POST:
@@ -188,6 +183,7 @@ def meeting_assistance(request, club_id, meeting_id):
                 meeting.members_maybe.remove(user)
             meeting.members_no.add(user)
     meeting.save()
+    MemberLeaderboard.invalidate(club.id)
     return HttpResponseRedirect(reverse('democracy:club_detail', kwargs={'club_id': club_id}))
 
 
@@ -195,24 +191,19 @@ def meeting_assistance(request, club_id, meeting_id):
 def delete_meeting(request, club_id, meeting_id):
 
     def create_notifications(_user, _club, _meeting):
-        meeting_members_groups = [_meeting.members_yes.all(), _meeting.members_maybe.all(), _meeting.members_no.all()]
-        for member_group in meeting_members_groups:
-            for member in member_group:
-                if _user != member:
-                    Notification.objects.create(type=Notification.MEET_DEL,
-                                                activator=_user,
-                                                club=_club,
-                                                object_id=_meeting.id,
-                                                recipient=member)
-
-    club = get_object_or_404(Club, id=club_id)
-    organizer_check = user_is_organizer_check(request.user, club=club, meeting_id=meeting_id)
-    admin_check = user_is_club_admin_check(request.user, club=club)
+        meeting_members = _meeting.members_yes.all() | _meeting.members_maybe.all() | _meeting.members_no.all()
+        bulk_create_notifications(Notification.MEET_DEL, meeting_members.exclude(id=_user.id),
+                                  activator=_user, club=_club, object_id=_meeting.id)
+
+    club = get_request_club(request, club_id)
+    organizer_check = user_is_organizer_check(request, club=club, meeting_id=meeting_id)
+    admin_check = user_is_club_admin_check(request, club=club)
     if not organizer_check and not admin_check:
         return HttpResponseForbidden()
     meeting = get_object_or_404(Meeting, id=meeting_id)
     meeting.active = False
     meeting.save()
+    MemberLeaderboard.invalidate(club.id)
     create_notifications(request.user, club, meeting)
     return HttpResponseRedirect(reverse('democracy:club_detail', kwargs={'club_id': club.id}))
 
@@ -221,11 +212,11 @@ def delete_meeting(request, club_id, meeting_id):
 class MeetingsListView(UserPassesTestMixin, generic.TemplateView):
 
     def test_func(self):
-        return user_is_club_member_check(self.request.user, club_id=self.kwargs['club_id'])
+        return user_is_club_member_check(self.request, club_id=self.kwargs['club_id'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        club = get_object_or_404(Club, id=self.kwargs['club_id'])
+        club = get_request_club(self.request, self.kwargs['club_id'])
         club_meetings = Meeting.objects.filter(club=club, active=True, date__gte=timezone.now().date())
         context['club_meetings'] = club_meetings.order_by('date')[0:20]
         return context
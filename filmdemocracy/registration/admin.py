@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
+from filmdemocracy.democracy.ranking import RankingCache
 from filmdemocracy.registration import forms
 from filmdemocracy.registration.models import User
 
@@ -12,4 +13,13 @@ class CustomUserAdmin(UserAdmin):
     list_display = ['email', 'username',]
 
 
-admin.site.register(User, UserAdmin)
+class RankingCacheUserAdmin(UserAdmin):
+    """ Usernames are only edited from here, and the cached club rankings show them """
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change:
+            RankingCache.invalidate_member(obj.id)
+
+
+admin.site.register(User, RankingCacheUserAdmin)
@@ -9,6 +9,10 @@ from django.views import generic
 
 from filmdemocracy.registration import forms
 from filmdemocracy.core.models import Notification
+from filmdemocracy.core.utils import bulk_create_notifications
+from filmdemocracy.democracy.ranking import RankingCache, rebuild_film_vote_tally
+from filmdemocracy.democracy.stats import MemberLeaderboard
+from filmdemocracy.democracy.models import Film
 
 
 class SignUpView(generic.CreateView):
@@ -64,11 +68,7 @@ class DeleteAccountView(generic.FormView):
     @staticmethod
     def create_notifications(_user, _club):
         abandoned_members = _club.members.filter(is_active=True).exclude(id=_user.id)
-        for abandoned_member in abandoned_members:
-            Notification.objects.create(type=Notification.ABANDONED,
-                                        activator=None,
-                                        club=_club,
-                                        recipient=abandoned_member)
+        bulk_create_notifications(Notification.ABANDONED, abandoned_members, activator=None, club=_club)
 
     def get_success_url(self):
         return reverse_lazy('core:home')
@@ -77,6 +77,8 @@ class DeleteAccountView(generic.FormView):
         user = self.request.user
         user_clubs = user.club_set.all()
         for club in user_clubs:
+            RankingCache.invalidate(club.id)
+            MemberLeaderboard.invalidate(club.id)
             club_members = club.members.filter(is_active=True)
             club_admins = club.admin_members.filter(is_active=True)
             if len(club_members) == 1:
@@ -86,7 +88,10 @@ class DeleteAccountView(generic.FormView):
                     club.admin_members.add(member)
                 club.save()
                 self.create_notifications(user, club)
+        voted_films = list(Film.objects.filter(vote__user=user))
         user.delete()
+        for film in voted_films:
+            rebuild_film_vote_tally(film)
         messages.success(self.request, _("Account deleted successfully."))
         return super().form_valid(form)
 
@@ -98,3 +103,8 @@ class AccountInfoView(generic.UpdateView):
 
     def get_object(self, queryset=None):
         return self.request.user
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        RankingCache.invalidate_member(self.request.user.id)
+        return response
@@ -100,6 +100,10 @@ DATABASES = {
     }
 }
 
+# Trigram lookups of the films search (see create_search_indexes)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    INSTALLED_APPS.append('django.contrib.postgres')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -164,6 +168,33 @@ LOGIN_REDIRECT_URL = 'core:home'
 LOGOUT_REDIRECT_URL = 'core:home'
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'filmdemocracy',
+    }
+}
+
+
+# OMDb API client
+# http://www.omdbapi.com/
+
+OMDB_API_URL = 'http://www.omdbapi.com/'
+OMDB_CACHE_DIR = os.path.join(BASE_DIR, 'local/omdb_cache')
+OMDB_CACHE_TTL = 60 * 60 * 24 * 7
+OMDB_REQUESTS_PER_SECOND = 10
+
+
+# In-process films search index for the autocomplete (see core.search.FilmSearchIndex)
+
+FILM_SEARCH_INDEX_ENABLED = False
+FILM_SEARCH_INDEX_SNAPSHOT = os.path.join(BASE_DIR, 'local/film_search_index.json.gz')
+FILM_SEARCH_INDEX_REFRESH_SECS = 60
+
+
 # Dev email backend
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
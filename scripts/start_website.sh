@@ -17,7 +17,10 @@ for WEB_APP in "${WEB_APPS[@]}"; do
   python manage.py makemigrations ${WEB_APP}
 done
 
+python manage.py dedupe_film_public_ids
 python manage.py migrate
+python manage.py create_search_indexes
+python manage.py backfill_films_durations
 
 cd ${APPS_DIR} || exit
 django-admin compilemessages
@@ -25,6 +28,9 @@ django-admin compilemessages
 cd ${WORKDIR}/.. || exit
 python manage.py feed_db_with_films --test
 python manage.py create_mock_db
+python manage.py rebuild_vote_tallies
+python manage.py build_film_search_snapshot
+python manage.py send_queued_emails --loop &
 python manage.py runserver 0.0.0.0:8000
 
 exit 0